@@ -1,19 +1,30 @@
 # agent_controller.py
 
 import logging
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from config import settings
-from llm_client import generate_content
+from llm_client import generate_content, stream_content, ToolRegistry, RouteDecision, model_router
 from audit import log_interaction
-from pydantic import BaseModel, ValidationError
+import agent_planner
+import fast_path
+import session_memory
+from pydantic import BaseModel, Field, ValidationError
+from utils.cache import make_cache
 from utils.circuit_breaker import CircuitBreaker
+from utils.lazy import LazyCallable
+from utils import deadline
+from tools import rag_prefetch
 
-# --- IMPORTANT: CORRECTED IMPORTS FOR TOOLS ---
-# These imports assume the files are located in the 'tools/' subdirectory.
-from tools.currency_tool import get_exchange_rate
-from tools.finance_rag import generate_rag_answer
-from tools.registry_check import verify_company_registry
-# from audit import log_interaction # Placeholder import
+# Tool implementations live in the 'tools/' subdirectory. They are imported on first call
+# so that importing the agent (and the API server) does not pull in provider SDKs or the vector DB.
+get_exchange_rate = LazyCallable('tools.currency_tool', 'get_exchange_rate')
+get_historical_exchange_rate = LazyCallable('tools.rate_history', 'get_historical_exchange_rate')
+generate_rag_answer = LazyCallable('tools.finance_rag', 'generate_rag_answer')
+verify_company_registry = LazyCallable('tools.registry_check', 'verify_company_registry')
+verify_companies = LazyCallable('tools.registry_check', 'verify_companies')
 
 logger = logging.getLogger(__name__)
 
@@ -22,39 +33,82 @@ logger = logging.getLogger(__name__)
 # Define the available tools (must match the function names imported)
 tools = {
     "get_exchange_rate": get_exchange_rate,
+    "get_historical_exchange_rate": get_historical_exchange_rate,
     "generate_rag_answer": generate_rag_answer,
-    "verify_company_registry": verify_company_registry
+    "verify_company_registry": verify_company_registry,
+    "verify_companies": verify_companies
 }
 
 # Circuit breaker for tools
-tool_cb = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+tool_cb = CircuitBreaker(failure_threshold=3, reset_timeout=60,
+                         backend=make_cache('circuit_breaker:tools', maxsize=1024, ttl=60))
 
 # Simple arg validation schemas for tools. Keys map to tool name -> {required: set(keys), types: {key: type}}
 class GetExchangeRateArgs(BaseModel):
-    source_currency: str
-    target_currency: str
+    source_currency: str = Field(description="ISO 4217 code of the currency to convert from, e.g. USD")
+    target_currency: str = Field(description="ISO 4217 code of the currency to convert to, e.g. EUR")
+
+
+class GetHistoricalExchangeRateArgs(BaseModel):
+    source_currency: str = Field(description="ISO 4217 code of the currency to convert from, e.g. USD")
+    target_currency: str = Field(description="ISO 4217 code of the currency to convert to, e.g. EUR")
+    date: str = Field(pattern=r"^\d{4}-\d{2}-\d{2}$", description="Day of the rate, or first day of the period (YYYY-MM-DD)")
+    end_date: Optional[str] = Field(default=None, pattern=r"^\d{4}-\d{2}-\d{2}$",
+                                    description="Last day of the period (YYYY-MM-DD) to get the average rate over it")
 
 
 class GenerateRagArgs(BaseModel):
-    user_query: str
+    user_query: str = Field(description="Question to answer from the indexed financial documents")
 
 
 class VerifyCompanyRegistryArgs(BaseModel):
-    company_name: str
+    company_name: str = Field(description="Legal or common name of the company to look up")
+
+
+class VerifyCompaniesArgs(BaseModel):
+    company_names: List[str] = Field(min_length=1, max_length=settings.REGISTRY_BULK_MAX_NAMES,
+                                     description="Names of all companies to look up, e.g. a portfolio's counterparties")
 
 
 TOOL_ARG_MODELS = {
     "get_exchange_rate": GetExchangeRateArgs,
+    "get_historical_exchange_rate": GetHistoricalExchangeRateArgs,
     "generate_rag_answer": GenerateRagArgs,
     "verify_company_registry": VerifyCompanyRegistryArgs,
+    "verify_companies": VerifyCompaniesArgs,
 }
 
+TOOL_DESCRIPTIONS = {
+    "get_exchange_rate": "Get the latest exchange rate between two currencies.",
+    "get_historical_exchange_rate": "Get the exchange rate between two currencies on a past date, or its average over a period (e.g. a quarter).",
+    "generate_rag_answer": "Answer a question from proprietary financial documents (reports, filings, transcripts) with citations.",
+    "verify_company_registry": "Verify a company's registration status and details in the company registry.",
+    "verify_companies": "Verify the registration status of many companies at once (use instead of repeated single lookups).",
+}
+
+# Tool manifest compiled once here and sent to the LLM on every tool-decision call
+tool_registry = ToolRegistry()
+for _name, _func in tools.items():
+    tool_registry.register(_name, _func, TOOL_ARG_MODELS.get(_name), TOOL_DESCRIPTIONS.get(_name))
+
+
+def register_tool(name: str, func, arg_model: type[BaseModel], description: str):
+    """Make a tool callable by the agent: executable, validated and described to the LLM."""
+    tools[name] = func
+    TOOL_ARG_MODELS[name] = arg_model
+    TOOL_DESCRIPTIONS[name] = description
+    tool_registry.register(name, func, arg_model, description)
+
 
 TOOL_ARG_SCHEMAS = {
     "get_exchange_rate": {
         "required": {"source_currency", "target_currency"},
         "types": {"source_currency": str, "target_currency": str}
     },
+    "get_historical_exchange_rate": {
+        "required": {"source_currency", "target_currency", "date"},
+        "types": {"source_currency": str, "target_currency": str, "date": str, "end_date": str}
+    },
     "generate_rag_answer": {
         "required": {"user_query"},
         "types": {"user_query": str}
@@ -62,6 +116,10 @@ TOOL_ARG_SCHEMAS = {
     "verify_company_registry": {
         "required": {"company_name"},
         "types": {"company_name": str}
+    },
+    "verify_companies": {
+        "required": {"company_names"},
+        "types": {"company_names": list}
     }
 }
 
@@ -102,17 +160,283 @@ def validate_tool_args(tool_name: str, args: dict) -> tuple[bool, str, Optional[
 
     return True, "", args
 
-def process_query_with_agent(user_query: str) -> dict:
+def _unpack_call(call) -> tuple:
+    """Return (tool_name, args) for a dict call (Groq JSON) or an object call (Gemini SDK)."""
+    if isinstance(call, dict):
+        return call.get('tool') or call.get('name'), dict(call.get('args') or {})
+    tool_name = getattr(call, 'name', None)
+    try:
+        tool_args = dict(getattr(call, 'args', {}))
+    except Exception:
+        tool_args = {}
+    return tool_name, tool_args
+
+
+def _run_tool_call(call, user_query: str) -> Optional[tuple]:
+    """Validate and execute one tool call requested by the model.
+
+    Returns (tool_name, result, error) where error is None on success, or None when
+    the model asked for a tool that is not registered.
+    """
+    tool_name, tool_args = _unpack_call(call)
+
+    function_to_call = tools.get(tool_name)
+    if not function_to_call:
+        return None
+
+    # Check circuit breaker for tool
+    if tool_cb.is_open(tool_name):
+        logger.warning("Skipping tool %s because its circuit breaker is open", tool_name)
+        return tool_name, {"error": "Circuit breaker open"}, "Circuit breaker open"
+
+    # Validate args before execution
+    is_valid, err, validated_args = validate_tool_args(tool_name, tool_args)
+    if not is_valid:
+        logger.warning("Tool args invalid for %s: %s", tool_name, err)
+        return tool_name, {"error": f"Invalid args: {err}"}, err
+
+    # A follow-up repeating an earlier call of the conversation reuses its result while fresh
+    reused = session_memory.reuse_tool_result(tool_name, validated_args)
+    if reused is not session_memory.MISSING:
+        logger.debug("Reusing %s result from earlier in the session", tool_name)
+        try:
+            log_interaction("TOOL_CALL", user_query, {"tool": tool_name, "args": validated_args, "result": reused,
+                                                      "reused": True})
+        except Exception:
+            logger.exception("Failed to log tool execution for %s", tool_name)
+        return tool_name, reused, None
+
+    if deadline.expired():
+        logger.warning("Skipping tool %s: request deadline exceeded", tool_name)
+        return tool_name, {"error": "Request deadline exceeded"}, "Request deadline exceeded"
+
+    logger.debug("Executing tool %s with args %s", tool_name, tool_args)
+    try:
+        result = function_to_call(**validated_args)
+    except Exception as e:
+        logger.exception("Tool execution %s failed: %s", tool_name, e)
+        err_result = {"error": str(e)}
+        try:
+            log_interaction("TOOL_CALL", user_query, {"tool": tool_name, "args": validated_args, "result": err_result})
+        except Exception:
+            logger.exception("Failed to log tool execution for %s", tool_name)
+        return tool_name, err_result, err_result['error']
+
+    try:
+        log_interaction("TOOL_CALL", user_query, {"tool": tool_name, "args": validated_args, "result": result})
+    except Exception:
+        logger.exception("Failed to log tool execution for %s", tool_name)
+    session_memory.record_tool_result(tool_name, validated_args, result)
+    return tool_name, result, None
+
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=settings.AGENT_TOOL_WORKERS, thread_name_prefix="agent-tool")
+    return _tool_executor
+
+
+def _routed_generate(decision: RouteDecision, prompt: str, tools=None):
+    """generate_content on the routed model, recording the call latency for the route."""
+    start = time.monotonic()
+    try:
+        return generate_content(prompt, model=decision.model, tools=tools)
+    finally:
+        model_router.record(decision, time.monotonic() - start)
+
+
+def _tool_decision_problem(response) -> Optional[str]:
+    """Why a tool-decision reply is unusable (empty, unknown tool, invalid args), or None if it is fine."""
+    calls = getattr(response, 'function_calls', None) or []
+    if not calls and not (getattr(response, 'text', '') or '').strip():
+        return "empty response"
+    for call in calls:
+        tool_name, tool_args = _unpack_call(call)
+        if tool_name not in tools:
+            return f"unknown tool '{tool_name}'"
+        is_valid, err, _ = validate_tool_args(tool_name, tool_args)
+        if not is_valid:
+            return f"invalid args for {tool_name}"
+    return None
+
+
+def _decide_and_run_tools(user_query: str, prompt: Optional[str] = None):
+    """First LLM call plus execution of the requested tools; returns (response, outcomes).
+
+    ``prompt`` is what the model sees (the query with conversation history); defaults to ``user_query``.
+    """
+    prompt = prompt or user_query
+    # Retrieval for RAG-looking questions starts now and is handed to generate_rag_answer if the model picks it
+    with rag_prefetch.speculate(user_query):
+        decision = model_router.route('tool_decision', user_query)
+        if not settings.AGENT_STREAM_TOOL_CALLS:
+            # Use LLM provider wrapper; provider might be Groq, Gemini, etc.
+            # Provide tools to the LLM so that Groq-style providers can be instructed
+            response = _routed_generate(decision, prompt, tools=tool_registry)
+            problem = _tool_decision_problem(response) if decision.route == 'fast' else None
+            if problem:
+                response = _routed_generate(model_router.escalate(decision, problem), prompt, tools=tool_registry)
+            outcomes = [_run_tool_call(call, user_query) for call in (getattr(response, 'function_calls', None) or [])]
+            return response, outcomes
+
+        # Streaming: each tool call starts executing as soon as the model has finished emitting it,
+        # overlapping tool latency with the rest of the generation.
+        executor = _get_tool_executor()
+        futures = []
+        # Tools already started from a streamed reply cannot be recalled, so only escalate on empty output.
+        response = stream_content(prompt, model=decision.model, tools=tool_registry,
+                                  on_tool_call=lambda call: futures.append(
+                                      executor.submit(deadline.run_in_context(_run_tool_call, call, user_query))))
+        if decision.route == 'fast' and not futures and not (getattr(response, 'text', '') or '').strip():
+            response = _routed_generate(model_router.escalate(decision, "empty response"), prompt, tools=tool_registry)
+            outcomes = [_run_tool_call(call, user_query) for call in (getattr(response, 'function_calls', None) or [])]
+            return response, outcomes
+        return response, [f.result() for f in futures]
+
+
+def _synthesize(user_query: str, outcomes: list, prompt: Optional[str] = None) -> dict:
+    """Final LLM call over the tool outcomes ((tool_name, result, error) tuples or None)."""
+    used_tools: list[str] = []
+    tool_errors: list[str] = []
+    # Build a simple, provider-agnostic string for final synthesis (one line per call; a planned
+    # question may call the same tool more than once)
+    tool_output_lines = []
+
+    for outcome in outcomes:
+        if outcome is None:
+            continue
+        tool_name, result, error = outcome
+        if tool_name not in used_tools:
+            used_tools.append(tool_name)
+        tool_output_lines.append(f"{tool_name}: {result}")
+        if error is not None:
+            tool_errors.append(f"{tool_name}: {error}")
+    tool_output_text = "\n".join(tool_output_lines)
+    combined_prompt = f"{prompt or user_query}\n\nTOOL_OUTPUTS:\n{tool_output_text}"
+    partial_answer = {
+        "final_answer": f"Partial answer (request deadline reached before synthesis):\n{tool_output_text}",
+        "used_tools": used_tools,
+        "tool_errors": tool_errors,
+        "partial": True
+    }
+    # Without enough budget left for another LLM round-trip, return the raw tool outputs
+    if not deadline.can_wait(settings.DEADLINE_SYNTHESIS_RESERVE_S):
+        return partial_answer
+    # Final LLM synthesis: use the configured provider again (supports Groq/Gemini)
+    try:
+        # Multi-tool or document (RAG) outputs need the large model; a single lookup does not
+        decision = model_router.route('synthesis', combined_prompt, tool_outputs=len(tool_output_lines),
+                                      document_outputs=int('generate_rag_answer' in used_tools))
+        final_response = _routed_generate(decision, combined_prompt)
+        if decision.route == 'fast' and not (getattr(final_response, 'text', '') or '').strip():
+            final_response = _routed_generate(model_router.escalate(decision, "empty answer"), combined_prompt)
+    except Exception:
+        if deadline.expired():
+            logger.warning("Request deadline reached during synthesis; returning tool outputs")
+            return partial_answer
+        raise
+
+    return {
+        "final_answer": getattr(final_response, 'text', str(final_response)),
+        "used_tools": used_tools,
+        "tool_errors": tool_errors,
+        "partial": False
+    }
+
+
+def _try_fast_path(user_query: str) -> Optional[dict]:
+    """Answer a pattern-matched single-tool query without the tool-decision LLM call.
+
+    Returns None when the query does not match (or names an unregistered tool), so the
+    caller takes the normal LLM path. A tool error or a result the template cannot
+    render still skips the decision call but goes through LLM synthesis.
+    """
+    match = fast_path.match_intent(user_query)
+    if match is None:
+        return None
+    outcome = _run_tool_call(match.as_call(), user_query)
+    if outcome is None:
+        return None
+    tool_name, result, error = outcome
+    answer = fast_path.render_answer(match, result) if error is None else None
+    if answer is None:
+        return _synthesize(user_query, [outcome])
+    logger.debug("Fast path answered %r with %s", user_query, tool_name)
+    return {"final_answer": answer, "used_tools": [tool_name], "tool_errors": [], "partial": False}
+
+
+def _try_plan(user_query: str, prompt: Optional[str] = None) -> Optional[dict]:
+    """Answer via a planned DAG of tool calls: one planning call, the scheduled tools, one synthesis.
+
+    Returns None when the model's plan is unusable or needs no tools, so the caller falls back
+    to the single-round path.
+    """
+    planning_prompt = agent_planner.planning_prompt(prompt or user_query, tool_registry.catalog())
+    response = _routed_generate(model_router.route('planning', planning_prompt), planning_prompt)
+    try:
+        plan = agent_planner.parse_plan(getattr(response, 'text', '') or '', tools)
+    except agent_planner.PlanError as e:
+        logger.warning("Unusable plan, falling back to a single tool round: %s", e)
+        return None
+    if not plan.steps:
+        return None
+    logger.debug("Executing a %d-step plan for %r", len(plan.steps), user_query)
+    outcomes = agent_planner.execute_plan(
+        plan, lambda tool, args: _run_tool_call({'tool': tool, 'args': args}, user_query), _get_tool_executor())
+    return _synthesize(user_query, outcomes, prompt)
+
+
+def process_query_with_agent(user_query: str, session_id: Optional[str] = None) -> dict:
     """
     The main Agent function that decides on tool usage and executes the final logic.
+
+    With a ``session_id`` the query is answered as part of that conversation (history in
+    the prompt, fresh earlier tool results reused) and the turn is stored; the result then
+    carries the ``session_id``. Turns of one session are answered one at a time (see
+    ``session_memory.locked``).
     """
+    if session_id is None:
+        return _process_query(user_query)
+    with session_memory.locked(session_id):
+        session = session_memory.load(session_id)
+        with session_memory.session_scope(session):
+            result = _process_query(user_query, session_memory.with_history(session, user_query))
+        session.add_turn(user_query, result.get("final_answer", ""), result.get("used_tools", []))
+        session_memory.save(session)
+    return {**result, "session_id": session.session_id}
+
+
+def _process_query(user_query: str, prompt: Optional[str] = None) -> dict:
     # No direct SDK client dependency here; use the provider-agnostic `generate_content` wrapper
 
-    # 1. Initial Call: Ask the LLM to decide on a tool
+    # 1. Initial Call: Ask the LLM to decide on a tool (and run the tools it asks for),
+    # unless the query matches a known single-tool pattern
     try:
-        # Use LLM provider wrapper; provider might be Groq, Gemini, etc.
-        # Provide tools to the LLM so that Groq-style providers can be instructed
-        response = generate_content(user_query, model=settings.RAG_MODEL, tools=tools)
+        if settings.AGENT_FAST_PATH_ENABLED:
+            fast_answer = _try_fast_path(user_query)
+            if fast_answer is not None:
+                return fast_answer
+        mode = settings.AGENT_PLANNING_MODE
+        if mode == 'always' or (mode == 'auto' and agent_planner.looks_multi_step(user_query)):
+            planned_answer = _try_plan(user_query, prompt)
+            if planned_answer is not None:
+                return planned_answer
+        response, outcomes = _decide_and_run_tools(user_query, prompt)
+    except deadline.DeadlineExceeded:
+        logger.warning("Request deadline reached during the tool decision for: %s", user_query)
+        return {
+            "final_answer": "The request deadline was reached before the agent could answer. Please retry.",
+            "used_tools": [],
+            "tool_errors": [],
+            "partial": True
+        }
     except Exception as e:
         # Replaces temporary debug print with a controlled return
         logger.exception("Agent execution error: %s", e)
@@ -122,86 +446,13 @@ def process_query_with_agent(user_query: str) -> dict:
 
     # 2. Check for Tool Calls
     if getattr(response, 'function_calls', None):
-        tool_results = {}
-        tool_errors: list[str] = []
-        used_tools: list[str] = []
-        
-        # Execute all tool calls requested by the model
-        for call in response.function_calls:
-            # Support multiple call formats: object with attributes (e.g., Gemini SDK) or dict (Groq JSON)
-            if isinstance(call, dict):
-                tool_name = call.get('tool') or call.get('name')
-                tool_args = dict(call.get('args') or {})
-            else:
-                tool_name = getattr(call, 'name', None)
-                try:
-                    tool_args = dict(getattr(call, 'args', {}))
-                except Exception:
-                    tool_args = {}
-
-            function_to_call = tools.get(tool_name)
-
-            if function_to_call:
-                # Check circuit breaker for tool
-                if tool_cb.is_open(tool_name):
-                    logger.warning("Skipping tool %s because its circuit breaker is open", tool_name)
-                    err_result = {"error": "Circuit breaker open"}
-                    tool_results[tool_name] = err_result
-                    tool_errors.append(f"{tool_name}: Circuit breaker open")
-                    used_tools.append(tool_name)
-                    continue
-                # Validate args before execution
-                is_valid, err, validated_args = validate_tool_args(tool_name, tool_args)
-                if not is_valid:
-                    logger.warning("Tool args invalid for %s: %s", tool_name, err)
-                    err_result = {"error": f"Invalid args: {err}"}
-                    tool_results[tool_name] = err_result
-                    tool_errors.append(f"{tool_name}: {err}")
-                    # record attempted tool
-                    used_tools.append(tool_name)
-                else:
-                        logger.debug("Executing tool %s with args %s", tool_name, tool_args)
-                        try:
-                            result = function_to_call(**validated_args)
-                        except Exception as e:
-                            logger.exception("Tool execution %s failed: %s", tool_name, e)
-                            err_result = {"error": str(e)}
-                            tool_results[tool_name] = err_result
-                            tool_errors.append(f"{tool_name}: {err_result['error']}")
-                            try:
-                                log_interaction("TOOL_CALL", user_query, {"tool": tool_name, "result": err_result})
-                            except Exception:
-                                logger.exception("Failed to log tool execution for %s", tool_name)
-                            # record attempted tool
-                            used_tools.append(tool_name)
-                        else:
-                            tool_results[tool_name] = result
-                            used_tools.append(tool_name)
-                            try:
-                                log_interaction("TOOL_CALL", user_query, {"tool": tool_name, "result": result})
-                            except Exception:
-                                logger.exception("Failed to log tool execution for %s", tool_name)
-
         # 3. Final Call: Send tool results back to the LLM for final synthesis
-        
-        # Build a simple, provider-agnostic string for final synthesis
-        tool_output_lines = []
-        for tool_name, result in tool_results.items():
-            tool_output_lines.append(f"{tool_name}: {result}")
-        tool_output_text = "\n".join(tool_output_lines)
-        combined_prompt = f"{user_query}\n\nTOOL_OUTPUTS:\n{tool_output_text}"
-        # Final LLM synthesis: use the configured provider again (supports Groq/Gemini)
-        final_response = generate_content(combined_prompt, model=settings.RAG_MODEL)
+        return _synthesize(user_query, outcomes, prompt)
 
-        return {
-            "final_answer": getattr(final_response, 'text', str(final_response)),
-            "used_tools": list(tool_results.keys()),
-            "tool_errors": tool_errors
-        }
-        
     # 4. No Tool Call: Direct answer (General Knowledge/Chat)
     return {
         "final_answer": response.text,
         "used_tools": [],
-        "tool_errors": []
-    }
\ No newline at end of file
+        "tool_errors": [],
+        "partial": False
+    }
@@ -0,0 +1,206 @@
+# agent_planner.py
+"""Planning mode: the model emits a DAG of tool calls once, a scheduler runs it.
+
+For multi-hop questions ("verify Acme, pull its Q3 revenue from filings, convert
+to GBP") the agent asks the model for a plan instead of a flat set of calls:
+
+    {"steps": [
+        {"id": "s1", "tool": "verify_company_registry", "args": {"company_name": "Acme"}},
+        {"id": "s2", "tool": "generate_rag_answer",
+         "args": {"user_query": "Q3 revenue of {s1.name}"}, "depends_on": ["s1"]},
+        {"id": "s3", "tool": "get_exchange_rate", "args": {"source_currency": "USD", "target_currency": "GBP"}}
+    ]}
+
+Arguments may reference earlier outputs as ``{s1}`` or ``{s1.field}``; an argument
+that is exactly one reference keeps the referenced value's type. ``execute_plan``
+starts every step whose dependencies are done, so independent steps (s1 and s3
+above) run concurrently, and dependents of a failed step are skipped. The whole
+question then costs two LLM calls (plan + synthesis) however many hops it has.
+"""
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from config import settings
+from utils import deadline
+
+_REF_RE = re.compile(r"\{([A-Za-z][\w-]*)(?:\.([\w.]+))?\}")
+
+# Cue words per tool family; a question touching two or more families is worth planning
+_PLAN_CUES = {
+    'registry': ('verify', 'registry', 'registered', 'cik', 'active company', 'company status'),
+    'document': ('report', 'filing', '10-k', '10-q', 'revenue', 'earnings', 'transcript', 'q1', 'q2', 'q3', 'q4'),
+    'conversion': ('convert', 'exchange rate', 'in usd', 'in eur', 'in gbp', 'to usd', 'to eur', 'to gbp'),
+}
+
+PLANNING_INSTRUCTION = (
+    "Plan the tool calls needed to answer the question. Reply with JSON only, in the form\n"
+    '{"steps": [{"id": "s1", "tool": "<tool name>", "args": {...}, "depends_on": []}, ...]}\n'
+    "Use only the tools listed below. Steps without dependencies run in parallel. To use the "
+    "output of an earlier step in an argument, list it in depends_on and write {s1} (whole output) "
+    "or {s1.field} (one field of it) inside the argument value. Use as few steps as possible; "
+    'reply {"steps": []} if no tool is needed.\n'
+)
+
+
+class PlanError(ValueError):
+    pass
+
+
+@dataclass
+class PlanStep:
+    id: str
+    tool: str
+    args: Dict[str, Any] = field(default_factory=dict)
+    depends_on: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Plan:
+    steps: List[PlanStep]
+
+    def order(self) -> List[str]:
+        """Step ids in a topological order (raises PlanError on a cycle)."""
+        pending = {s.id: set(s.depends_on) for s in self.steps}
+        done: List[str] = []
+        while pending:
+            ready = [sid for sid, deps in pending.items() if deps <= set(done)]
+            if not ready:
+                raise PlanError(f"Plan has a dependency cycle among {sorted(pending)}")
+            for sid in ready:
+                done.append(sid)
+                del pending[sid]
+        return done
+
+
+def looks_multi_step(query: str) -> bool:
+    """Cheap check: does the question touch two or more tool families?"""
+    q = f" {query.lower()} "
+    return sum(any(cue in q for cue in cues) for cues in _PLAN_CUES.values()) >= 2
+
+
+def planning_prompt(user_query: str, tool_catalog: str) -> str:
+    return f"{PLANNING_INSTRUCTION}\nAvailable tools:\n{tool_catalog}\n\nQUESTION:\n{user_query}"
+
+
+def parse_plan(text: str, known_tools) -> Plan:
+    """Parse and check the model's plan: valid JSON, known tools, existing dependencies, no cycles."""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        raise PlanError("No JSON object in planner output")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise PlanError(f"Planner output is not valid JSON: {e}")
+    raw_steps = data.get('steps') if isinstance(data, dict) else None
+    if not isinstance(raw_steps, list):
+        raise PlanError("Planner output has no 'steps' list")
+    if len(raw_steps) > settings.AGENT_PLAN_MAX_STEPS:
+        raise PlanError(f"Plan has {len(raw_steps)} steps (max {settings.AGENT_PLAN_MAX_STEPS})")
+
+    steps: List[PlanStep] = []
+    for i, raw in enumerate(raw_steps, start=1):
+        if not isinstance(raw, dict):
+            raise PlanError(f"Step {i} is not an object")
+        step = PlanStep(str(raw.get('id') or f"s{i}"), raw.get('tool') or raw.get('name'),
+                        dict(raw.get('args') or {}), [str(d) for d in raw.get('depends_on') or []])
+        if step.tool not in known_tools:
+            raise PlanError(f"Step {step.id} uses unknown tool '{step.tool}'")
+        steps.append(step)
+    ids = [s.id for s in steps]
+    if len(set(ids)) != len(ids):
+        raise PlanError("Plan has duplicate step ids")
+    for step in steps:
+        # references in args imply dependencies even if the model forgot to list them
+        for value in step.args.values():
+            if isinstance(value, str):
+                step.depends_on.extend(m.group(1) for m in _REF_RE.finditer(value)
+                                       if m.group(1) in ids and m.group(1) not in step.depends_on)
+        missing = [d for d in step.depends_on if d not in ids]
+        if missing:
+            raise PlanError(f"Step {step.id} depends on unknown steps {missing}")
+    plan = Plan(steps)
+    plan.order()
+    return plan
+
+
+def _lookup(value: Any, path: Optional[str]) -> Any:
+    for part in (path.split('.') if path else []):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            raise PlanError(f"Output has no field '{part}'")
+    return value
+
+
+def resolve_args(args: Dict[str, Any], outputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Substitute ``{step}`` / ``{step.field}`` references with the outputs of earlier steps."""
+    resolved = {}
+    for name, value in args.items():
+        if isinstance(value, str):
+            whole = _REF_RE.fullmatch(value)
+            if whole and whole.group(1) in outputs:
+                value = _lookup(outputs[whole.group(1)], whole.group(2))
+            else:
+                value = _REF_RE.sub(lambda m: str(_lookup(outputs[m.group(1)], m.group(2)))
+                                    if m.group(1) in outputs else m.group(0), value)
+        resolved[name] = value
+    return resolved
+
+
+def execute_plan(plan: Plan, run_step: Callable[[str, dict], tuple], executor: Executor) -> List[tuple]:
+    """Run the plan's steps as their dependencies complete; returns outcomes in plan order.
+
+    ``run_step(tool, args)`` returns a (tool_name, result, error) outcome (error None on
+    success). A step whose dependency failed, or whose references cannot be resolved,
+    is not run and gets an error outcome.
+    """
+    by_id = {s.id: s for s in plan.steps}
+    outcomes: Dict[str, tuple] = {}
+    outputs: Dict[str, Any] = {}
+    running: Dict[Any, str] = {}
+
+    def start_ready():
+        # repeat while steps get skipped: their dependents may now be skippable too
+        progressed = True
+        while progressed:
+            progressed = False
+            for step in plan.steps:
+                if step.id in outcomes or step.id in running.values():
+                    continue
+                if not all(d in outcomes for d in step.depends_on):
+                    continue
+                failed = [d for d in step.depends_on if outcomes[d][2] is not None]
+                if failed:
+                    outcomes[step.id] = (step.tool, {"error": f"Skipped: step {failed[0]} failed"},
+                                         f"skipped because step {failed[0]} failed")
+                    progressed = True
+                    continue
+                try:
+                    args = resolve_args(step.args, outputs)
+                except PlanError as e:
+                    outcomes[step.id] = (step.tool, {"error": str(e)}, str(e))
+                    progressed = True
+                    continue
+                running[executor.submit(deadline.run_in_context(run_step, step.tool, args))] = step.id
+
+    start_ready()
+    while running:
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            step_id = running.pop(future)
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = (by_id[step_id].tool, {"error": str(e)}, str(e))
+            if outcome is None:
+                outcome = (by_id[step_id].tool, {"error": "Tool not registered"}, "Tool not registered")
+            outcomes[step_id] = outcome
+            if outcome[2] is None:
+                outputs[step_id] = outcome[1]
+        start_ready()
+    return [outcomes[s.id] for s in plan.steps]
@@ -1,8 +1,15 @@
+import json
+import uuid
 from fastapi import APIRouter
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional
 from agent_controller import process_query_with_agent
 import logging
-from audit import log_interaction
+from audit import log_interaction, request_scope
+from config import settings
+from llm_client import model_router
+from utils.deadline import deadline_scope
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +18,26 @@ router = APIRouter()
 # Pydantic schema for the request body
 class QueryRequest(BaseModel):
     query: str
+    # Optional client-side time budget in seconds; capped by settings.REQUEST_DEADLINE_S
+    deadline_s: Optional[float] = Field(default=None, gt=0)
+    # Conversation to continue (from a previous response); omitted: a stateless query unless new_session is set
+    session_id: Optional[str] = Field(default=None, max_length=128)
+    # Start a conversation; its id comes back as `session_id` in the response
+    new_session: bool = False
 
 # Pydantic schema for the response body
 class QueryResponse(BaseModel):
     answer: str
     tools_used: list[str]
     tool_errors: list[str] = []
+    # True when the deadline cut the pipeline short and the answer is incomplete
+    partial: bool = False
+    # Pass back as `session_id` to ask a follow-up in the same conversation (None for stateless queries)
+    session_id: Optional[str] = None
+
+
+class BulkVerifyRequest(BaseModel):
+    company_names: list[str] = Field(min_length=1, max_length=settings.REGISTRY_BULK_MAX_NAMES)
 
 
 class ProviderInfoResponse(BaseModel):
@@ -31,26 +52,69 @@ async def handle_financial_query(request: QueryRequest):
     Main endpoint for sending complex financial questions to the AI Agent.
     """
     
-    # Process the query using the sophisticated Agent Controller
-    agent_result = process_query_with_agent(request.query)
-    # Log the interaction for auditing
-    try:
-        log_interaction("USER_QUERY", request.query, agent_result)
-    except Exception as e:
-        logger.exception("Failed to log interaction: %s", e)
+    # Process the query using the sophisticated Agent Controller, bounded by the request deadline
+    budget = settings.REQUEST_DEADLINE_S
+    if request.deadline_s is not None:
+        budget = min(budget, request.deadline_s)
+    with request_scope():
+        with deadline_scope(budget):
+            session_id = request.session_id or (uuid.uuid4().hex if request.new_session else None)
+            agent_result = process_query_with_agent(request.query, session_id=session_id)
+        # Log the interaction for auditing
+        try:
+            log_interaction("USER_QUERY", request.query, agent_result)
+        except Exception as e:
+            logger.exception("Failed to log interaction: %s", e)
     
     return QueryResponse(
         answer=agent_result["final_answer"],
-        tools_used=agent_result["used_tools"]
+        tools_used=agent_result["used_tools"],
+        partial=agent_result.get("partial", False),
+        session_id=agent_result.get("session_id")
     )
 
 
+@router.delete("/sessions/{session_id}", tags=["Agent"])
+def delete_session(session_id: str):
+    """Forget a conversation (its turns and stored tool results)."""
+    import session_memory
+    session_memory.delete(session_id)
+    return {"deleted": session_id}
+
+
+@router.post("/registry/verify", tags=["Registry"])
+def verify_companies_bulk(request: BulkVerifyRequest):
+    """
+    Verify many companies at once. Streams one JSON object per line ({"company_name", "result"})
+    as each lookup completes; duplicates are resolved once and recent results come from cache.
+    """
+    from tools.registry_check import iter_verify_companies
+
+    def lines():
+        for name, result in iter_verify_companies(request.company_names):
+            yield json.dumps({"company_name": name, "result": result}, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/rates/prefetch", tags=["Admin"])
+def get_rate_prefetch_stats():
+    """Background rate prefetcher counters, hot base currencies and rate-table cache hit rate."""
+    from tools import rate_prefetch
+    return rate_prefetch.stats()
+
+
 @router.get("/provider", response_model=ProviderInfoResponse, tags=["Admin"])
 async def get_provider_info():
     """Return configured LLM provider information (no API keys included)."""
-    from config import settings
     groq_ok = bool(settings.GROQ_API_KEY)
     gemini_ok = bool(settings.GEMINI_API_KEY)
     # The 'model' shown is the model configured for the default RAG path
     model = settings.GROQ_MODEL if settings.LLM_PROVIDER == 'groq' else settings.RAG_MODEL
-    return ProviderInfoResponse(provider=settings.LLM_PROVIDER, model=model, groq_configured=groq_ok, gemini_configured=gemini_ok)
\ No newline at end of file
+    return ProviderInfoResponse(provider=settings.LLM_PROVIDER, model=model, groq_configured=groq_ok, gemini_configured=gemini_ok)
+
+
+@router.get("/routing", tags=["Admin"])
+async def get_routing_stats():
+    """Per-route (fast/large model) call counts, latency percentiles and escalation rates."""
+    return model_router.stats()
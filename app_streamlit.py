@@ -123,12 +123,14 @@ if st.button("Analyze & Answer", type="primary") and user_query:
             # Call the FastAPI backend with the user query
             response = requests.post(
                 API_URL, 
-                json={"query": user_query},
+                # Follow-ups continue the same server-side conversation
+                json={"query": user_query, "session_id": st.session_state.get("session_id")},
                 timeout=30 # Allow 30 seconds for complex queries
             )
             response.raise_for_status()
 
             data = response.json()
+            st.session_state["session_id"] = data.get("session_id")
 
             st.subheader("Final AI Answer 🤖")
             st.markdown(data.get("answer", "No answer received."))
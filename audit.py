@@ -1,19 +1,48 @@
+import contextvars
 import logging
 import json
+import threading
+import uuid
+from contextlib import contextmanager
 from config import settings
 from datetime import datetime
 
-# Configure a file handler for the audit trail
 AUDIT_LOG_FILE = "audit_trail.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    handlers=[
-        logging.FileHandler(AUDIT_LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(settings.APP_NAME)
+_configured = False
+_configure_lock = threading.Lock()
+# Id of the request being processed, written with every record so concurrent identical queries stay apart
+_request_id: contextvars.ContextVar = contextvars.ContextVar('audit_request_id', default=None)
+
+
+@contextmanager
+def request_scope(request_id: str = None):
+    """Tag every record logged inside the block (and in threads run with ``deadline.run_in_context``)
+    with ``request_id`` (default: a new random id)."""
+    token = _request_id.set(request_id or uuid.uuid4().hex)
+    try:
+        yield _request_id.get()
+    finally:
+        _request_id.reset(token)
+
+
+def configure_audit_logging():
+    """Attach the audit trail file handler to the audit logger. Runs once, on the first logged
+    interaction, so importing this module has no side effects (no log file is opened at import time).
+    The handler sits on the audit logger itself, so it is attached even when the root logger was
+    already configured (by uvicorn, a library or a test)."""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.FileHandler(AUDIT_LOG_FILE)
+        handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _configured = True
+
 
 def log_interaction(interaction_type: str, user_query: str, agent_response: dict = None):
     """
@@ -24,12 +53,15 @@ def log_interaction(interaction_type: str, user_query: str, agent_response: dict
         user_query: The original or current query being processed.
         agent_response: Full response object (tools used, answer, sources).
     """
+    configure_audit_logging()
     log_data = {
         "timestamp": datetime.now().isoformat(),
         "type": interaction_type,
         "query": user_query,
         "response_details": agent_response if agent_response else {}
     }
+    if _request_id.get() is not None:
+        log_data["request_id"] = _request_id.get()
     
     logger.info(json.dumps(log_data))
     
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Literal
-from typing import List
+from typing import Dict, List
 
 class Settings(BaseSettings):
     """
@@ -25,16 +25,167 @@ class Settings(BaseSettings):
     VECTOR_DB_URL: str = "http://localhost:8080"
     RAG_MODEL: str = "llama-3.3-70b-versatile"
     RAG_K_CHUNKS: int = 5
+    # Token budget for the retrieved CONTEXT block of RAG prompts, optionally per model
+    RAG_CONTEXT_TOKEN_BUDGET: int = 3000
+    RAG_CONTEXT_TOKEN_BUDGETS: Dict[str, int] = {'llama-3.1-8b-instant': 1500}
+    # Document ingestion: chunk size/overlap in characters, process-pool PDF parsing (0 workers: one per core)
+    DOC_CHUNK_SIZE: int = 1200
+    DOC_CHUNK_OVERLAP: int = 200
+    DOC_PARSE_WORKERS: int = 0
+    DOC_PARSE_PAGES_PER_TASK: int = 8
+    DOC_PARALLEL_MIN_PAGES: int = 16
+    DOC_INGEST_BATCH_SIZE: int = 256
+    # Chunk ids and manifest keys use document paths relative to this root ('': working directory)
+    DOC_CORPUS_ROOT: str = ''
+    # OCR: engine ('auto' = tesseract, an error when it is not installed; 'standin' only for tests and
+    # benchmarks), pool size (0: one per core), on-disk cache keyed by page image hash ('' disables),
+    # downscale/binarize before recognition
+    OCR_ENGINE: Literal['auto', 'tesseract', 'standin'] = 'auto'
+    OCR_WORKERS: int = 0
+    OCR_CACHE_DIR: str = '.ocr_cache'
+    OCR_PREPROCESS: bool = True
+    OCR_MAX_SIDE: int = 2000
+    OCR_BINARIZE: bool = True
+    # Content hashes of ingested documents/chunks for incremental re-ingestion
+    INGEST_MANIFEST_PATH: str = '.ingest_manifest.json'
+    # Chroma data directory (chromadb.PersistentClient); '' uses an in-process client that is lost on exit
+    CHROMA_PERSIST_DIR: str = ''
+    # Shingle Jaccard/containment above which a retrieved chunk counts as a duplicate
+    RAG_DEDUP_THRESHOLD: float = 0.8
     # External API configuration for currency exchange provider
     EXCHANGE_RATE_BASE_URL: str = "https://v6.exchangerate-api.com/v6"
     EXCHANGE_RATE_API_KEY: str = ""
+    # Latest-rate tables per base currency are cached this long; the background prefetcher
+    # (tools/rate_prefetch.py) refetches the RATE_PREFETCH_TOP_N most requested bases over the
+    # last RATE_PREFETCH_WINDOW_S once they reach RATE_PREFETCH_REFRESH_AT of the TTL
+    RATE_TABLE_TTL_S: float = 600.0
+    RATE_TABLE_CACHE_SIZE: int = 256
+    RATE_PREFETCH_ENABLED: bool = True
+    RATE_PREFETCH_INTERVAL_S: float = 60.0
+    RATE_PREFETCH_REFRESH_AT: float = 0.8
+    RATE_PREFETCH_TOP_N: int = 5
+    RATE_PREFETCH_WINDOW_S: float = 3600.0
+    # provider requests per minute, per host with CACHE_BACKEND=sqlite (one leader worker), else per worker
+    RATE_PREFETCH_MAX_PER_MINUTE: int = 10
+    RATE_PREFETCH_SEED_BASES: List[str] = ['USD']
+    # Local daily rate history (tools/rate_history.py): store directory, quote base, and how many
+    # days back a missing quote (weekend/holiday) may be filled from
+    RATE_HISTORY_DIR: str = '.rate_history'
+    RATE_HISTORY_BASE: str = 'USD'
+    RATE_HISTORY_MAX_GAP_DAYS: int = 7
     # LLM Provider configuration
     LLM_PROVIDER: Literal['gemini', 'groq'] = 'groq'
     GROQ_API_KEY: str = ''
     GROQ_MODEL: str = 'llama-3.3-70b-versatile'  # Default Groq model (Llama 3.3 70B versatile recommended for free tier)
     GROQ_FALLBACK_MODELS: List[str] = ['llama-3.3-70b-versatile', 'llama-3.1-8b-instant', 'groq-1.0']
+    # Groq retry policy: jittered exponential backoff across GROQ_FALLBACK_MODELS, capped by a
+    # retry budget (retries <= ratio x requests). Call sites listed here also hedge: a duplicate
+    # request goes to the next model when the primary is slower than its p95 latency.
+    LLM_RETRY_MAX_ATTEMPTS: int = 3
+    LLM_RETRY_BASE_DELAY_S: float = 0.25
+    LLM_RETRY_MAX_DELAY_S: float = 4.0
+    LLM_RETRY_BUDGET_RATIO: float = 0.2
+    LLM_HEDGE_CALL_SITES: List[str] = ['tool_decision']
+    LLM_HEDGE_DEFAULT_DELAY_S: float = 2.0
+    # Answer pattern-matched queries ("convert 100 USD to EUR", "is Tesla an active company")
+    # by calling the tool directly, without the tool-decision LLM call
+    AGENT_FAST_PATH_ENABLED: bool = True
+    # Speculative RAG retrieval during the tool-decision call, with a cap on wasted work
+    RAG_SPECULATIVE_PREFETCH: bool = True
+    RAG_PREFETCH_MAX_IN_FLIGHT: int = 4
+    RAG_PREFETCH_MAX_PER_MINUTE: int = 120
+    RAG_PREFETCH_MIN_OVERLAP: float = 0.5
+    # RAG answer cache (tools/rag_answer_cache.py): answers keyed by normalized question, retrieval
+    # settings and index version (bumped by every ingestion). Near-duplicate reuse is off by default
+    # (threshold 1.0): below it, a paraphrase matches when the query embeddings reach the threshold and
+    # both questions name the same periods, numbers and capitalized names
+    RAG_ANSWER_CACHE_ENABLED: bool = True
+    RAG_ANSWER_CACHE_TTL_S: float = 86400.0
+    RAG_ANSWER_CACHE_SIZE: int = 2048
+    RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD: float = 1.0
+    RAG_ANSWER_CACHE_SEMANTIC_SIZE: int = 1024
+    # Embedding search for the in-memory fallback (tools/vector_index.py): int8 (or product-quantized)
+    # codes in RAM for the first pass, float32 vectors on disk (RAG_VECTOR_DIR) to re-score the best
+    # RAG_VECTOR_RESCORE candidates. Chunks are only indexed with real embeddings (Gemini or the local
+    # model below); until then retrieval stays on term search
+    RAG_VECTOR_INDEX_ENABLED: bool = True
+    RAG_VECTOR_QUANTIZATION: Literal['none', 'int8', 'pq'] = 'int8'
+    RAG_VECTOR_RESCORE: int = 50
+    # must divide the embedding dimension; otherwise indexing fails with an error
+    RAG_VECTOR_PQ_SUBVECTORS: int = 16
+    RAG_VECTOR_PQ_TRAIN_SIZE: int = 10000
+    RAG_VECTOR_DIR: str = '.vector_index'
+    # Above 1, the embedding index is split across this many worker processes (tools/sharded_index.py),
+    # routed by chunk-id hash or by the chunk's company; capped at the number of cores
+    RAG_VECTOR_SHARDS: int = 1
+    RAG_VECTOR_SHARD_BY: Literal['hash', 'company'] = 'hash'
+    # Offline embeddings (tools/local_embedder.py): hashed word/bigram TF-IDF reduced by truncated SVD,
+    # stored at LOCAL_EMBEDDER_PATH and used whenever Gemini embeddings are not configured. Fit it with
+    # `python -m tools.local_embedder --fit FILES`; workers re-embed their chunks when the file changes.
+    # LOCAL_EMBEDDER_AUTO_FIT (opt-in: the fit blocks ingestion) fits on the in-memory chunks once there
+    # are LOCAL_EMBEDDER_MIN_DOCS and refits each time the corpus grows LOCAL_EMBEDDER_REFIT_GROWTH-fold
+    LOCAL_EMBEDDER_PATH: str = '.vector_index/local_embedder.npz'
+    LOCAL_EMBEDDER_DIM: int = 256
+    LOCAL_EMBEDDER_FEATURES: int = 2 ** 18
+    LOCAL_EMBEDDER_AUTO_FIT: bool = False
+    LOCAL_EMBEDDER_MIN_DOCS: int = 20
+    LOCAL_EMBEDDER_REFIT_GROWTH: float = 2.0
+    # Model routing: simple steps go to a fast model, multi-document synthesis to RAG_MODEL
+    MODEL_ROUTING_ENABLED: bool = True
+    ROUTER_FAST_MODEL: str = 'llama-3.1-8b-instant'
+    GEMINI_FAST_MODEL: str = ''
+    ROUTER_FAST_MAX_PROMPT_CHARS: int = 2000
+    # Send tools as native function-calling schemas (False: ask for a JSON object in the text reply)
+    LLM_NATIVE_TOOL_CALLING: bool = True
+    # Agent: stream the tool-decision call and start each tool as soon as its call is parsed
+    AGENT_STREAM_TOOL_CALLS: bool = False
+    AGENT_TOOL_WORKERS: int = 8
+    # End-to-end budget for one /query request (seconds); LLM calls, retries and tools share it
+    REQUEST_DEADLINE_S: float = 60.0
+    # Minimum budget left before attempting the final synthesis call; otherwise return partial results
+    DEADLINE_SYNTHESIS_RESERVE_S: float = 1.0
     # Optional external registry API endpoint for validating company details
     REGISTRY_API_URL: str = ""
+    # Cache backend for rate tables, registry results, LLM responses and circuit breakers:
+    # 'memory' (per process) or 'sqlite' (per-process tier of up to CACHE_LOCAL_TTL_S in front
+    # of a SQLite file shared by all workers on the host)
+    CACHE_BACKEND: Literal['memory', 'sqlite'] = 'memory'
+    CACHE_SQLITE_PATH: str = '.cache/shared_cache.sqlite3'
+    CACHE_LOCAL_TTL_S: float = 30.0
+    # Opt-in cache of identical LLM calls (same provider, model, prompt and tools)
+    LLM_RESPONSE_CACHE_ENABLED: bool = False
+    LLM_RESPONSE_CACHE_TTL_S: float = 3600.0
+    LLM_RESPONSE_CACHE_SIZE: int = 2048
+    # Planning mode (agent_planner.py): 'auto' plans questions that touch several tool families,
+    # 'always' plans every question that is not answered by the fast path
+    AGENT_PLANNING_MODE: Literal['off', 'auto', 'always'] = 'auto'
+    AGENT_PLAN_MAX_STEPS: int = 8
+    # Conversation sessions (session_memory.py): history kept under a token budget (last
+    # SESSION_KEEP_TURNS verbatim, older turns summarized) and per-tool freshness for reusing results
+    SESSION_TTL_S: float = 86400.0
+    SESSION_MAX_SESSIONS: int = 10000
+    SESSION_CONTEXT_TOKEN_BUDGET: int = 800
+    SESSION_KEEP_TURNS: int = 3
+    SESSION_MAX_ANSWER_CHARS: int = 1500
+    SESSION_MAX_TOOL_RESULTS: int = 20
+    SESSION_TOOL_RESULT_DEFAULT_TTL_S: float = 600.0
+    SESSION_TOOL_RESULT_TTL_S: Dict[str, float] = {
+        'get_exchange_rate': 300.0,
+        'get_historical_exchange_rate': 86400.0,
+        'generate_rag_answer': 3600.0,
+        'verify_company_registry': 3600.0,
+        'verify_companies': 3600.0,
+    }
+    # Registry result cache and bulk verification fan-out
+    REGISTRY_CACHE_TTL_S: float = 3600.0
+    REGISTRY_CACHE_SIZE: int = 10000
+    REGISTRY_BULK_CONCURRENCY: int = 16
+    REGISTRY_BULK_MAX_NAMES: int = 1000
+    # Local registry export (CSV/Parquet) used before the API; the API is only called for
+    # snapshot misses (score below REGISTRY_MATCH_MIN_SCORE) or when the snapshot is stale
+    REGISTRY_SNAPSHOT_PATH: str = ""
+    REGISTRY_MATCH_MIN_SCORE: float = 0.75
+    REGISTRY_SNAPSHOT_MAX_AGE_DAYS: float = 7.0
 
     @property
     def is_production(self) -> bool:
@@ -0,0 +1,163 @@
+# fast_path.py
+"""Deterministic intent matcher for the most common query shapes.
+
+Queries such as "convert 1,200 USD to EUR" or "is Tesla an active company" map
+to exactly one tool call. Matching them locally saves the tool-decision LLM
+round-trip; the agent validates the extracted args against TOOL_ARG_MODELS,
+runs the tool and answers from a template, falling back to LLM synthesis when
+the tool fails or its result does not fit the template.
+"""
+import math
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# ISO 4217 codes accepted as bare three-letter tokens (anything else is not treated as a currency)
+CURRENCY_CODES = frozenset({
+    'AED', 'ARS', 'AUD', 'BDT', 'BRL', 'CAD', 'CHF', 'CLP', 'CNY', 'COP', 'CZK', 'DKK', 'EGP',
+    'EUR', 'GBP', 'GHS', 'HKD', 'HUF', 'IDR', 'ILS', 'INR', 'JPY', 'KES', 'KRW', 'MAD', 'MXN',
+    'MYR', 'NGN', 'NOK', 'NZD', 'PHP', 'PKR', 'PLN', 'QAR', 'RON', 'RUB', 'SAR', 'SEK', 'SGD',
+    'THB', 'TRY', 'TWD', 'TZS', 'UAH', 'UGX', 'USD', 'VND', 'XAF', 'XOF', 'ZAR', 'ZMW',
+})
+
+CURRENCY_NAMES = {
+    'dollar': 'USD', 'dollars': 'USD', 'us dollar': 'USD', 'us dollars': 'USD',
+    'euro': 'EUR', 'euros': 'EUR',
+    'pound': 'GBP', 'pounds': 'GBP', 'sterling': 'GBP', 'british pound': 'GBP', 'british pounds': 'GBP',
+    'naira': 'NGN', 'yen': 'JPY', 'yuan': 'CNY', 'renminbi': 'CNY', 'rupee': 'INR', 'rupees': 'INR',
+    'franc': 'CHF', 'swiss franc': 'CHF', 'swiss francs': 'CHF', 'rand': 'ZAR', 'cedi': 'GHS', 'cedis': 'GHS',
+    'shilling': 'KES', 'shillings': 'KES', 'canadian dollar': 'CAD', 'canadian dollars': 'CAD',
+    'australian dollar': 'AUD', 'australian dollars': 'AUD',
+}
+
+_CURRENCY = r"(?:[a-z]{3}|" + "|".join(sorted((re.escape(n) for n in CURRENCY_NAMES), key=len, reverse=True)) + r")"
+_AMOUNT = r"(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+
+_CONVERT_RE = re.compile(
+    rf"^(?:please\s+)?(?:convert|change|exchange|how much is)?\s*(?:{_AMOUNT}\s*)?(?P<src>{_CURRENCY})"
+    rf"\s+(?:to|in|into|->)\s+(?P<dst>{_CURRENCY})$",
+    re.IGNORECASE,
+)
+_RATE_RE = re.compile(
+    rf"^(?:what(?:'s| is)\s+)?(?:the\s+)?(?:current\s+|latest\s+)?(?:exchange\s+)?rate\s+"
+    rf"(?:from\s+|for\s+|between\s+)?(?P<src>{_CURRENCY})\s*(?:to|and|/|-)\s*(?P<dst>{_CURRENCY})$",
+    re.IGNORECASE,
+)
+_REGISTRY_RE = re.compile(
+    r"^(?:please\s+)?(?:is|check\s+(?:if|whether)|verify\s+(?:if|whether|that)?)\s*(?P<name>.+?)\s+(?:is\s+)?"
+    r"(?:an?\s+|still\s+(?:an?\s+)?)?(?:active|registered|valid)\s+(?:company|business|firm|entity|corporation)$"
+    r"|^(?:please\s+)?(?:verify|check)\s+(?:the\s+)?(?:company|registry(?:\s+status)?(?:\s+(?:of|for))?)\s+(?P<name2>.+?)$",
+    re.IGNORECASE,
+)
+
+# Company names longer than this are more likely a sentence the pattern swallowed than a name
+_MAX_NAME_WORDS = 6
+# Words that turn the captured span into a clause or a financial/document question
+# ("check company filings for Tesla", "verify company revenue growth in Q3"), not a name
+_NOT_NAME_WORDS = frozenset({
+    'for', 'in', 'on', 'at', 'from', 'with', 'during', 'about', 'by', 'to', 'that', 'if', 'whether',
+    'is', 'are', 'was', 'were', 'has', 'have', 'what', 'which', 'who', 'how', 'why', 'when', 'where',
+    'balance', 'sheet', 'sheets', 'filing', 'filings', 'revenue', 'revenues', 'growth', 'income',
+    'earnings', 'profit', 'profits', 'loss', 'losses', 'cash', 'flow', 'margin', 'margins', 'debt',
+    'report', 'reports', 'statement', 'statements', 'results', 'quarter', 'quarterly', 'annual',
+    'dividend', 'dividends', 'valuation', 'price', 'stock', 'shares', 'status', 'record', 'records',
+})
+# A lowercase determiner in front ("the new CFO") starts a description; "The Home Depot" is a name
+_LEADING_NOT_NAME = frozenset({'the', 'a', 'an', 'this', 'that', 'these', 'those', 'our', 'my', 'their', 'its', 'new'})
+_PERIOD_RE = re.compile(r"^(?:q[1-4]|h[12]|fy\d*|(?:19|20)\d\d)$", re.IGNORECASE)
+
+
+@dataclass
+class FastPathMatch:
+    tool: str
+    args: dict
+    # Amount to convert for exchange-rate matches (None: just the rate)
+    amount: Optional[float] = None
+
+    def as_call(self) -> dict:
+        return {"tool": self.tool, "args": dict(self.args)}
+
+
+def _currency(token: str) -> Optional[str]:
+    token = token.strip().lower()
+    if token in CURRENCY_NAMES:
+        return CURRENCY_NAMES[token]
+    code = token.upper()
+    return code if code in CURRENCY_CODES else None
+
+
+def _is_company_name(name: str) -> bool:
+    words = name.split()
+    if not words or len(words) > _MAX_NAME_WORDS or words[0] in _LEADING_NOT_NAME:
+        return False
+    return not any(w.lower().strip(',') in _NOT_NAME_WORDS or _PERIOD_RE.match(w) for w in words)
+
+
+def _normalize(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().rstrip('?.!').strip()
+
+
+def match_intent(query: str) -> Optional[FastPathMatch]:
+    """Return the single tool call a query unambiguously asks for, or None to use the LLM."""
+    text = _normalize(query)
+    if not text or len(text) > 200:
+        return None
+
+    m = _CONVERT_RE.match(text) or _RATE_RE.match(text)
+    if m:
+        src, dst = _currency(m.group('src')), _currency(m.group('dst'))
+        if not src or not dst or src == dst:
+            return None
+        amount = m.groupdict().get('amount')
+        return FastPathMatch(
+            tool='get_exchange_rate',
+            args={'source_currency': src, 'target_currency': dst},
+            amount=float(amount.replace(',', '')) if amount else None,
+        )
+
+    m = _REGISTRY_RE.match(text)
+    if m:
+        name = (m.group('name') or m.group('name2') or '').strip(' "\'')
+        if not _is_company_name(name):
+            return None
+        return FastPathMatch(tool='verify_company_registry', args={'company_name': name})
+    return None
+
+
+def format_number(value: float) -> str:
+    """Thousands separators, no trailing zeros: 1200.0 -> '1,200', 0.92040 -> '0.9204'.
+
+    Four decimals, or four significant digits for values below 1 (0.0000631 -> '0.0000631').
+    """
+    decimals = 4
+    if value and abs(value) < 1:
+        decimals = max(4, 3 - math.floor(math.log10(abs(value))))
+    text = f"{value:,.{decimals}f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+def render_answer(match: FastPathMatch, result) -> Optional[str]:
+    """Templated answer for a tool result, or None when the result needs LLM synthesis."""
+    if match.tool == 'get_exchange_rate':
+        try:
+            rate = float(result)
+        except (TypeError, ValueError):
+            return None
+        src, dst = match.args['source_currency'], match.args['target_currency']
+        if match.amount is None:
+            return f"1 {src} = {format_number(rate)} {dst}"
+        return (f"{format_number(match.amount)} {src} = {format_number(match.amount * rate)} {dst} "
+                f"(rate: 1 {src} = {format_number(rate)} {dst})")
+
+    if match.tool == 'verify_company_registry':
+        if not isinstance(result, dict) or not result.get('status'):
+            return None
+        name = result.get('name') or match.args['company_name']
+        if str(result['status']).lower() == 'not found':
+            return f"No registry record was found for {name}."
+        details = [f"{label} {result[key]}" for key, label in
+                   (('cik', 'CIK'), ('country', 'country:'), ('date_founded', 'founded'))
+                   if result.get(key)]
+        suffix = f" ({', '.join(details)})" if details else ""
+        return f"{name} is registered with status {result['status']}{suffix}."
+    return None
@@ -1,10 +1,18 @@
+import hashlib
+import inspect
 import json
 import logging
-from typing import Any, List, Optional
+import random
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import requests
 from config import settings
+from utils import deadline
+from utils.cache import make_cache
 
 logger = logging.getLogger(__name__)
 
@@ -15,34 +23,359 @@ class LLMResponse:
         self.function_calls = function_calls or []
 
 
-def _extract_json_snippet(s: str) -> Optional[str]:
-    # Finds first JSON object by scanning braces and returning the substring
-    start = s.find('{')
-    if start == -1:
+class ToolCallStreamParser:
+    """Incremental parser for tool-call JSON embedded in (streamed) model text.
+
+    Feed text as it arrives; each complete top-level ``{"tool": ..., "args": ...}``
+    object, or each such element of a top-level JSON array, is returned as soon
+    as its closing brace is seen. Braces inside JSON strings are ignored.
+    """
+
+    def __init__(self):
+        self._buf: List[str] = []
+        self._stack: List[str] = []
+        self._starts: List[int] = []
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self.calls: List[dict] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        completed = []
+        for c in chunk:
+            if self._stack:
+                self._buf.append(c)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c in '{[':
+                if not self._stack:
+                    self._buf = [c]
+                    self._pos = 0
+                self._stack.append(c)
+                self._starts.append(self._pos)
+            elif self._stack and c == '"':
+                self._in_string = True
+            elif self._stack and c in '}]':
+                opener = self._stack.pop()
+                start = self._starts.pop()
+                if (opener, c) not in (('{', '}'), ('[', ']')):
+                    # Mismatched brackets: not JSON, drop what we were tracking
+                    self._stack.clear()
+                    self._starts.clear()
+                elif opener == '{' and (not self._stack or self._stack == ['[']):
+                    call = self._decode(''.join(self._buf[start:self._pos + 1]))
+                    if call is not None:
+                        completed.append(call)
+            if self._stack:
+                self._pos += 1
+        self.calls.extend(completed)
+        return completed
+
+    @staticmethod
+    def _decode(snippet: str) -> Optional[dict]:
+        try:
+            parsed = json.loads(snippet)
+        except json.JSONDecodeError:
+            logger.debug("Model output included JSON-looking snippet but failed parsing")
+            return None
+        if isinstance(parsed, dict) and ('tool' in parsed or 'name' in parsed):
+            return parsed
         return None
-    depth = 0
-    for i in range(start, len(s)):
-        c = s[i]
-        if c == '{':
-            depth += 1
-        elif c == '}':
-            depth -= 1
-            if depth == 0:
-                return s[start:i+1]
-    return None
-
-
-def generate_content(prompt: str, model: Optional[str] = None, tools: Optional[dict] = None) -> LLMResponse:
+
+
+# Instruction used when the provider is asked to express tool calls as plain-text JSON
+_TEXT_TOOL_INSTRUCTION = (
+    "If you must call a tool to answer the user's query, respond with a single JSON object only. "
+    "The object must have 'tool' and 'args' properties like: {\"tool\": \"get_exchange_rate\", \"args\": {\"source_currency\": \"USD\", \"target_currency\": \"NGN\"}}.\n"
+    "If you do not need a tool, respond with final text answer.\n"
+)
+
+# Instruction used alongside native function calling (the tool list travels in the request schema)
+_NATIVE_TOOL_INSTRUCTION = (
+    "You are a financial analysis agent. If a tool is needed to answer the user's query, call it "
+    "using the provided function definitions. If you do not need a tool, respond with final text answer."
+)
+
+
+def _strip_titles(schema: Any) -> Any:
+    # Pydantic adds 'title' to every level of its JSON schema; providers don't need it
+    if isinstance(schema, dict):
+        return {k: _strip_titles(v) for k, v in schema.items() if k != 'title'}
+    if isinstance(schema, list):
+        return [_strip_titles(v) for v in schema]
+    return schema
+
+
+class ToolSpec:
+    """Compiled description of one tool: signature text, JSON arg schema and description."""
+
+    def __init__(self, name: str, func: Callable, parameters: dict, description: str, signature: str):
+        self.name = name
+        self.func = func
+        self.parameters = parameters
+        self.description = description
+        self.signature = signature
+
+    def as_groq(self) -> dict:
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+    def as_gemini(self) -> dict:
+        return {"name": self.name, "description": self.description, "parameters": self.parameters}
+
+
+class ToolRegistry:
+    """Tool manifest compiled once at registration time.
+
+    Signatures and argument schemas are computed when a tool is registered; the
+    provider-specific tool schemas and prompt prefixes are rendered on first use
+    and cached until the next registration, so every request sends an identical
+    prefix (which also keeps it eligible for provider-side prompt caching).
+    """
+
+    def __init__(self):
+        self._specs: Dict[str, ToolSpec] = {}
+        self._rendered: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, func: Callable, arg_model: Any = None, description: Optional[str] = None) -> ToolSpec:
+        if arg_model is not None:
+            parameters = _strip_titles(arg_model.model_json_schema())
+            signature = ', '.join(arg_model.model_fields.keys())
+        else:
+            try:
+                params = list(inspect.signature(func).parameters.keys())
+            except (TypeError, ValueError):
+                params = []
+            parameters = {
+                "type": "object",
+                "properties": {p: {"type": "string"} for p in params},
+                "required": params,
+            }
+            signature = ', '.join(params)
+        if description is None:
+            doc = inspect.getdoc(func) or ''
+            description = doc.strip().splitlines()[0] if doc.strip() else name
+        spec = ToolSpec(name, func, parameters, description, signature)
+        with self._lock:
+            self._specs[name] = spec
+            self._rendered.clear()
+        return spec
+
+    def names(self) -> List[str]:
+        return list(self._specs.keys())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def __len__(self) -> int:
+        return len(self._specs)
+
+    def _cached(self, key: str, build: Callable[[], Any]) -> Any:
+        value = self._rendered.get(key)
+        if value is None:
+            with self._lock:
+                value = self._rendered.get(key)
+                if value is None:
+                    value = build()
+                    self._rendered[key] = value
+        return value
+
+    def groq_tools(self) -> List[dict]:
+        return self._cached('groq_tools', lambda: [s.as_groq() for s in self._specs.values()])
+
+    def gemini_tools(self) -> List[dict]:
+        return self._cached('gemini_tools', lambda: [{"function_declarations": [s.as_gemini() for s in self._specs.values()]}])
+
+    def catalog(self) -> str:
+        """One ``name(args): description`` line per tool (used by the planner prompt)."""
+        return self._cached('catalog', lambda: "\n".join(
+            f"{s.name}({s.signature}): {s.description}" for s in self._specs.values()))
+
+    def prompt_prefix(self, provider: str, native: bool = True) -> str:
+        """Rendered instruction prefix for a provider; cached so it is byte-identical across calls."""
+        def build() -> str:
+            if native:
+                return _NATIVE_TOOL_INSTRUCTION
+            lines = [f"{s.name}({s.signature}): {s.description}" for s in self._specs.values()]
+            return _TEXT_TOOL_INSTRUCTION + "Available tools:\n" + "\n".join(lines)
+        return self._cached(f'prefix:{provider}:{int(native)}', build)
+
+
+# Registries compiled for plain ``{name: func}`` dicts passed by callers, keyed by tool identity
+_dict_registries: Dict[tuple, ToolRegistry] = {}
+
+
+def _as_registry(tools: Union[ToolRegistry, dict, None]) -> Optional[ToolRegistry]:
+    if not tools:
+        return None
+    if hasattr(tools, 'groq_tools'):
+        return tools
+    key = tuple((name, id(func)) for name, func in tools.items())
+    registry = _dict_registries.get(key)
+    if registry is None:
+        registry = ToolRegistry()
+        for name, func in tools.items():
+            registry.register(name, func)
+        if len(_dict_registries) >= 32:
+            _dict_registries.clear()
+        _dict_registries[key] = registry
+    return registry
+
+
+_ANALYSIS_TERMS = ('compare', 'comparison', 'analy', 'explain', 'why', 'trend', 'forecast', 'summar',
+                   'impact', 'evaluate', 'assess', 'versus', ' vs ', 'outlook', 'risk')
+_DOCUMENT_TERMS = ('report', 'filing', '10-k', '10-q', 'annual', 'quarter', 'q1', 'q2', 'q3', 'q4',
+                   'revenue', 'earnings', 'transcript', 'income', 'balance sheet', 'cash flow')
+
+
+def classify_intent(query: str) -> str:
+    """Cheap keyword intent: 'analysis', 'document', 'conversion', 'registry' or 'general'."""
+    q = f" {query.lower()} "
+    if any(t in q for t in _ANALYSIS_TERMS):
+        return 'analysis'
+    if any(t in q for t in ('exchange rate', 'convert', ' fx ')):
+        return 'conversion'
+    if any(t in q for t in ('registry', 'registered', 'active company', 'verify', 'cik')):
+        return 'registry'
+    if any(t in q for t in _DOCUMENT_TERMS):
+        return 'document'
+    return 'general'
+
+
+class RouteDecision:
+    def __init__(self, route: str, model: str, reason: str):
+        self.route = route
+        self.model = model
+        self.reason = reason
+
+
+class ModelRouter:
+    """Routes each agent step to the fast or the large model using cheap local features.
+
+    Tool selection and short factual answers go to ``settings.ROUTER_FAST_MODEL``; long
+    prompts, analytical questions and synthesis over several (or document) tool outputs
+    go to ``settings.RAG_MODEL``. Callers escalate to the large model when the fast
+    model's output fails validation. Per-route latency and escalation counts are kept
+    for ``stats()``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = {}
+        self._escalations: Dict[str, int] = {}
+        self._latency: Dict[str, deque] = {}
+
+    def _models(self) -> tuple:
+        large = settings.RAG_MODEL
+        if settings.LLM_PROVIDER.lower() == 'gemini':
+            return (settings.GEMINI_FAST_MODEL or large), large
+        return settings.ROUTER_FAST_MODEL, large
+
+    def route(self, step: str, prompt: str, tool_outputs: int = 0, intent: Optional[str] = None,
+              document_outputs: int = 0) -> RouteDecision:
+        fast, large = self._models()
+        if not settings.MODEL_ROUTING_ENABLED or fast == large:
+            return RouteDecision('large', large, 'routing disabled')
+        intent = intent or classify_intent(prompt)
+        if len(prompt) > settings.ROUTER_FAST_MAX_PROMPT_CHARS:
+            return RouteDecision('large', large, 'long prompt')
+        if step == 'planning':
+            return RouteDecision('large', large, 'planning')
+        if intent == 'analysis':
+            return RouteDecision('large', large, 'analytical intent')
+        if step == 'synthesis' and (tool_outputs > 1 or document_outputs > 0):
+            return RouteDecision('large', large, 'multi-source synthesis')
+        return RouteDecision('fast', fast, f'simple {step}')
+
+    def escalate(self, decision: RouteDecision, reason: str) -> RouteDecision:
+        with self._lock:
+            self._escalations[decision.route] = self._escalations.get(decision.route, 0) + 1
+        logger.info("Escalating from %s to large model: %s", decision.model, reason)
+        return RouteDecision('large', self._models()[1], f'escalated: {reason}')
+
+    def record(self, decision: RouteDecision, seconds: float):
+        with self._lock:
+            self._calls[decision.route] = self._calls.get(decision.route, 0) + 1
+            self._latency.setdefault(decision.route, deque(maxlen=500)).append(seconds)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            out = {}
+            for route in sorted(set(self._calls) | set(self._escalations)):
+                calls = self._calls.get(route, 0)
+                samples = sorted(self._latency.get(route, ()))
+                out[route] = {
+                    "calls": calls,
+                    "escalations": self._escalations.get(route, 0),
+                    "escalation_rate": (self._escalations.get(route, 0) / calls) if calls else 0.0,
+                    "latency_ms_p50": samples[len(samples) // 2] * 1000 if samples else None,
+                    "latency_ms_p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000 if samples else None,
+                }
+            return out
+
+
+model_router = ModelRouter()
+
+
+def generate_content(prompt: str, model: Optional[str] = None, tools: Union[ToolRegistry, dict, None] = None,
+                     call_site: Optional[str] = None) -> LLMResponse:
+    """Generate a completion with the configured provider.
+
+    ``call_site`` selects the retry/hedging policy from RETRY_POLICIES; when omitted,
+    calls offering tools use 'tool_decision' and the rest 'synthesis'.
+    """
     provider = settings.LLM_PROVIDER.lower()
+    cache_key = _response_cache_key(provider, prompt, model, tools) if settings.LLM_RESPONSE_CACHE_ENABLED else None
+    if cache_key is not None:
+        cached = _get_response_cache().get(cache_key)
+        if cached is not None:
+            data = json.loads(cached)
+            return LLMResponse(text=data['text'], function_calls=data['function_calls'])
     if provider == 'groq':
-        return _generate_groq(prompt, model, tools)
+        resp = _generate_groq(prompt, model, tools, call_site)
     elif provider == 'gemini':
-        return _generate_gemini(prompt, model, tools)
+        resp = _generate_gemini(prompt, model, tools)
     else:
         raise ValueError(f"Unsupported LLM provider: {provider}")
+    # Only plain-data responses are cached (Gemini SDK function-call objects are not)
+    if cache_key is not None and (resp.text or resp.function_calls) and all(isinstance(c, dict) for c in resp.function_calls):
+        _get_response_cache().set(cache_key, json.dumps({"text": resp.text, "function_calls": resp.function_calls}))
+    return resp
+
+
+_response_cache = None
+
+
+def _get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = make_cache('llm_responses', maxsize=settings.LLM_RESPONSE_CACHE_SIZE,
+                                     ttl=settings.LLM_RESPONSE_CACHE_TTL_S)
+    return _response_cache
+
+
+def _response_cache_key(provider: str, prompt: str, model: Optional[str], tools: Union[ToolRegistry, dict, None]) -> str:
+    """Hash of everything that determines a completion: provider, model, prompt and offered tools."""
+    model = model or (settings.GROQ_MODEL if provider == 'groq' else settings.RAG_MODEL)
+    registry = _as_registry(tools)
+    payload = json.dumps([provider, model, prompt, registry.groq_tools() if registry else None],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
 
-def _generate_groq(prompt: str, model: Optional[str] = None, tools: Optional[dict] = None) -> LLMResponse:
+GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+
+
+def _groq_request(prompt: str, model: Optional[str], tools: Union[ToolRegistry, dict, None]) -> tuple:
+    """Build (model, headers, payload) for a Groq chat-completions call."""
     # Prevent accidentally passing Gemini model names to the Groq endpoint.
     # If a caller provided a model that looks like a Gemini model (e.g. 'gemini-...'),
     # fall back to the configured GROQ_MODEL to avoid misrouting requests.
@@ -55,148 +388,302 @@ def _generate_groq(prompt: str, model: Optional[str] = None, tools: Optional[dic
     if not api_key:
         raise RuntimeError("GROQ_API_KEY not configured in settings")
 
-    url = "https://api.groq.com/openai/v1/chat/completions"
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    # If tools are provided, describe them and instruct the model to output JSON
-    if tools:
-        # Build a short description for each tool
-        tool_descriptions = []
-        for tname, tfunc in tools.items():
-            try:
-                import inspect
-                sig = inspect.signature(tfunc)
-                params = ', '.join([p for p in sig.parameters.keys()])
-            except Exception:
-                params = ''
-            tool_descriptions.append(f"{tname}({params})")
-        tool_text = "Available tools:\n" + "\n".join(tool_descriptions)
-        # Instruction: ask to output JSON when calling a tool
-        instruction = (
-            "If you must call a tool to answer the user's query, respond with a single JSON object only. "
-            "The object must have 'tool' and 'args' properties like: {\"tool\": \"get_exchange_rate\", \"args\": {\"source_currency\": \"USD\", \"target_currency\": \"NGN\"}}.\n"
-            "If you do not need a tool, respond with final text answer.\n"
-        )
-        prompt = instruction + tool_text + "\nUSER QUERY:\n" + prompt
-
+    messages = [{"role": "user", "content": prompt}]
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "temperature": 0.7
     }
+    # If tools are provided, send the precompiled manifest: natively as function schemas,
+    # or as a cached text prefix instructing the model to answer with a JSON object.
+    registry = _as_registry(tools)
+    native_tools = bool(registry) and settings.LLM_NATIVE_TOOL_CALLING
+    if registry:
+        prefix = registry.prompt_prefix('groq', native=native_tools)
+        if native_tools:
+            messages.insert(0, {"role": "system", "content": prefix})
+            payload["tools"] = registry.groq_tools()
+            payload["tool_choice"] = "auto"
+        else:
+            messages[0]["content"] = prefix + "\nUSER QUERY:\n" + prompt
+    return model, headers, payload
+
+
+class RetryPolicy:
+    """How a call site retries and hedges Groq requests across the fallback models.
+
+    Args:
+        max_attempts: Total attempts (primary plus retries) per request chain.
+        base_delay_s / max_delay_s: Exponential backoff bounds; each sleep is drawn with
+            full jitter, uniformly from [0, min(max_delay_s, base_delay_s * 2**retry)].
+        hedge: If the primary model has not answered by its observed p95 latency, send a
+            duplicate request to the next fallback model and take the first success.
+        hedge_delay_s: Fixed hedge delay; None uses the primary model's p95 latency
+            (or settings.LLM_HEDGE_DEFAULT_DELAY_S until enough samples exist).
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay_s: float = 0.25, max_delay_s: float = 4.0,
+                 hedge: bool = False, hedge_delay_s: Optional[float] = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.hedge = hedge
+        self.hedge_delay_s = hedge_delay_s
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0.0, min(self.max_delay_s, self.base_delay_s * (2 ** retry)))
+
+
+class RetryBudget:
+    """Token bucket capping retries (and hedges) to a fraction of request volume.
+
+    Every request deposits ``ratio`` tokens and every retry withdraws one, so under a
+    provider outage retries stay at ~ratio x traffic instead of multiplying it. A
+    small reserve refilled at ``min_per_s`` keeps low-traffic processes able to retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_s: float = 1.0, capacity: float = 20.0):
+        self.ratio = ratio
+        self.min_per_s = min_per_s
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.min_per_s)
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, pct: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+
+retry_budget = RetryBudget(ratio=settings.LLM_RETRY_BUDGET_RATIO)
+latency_tracker = LatencyTracker()
+
+# Per-call-site policies: the tool-decision call is latency critical and hedged; the final
+# synthesis is longer and only retried. Override with set_retry_policy().
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    name: RetryPolicy(
+        max_attempts=settings.LLM_RETRY_MAX_ATTEMPTS,
+        base_delay_s=settings.LLM_RETRY_BASE_DELAY_S,
+        max_delay_s=settings.LLM_RETRY_MAX_DELAY_S,
+        hedge=name in settings.LLM_HEDGE_CALL_SITES,
+    )
+    for name in ('default', 'tool_decision', 'synthesis')
+}
+
+
+def set_retry_policy(call_site: str, policy: RetryPolicy):
+    RETRY_POLICIES[call_site] = policy
+
+
+def _policy_for(call_site: Optional[str], tools: Any) -> RetryPolicy:
+    # Callers that don't name their call site are classified by whether tools were offered
+    call_site = call_site or ('tool_decision' if tools else 'synthesis')
+    return RETRY_POLICIES.get(call_site) or RETRY_POLICIES['default']
+
+
+class _GroqAttemptError(Exception):
+    """One failed Groq attempt, classified for the retry loop."""
+
+    def __init__(self, cause: Exception, retryable: bool, immediate: bool = False):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.retryable = retryable
+        # Retry on the next model without backoff (e.g. decommissioned model)
+        self.immediate = immediate
+
+
+def _groq_attempt(model: str, headers: dict, payload: dict) -> LLMResponse:
+    body = dict(payload, model=model)
+    start = time.monotonic()
+    try:
+        r = requests.post(GROQ_CHAT_URL, json=body, headers=headers, timeout=deadline.timeout_for(30))
+    except deadline.DeadlineExceeded:
+        raise
+    except requests.RequestException as exc:
+        # Timeouts and connection errors are worth retrying elsewhere
+        raise _GroqAttemptError(exc, retryable=True)
 
-    logger.debug("Calling Groq model %s", model)
-    r = requests.post(url, json=payload, headers=headers, timeout=30)
     try:
         r.raise_for_status()
         data = r.json()
-    except Exception:
+    except Exception as exc:
         # Log detailed response body to help debugging 4xx/5xx errors from Groq
-        body_text = None
-        body_json = None
         try:
             body_text = r.text
         except Exception:
             body_text = '<could not read response body>'
-        logger.error("Groq API returned error %s: %s", getattr(r, 'status_code', 'N/A'), body_text)
-
-        # Try to parse JSON body to detect decommissioned model errors and retry with fallbacks
+        status = getattr(r, 'status_code', None)
+        logger.error("Groq API returned error %s: %s", status if status is not None else 'N/A', body_text)
         try:
             body_json = r.json()
         except Exception:
             body_json = None
-
-        code = None
-        message = ''
+        code, message, err = None, '', {}
         if isinstance(body_json, dict):
             err = body_json.get('error') or {}
             if isinstance(err, dict):
                 code = err.get('code')
-                message = err.get('message', '')
+                message = err.get('message', '') or ''
             else:
                 message = str(err)
+                err = {}
 
-        # If model was decommissioned, attempt fallback models
-        if code == 'model_decommissioned' or 'decommission' in (message or '').lower():
-            # Use configured fallback list if present, otherwise default list
-            fallback_models = getattr(settings, 'GROQ_FALLBACK_MODELS', [])
-            if settings.GROQ_MODEL not in fallback_models:
-                fallback_models = [settings.GROQ_MODEL] + list(fallback_models)
-            # Ensure uniqueness and preserve order
-            seen = set()
-            fallback_models = [m for m in fallback_models if m and (m not in seen and not seen.add(m))]
-
-            for fb in fallback_models:
-                if fb == model:
-                    continue
-
-        # If this is a rate limit / quota error, attempt retry with smaller/faster model
-        if getattr(r, 'status_code', None) == 429 or (code == 'RESOURCE_EXHAUSTED') or ('rate_limit' in (message or '').lower()):
-            rate_fallback_models = ['llama-3.1-8b-instant', 'llama-3.3-70b-versatile', 'groq-1.0']
-            for i, fb in enumerate(rate_fallback_models):
-                if fb == model:
-                    continue
-                logger.info("Rate-limited by Groq; retrying with model: %s", fb)
-                payload['model'] = fb
-                time.sleep(0.5 * (i + 1))
-                try:
-                    rr = requests.post(url, json=payload, headers=headers, timeout=30)
-                    rr.raise_for_status()
-                    data = rr.json()
-                    model = fb
-                    r = rr
-                    break
-                except Exception:
-                    logger.warning("Retry with %s failed", fb)
-                    continue
-                logger.info("Retrying Groq request with fallback model '%s' due to decommissioned model", fb)
-                payload['model'] = fb
-                try:
-                    r = requests.post(url, json=payload, headers=headers, timeout=30)
-                    r.raise_for_status()
-                    data = r.json()
-                    model = fb
-                    break
-                except Exception:
-                    # Log and try next fallback
-                    try:
-                        logger.warning("Fallback model '%s' failed: %s", fb, r.text)
-                    except Exception:
-                        logger.warning("Fallback model '%s' failed (no body available)", fb)
-                    continue
-
-        # If we did not obtain a successful response after retries, re-raise original exception
-        if 'data' not in locals():
-            raise
-        
-    # Check for rate-limited responses (HTTP 429 or RESOURCE_EXHAUSTED) and retry with lightweight models
-    if getattr(r, 'status_code', None) == 429 or (isinstance(data, dict) and \
-            ((data.get('error') and (data['error'].get('status') == 'RESOURCE_EXHAUSTED' or 'rate_limit' in str(data['error']).lower())) or 'rate_limit' in json.dumps(data).lower())):
-        # Try fallback order: smaller Llama > configured groq fallbacks
-        default_rate_fallbacks = ['llama-3.1-8b-instant', 'llama-3.3-70b-versatile', 'groq-1.0']
-        rate_fallback_models = list(getattr(settings, 'GROQ_FALLBACK_MODELS', default_rate_fallbacks))
-        for i, fb in enumerate(rate_fallback_models):
-            if fb == model:
-                continue
-            logger.info("Rate-limited by Groq; retrying with fallback model: %s", fb)
-            payload['model'] = fb
-            # backoff: short increasing delay
-            time.sleep(0.5 * (i + 1))
-            try:
-                r = requests.post(url, json=payload, headers=headers, timeout=30)
-                r.raise_for_status()
-                data = r.json()
-                model = fb
+        # The model produced a malformed native tool call; Groq returns the raw generation,
+        # which usually still contains a parseable JSON call.
+        if code == 'tool_use_failed':
+            failed = err.get('failed_generation') or ''
+            return LLMResponse(text=failed, function_calls=_parse_text_tool_calls(failed))
+        if code == 'model_decommissioned' or 'decommission' in message.lower():
+            raise _GroqAttemptError(exc, retryable=True, immediate=True)
+        rate_limited = status == 429 or code == 'RESOURCE_EXHAUSTED' or 'rate_limit' in message.lower()
+        raise _GroqAttemptError(exc, retryable=rate_limited or (status is not None and status >= 500))
+
+    # Some gateways report quota errors in a 200 body
+    err = data.get('error') if isinstance(data, dict) else None
+    if err and ('RESOURCE_EXHAUSTED' in str(err) or 'rate_limit' in str(err).lower()):
+        raise _GroqAttemptError(RuntimeError(f"Groq rate limited: {err}"), retryable=True)
+
+    latency_tracker.record(model, time.monotonic() - start)
+    return _parse_groq_response(data)
+
+
+def _groq_candidates(model: str) -> List[str]:
+    # Primary model first, then the configured fallbacks (unique, order preserved)
+    seen = set()
+    return [m for m in [model] + list(settings.GROQ_FALLBACK_MODELS) if m and not (m in seen or seen.add(m))]
+
+
+def _groq_with_retries(models: List[str], headers: dict, payload: dict, policy: RetryPolicy,
+                       cancelled: Optional[threading.Event] = None) -> LLMResponse:
+    """Try ``models`` in order with jittered exponential backoff until one succeeds."""
+    last: Optional[_GroqAttemptError] = None
+    for attempt in range(policy.max_attempts):
+        if cancelled is not None and cancelled.is_set():
+            break
+        if attempt:
+            if not retry_budget.try_withdraw():
+                logger.warning("Groq retry budget exhausted; not retrying")
+                break
+            delay = 0.0 if last.immediate else policy.backoff(attempt - 1)
+            if delay and not deadline.sleep(delay):
+                logger.warning("Request deadline reached; not retrying Groq")
+                break
+        model = models[attempt % len(models)]
+        if attempt:
+            logger.info("Retrying Groq request with fallback model '%s'", model)
+        logger.debug("Calling Groq model %s", model)
+        try:
+            return _groq_attempt(model, headers, payload)
+        except _GroqAttemptError as exc:
+            last = exc
+            if not exc.retryable:
                 break
-            except Exception:
-                logger.warning("Fallback model '%s' also failed (rate-limit or other).", fb)
-                continue
-    
+    if last is None:
+        raise RuntimeError("Groq request cancelled")
+    raise last.cause
+
+
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_lock = threading.Lock()
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+def _groq_hedged(models: List[str], headers: dict, payload: dict, policy: RetryPolicy) -> LLMResponse:
+    """Run the primary chain; if it is slower than its p95, race a chain starting at the next model."""
+    delay = policy.hedge_delay_s
+    if delay is None:
+        delay = latency_tracker.percentile(models[0], 95) or settings.LLM_HEDGE_DEFAULT_DELAY_S
+    executor = _get_hedge_executor()
+    primary_cancel, hedge_cancel = threading.Event(), threading.Event()
+    primary = executor.submit(deadline.run_in_context(_groq_with_retries, models, headers, payload, policy, primary_cancel))
+    done, _ = wait([primary], timeout=delay)
+    if done or not deadline.can_wait(0) or not retry_budget.try_withdraw():
+        return primary.result()
+
+    logger.info("Groq model %s slower than %.2fs; hedging with %s", models[0], delay, models[1])
+    hedge = executor.submit(deadline.run_in_context(_groq_with_retries, models[1:] + models[:1], headers, payload,
+                                                    policy, hedge_cancel))
+    cancels = {primary: primary_cancel, hedge: hedge_cancel}
+    error: Optional[Exception] = None
+    for future in as_completed(cancels):
+        try:
+            result = future.result()
+        except Exception as exc:
+            error = error or exc
+            continue
+        # Cancel the loser: it stops retrying and its in-flight response is discarded
+        for other, cancel in cancels.items():
+            if other is not future:
+                cancel.set()
+                other.cancel()
+        return result
+    raise error
+
+
+def _generate_groq(prompt: str, model: Optional[str] = None, tools: Union[ToolRegistry, dict, None] = None,
+                   call_site: Optional[str] = None) -> LLMResponse:
+    model, headers, payload = _groq_request(prompt, model, tools)
+    policy = _policy_for(call_site, tools)
+    models = _groq_candidates(model)
+    retry_budget.deposit()
+    if policy.hedge and len(models) > 1:
+        return _groq_hedged(models, headers, payload, policy)
+    return _groq_with_retries(models, headers, payload, policy)
+
+
+def _parse_groq_response(data: dict) -> LLMResponse:
     # Parse Groq OpenAI-compatible response format
     text = ""
+    native_calls = []
     if "choices" in data and len(data["choices"]) > 0:
         choice = data["choices"][0]
         if "message" in choice:
-            text = choice["message"].get("content", "")
+            text = choice["message"].get("content") or ""
+            native_calls = choice["message"].get("tool_calls") or []
         elif "text" in choice:
             text = choice.get("text", "")
 
@@ -213,24 +700,43 @@ def _generate_groq(prompt: str, model: Optional[str] = None, tools: Optional[dic
             else:
                 text = str(out)
 
+    if native_calls:
+        return LLMResponse(text=text, function_calls=_parse_native_tool_calls(native_calls))
+    # Otherwise the model may have expressed the call as a JSON snippet in its text
+    return LLMResponse(text=text, function_calls=_parse_text_tool_calls(text))
+
+
+def _parse_native_tool_calls(tool_calls: List[dict]) -> List[dict]:
+    # OpenAI-compatible shape: {"function": {"name": ..., "arguments": "<json string>"}}
     function_calls = []
-    # If prompt instructed JSON function call, extract JSON snippet and parse
-    json_snippet = _extract_json_snippet(text)
-    if json_snippet:
-        try:
-            parsed = json.loads(json_snippet)
-            # Make it a list of calls if not
-            if isinstance(parsed, list):
-                function_calls = parsed
-            else:
-                function_calls = [parsed]
-        except json.JSONDecodeError:
-            logger.debug("Groq output included JSON-looking snippet but failed parsing")
+    for call in tool_calls:
+        fn = call.get('function') or {}
+        args = fn.get('arguments') or {}
+        if isinstance(args, str):
+            try:
+                args = json.loads(args) if args.strip() else {}
+            except json.JSONDecodeError:
+                logger.debug("Groq native tool call had unparseable arguments: %s", args)
+                args = {}
+        function_calls.append({"tool": fn.get('name'), "args": args})
+    return function_calls
 
-    return LLMResponse(text=text, function_calls=function_calls)
 
+def _parse_text_tool_calls(text: str) -> List[Any]:
+    # If prompt instructed JSON function call, pick every tool-call object out of the text
+    return ToolCallStreamParser().feed(text or '')
 
-def _generate_gemini(prompt: str, model: Optional[str] = None, tools: Optional[dict] = None) -> LLMResponse:
+
+def _gemini_client(genai):
+    # Bound the SDK's HTTP timeout (milliseconds) by the remaining request budget
+    left = deadline.remaining()
+    if left is None:
+        return genai.Client(api_key=settings.GEMINI_API_KEY)
+    deadline.check()
+    return genai.Client(api_key=settings.GEMINI_API_KEY, http_options={"timeout": int(left * 1000)})
+
+
+def _generate_gemini(prompt: str, model: Optional[str] = None, tools: Union[ToolRegistry, dict, None] = None) -> LLMResponse:
     try:
         from google import genai
     except Exception as exc:
@@ -239,11 +745,18 @@ def _generate_gemini(prompt: str, model: Optional[str] = None, tools: Optional[d
     model = model or settings.RAG_MODEL
     if not settings.GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY not configured in settings")
-    client = genai.Client(api_key=settings.GEMINI_API_KEY)
-    # genai SDK: keep the same behavior that was used previously
-    # The genai SDK may support function calling via specialized params; for simplicity
-    # we rely on the LLM to include function calls in `resp.function_calls` when needed.
-    resp = client.models.generate_content(model=model, contents=prompt)
+    client = _gemini_client(genai)
+    registry = _as_registry(tools)
+    if registry:
+        # Native function declarations; automatic calling is disabled so the agent executes tools
+        config = {
+            "tools": registry.gemini_tools(),
+            "system_instruction": registry.prompt_prefix('gemini', native=True),
+            "automatic_function_calling": {"disable": True},
+        }
+        resp = client.models.generate_content(model=model, contents=prompt, config=config)
+    else:
+        resp = client.models.generate_content(model=model, contents=prompt)
     # Map to LLMResponse
     text = getattr(resp, 'text', '')
     function_calls = []
@@ -251,3 +764,120 @@ def _generate_gemini(prompt: str, model: Optional[str] = None, tools: Optional[d
     if getattr(resp, 'function_calls', None):
         function_calls = list(resp.function_calls)
     return LLMResponse(text=text, function_calls=function_calls)
+
+
+def stream_content(prompt: str, model: Optional[str] = None, tools: Union[ToolRegistry, dict, None] = None,
+                   on_tool_call: Optional[Callable[[Any], None]] = None) -> LLMResponse:
+    """Stream a generation and hand each tool call to ``on_tool_call`` as soon as it is complete.
+
+    Tool calls are recognised while the model is still generating (native tool-call
+    deltas, or JSON objects in the streamed text), so callers can start executing
+    tools before the completion finishes. Returns the full response at the end.
+    """
+    provider = settings.LLM_PROVIDER.lower()
+    if provider == 'groq':
+        return _stream_groq(prompt, model, tools, on_tool_call)
+    elif provider == 'gemini':
+        return _stream_gemini(prompt, model, tools, on_tool_call)
+    else:
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+
+
+def _emit_all(resp: LLMResponse, on_tool_call: Optional[Callable[[Any], None]]) -> LLMResponse:
+    if on_tool_call:
+        for call in resp.function_calls:
+            on_tool_call(call)
+    return resp
+
+
+def _stream_groq(prompt: str, model: Optional[str], tools: Union[ToolRegistry, dict, None],
+                 on_tool_call: Optional[Callable[[Any], None]]) -> LLMResponse:
+    model, headers, payload = _groq_request(prompt, model, tools)
+    payload["stream"] = True
+    try:
+        r = requests.post(GROQ_CHAT_URL, json=payload, headers=headers, timeout=deadline.timeout_for(30), stream=True)
+        r.raise_for_status()
+    except requests.RequestException:
+        # Errors (rate limits, decommissioned models) are handled by the non-streaming fallbacks
+        logger.warning("Groq streaming request failed; retrying without streaming")
+        return _emit_all(_generate_groq(prompt, model, tools), on_tool_call)
+
+    parser = ToolCallStreamParser()
+    text_parts: List[str] = []
+    function_calls: List[dict] = []
+    pending: Dict[int, dict] = {}
+
+    def emit(call: dict):
+        function_calls.append(call)
+        if on_tool_call:
+            on_tool_call(call)
+
+    def flush_native(below: Optional[int] = None):
+        # A native tool call is complete once a later index starts (or the stream ends)
+        for idx in sorted(pending):
+            if below is not None and idx >= below:
+                break
+            emit(_parse_native_tool_calls([pending.pop(idx)])[0])
+
+    for line in r.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            break
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        for choice in event.get('choices') or []:
+            delta = choice.get('delta') or {}
+            content = delta.get('content')
+            if content:
+                text_parts.append(content)
+                for call in parser.feed(content):
+                    emit(call)
+            for tc in delta.get('tool_calls') or []:
+                idx = tc.get('index', 0)
+                flush_native(below=idx)
+                entry = pending.setdefault(idx, {"function": {"name": "", "arguments": ""}})
+                fn = tc.get('function') or {}
+                entry["function"]["name"] += fn.get('name') or ''
+                entry["function"]["arguments"] += fn.get('arguments') or ''
+    flush_native()
+    return LLMResponse(text=''.join(text_parts), function_calls=function_calls)
+
+
+def _stream_gemini(prompt: str, model: Optional[str], tools: Union[ToolRegistry, dict, None],
+                   on_tool_call: Optional[Callable[[Any], None]]) -> LLMResponse:
+    try:
+        from google import genai
+    except Exception as exc:
+        raise RuntimeError("genai SDK not available") from exc
+
+    model = model or settings.RAG_MODEL
+    if not settings.GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY not configured in settings")
+    client = _gemini_client(genai)
+    registry = _as_registry(tools)
+    kwargs = {}
+    if registry:
+        kwargs["config"] = {
+            "tools": registry.gemini_tools(),
+            "system_instruction": registry.prompt_prefix('gemini', native=True),
+            "automatic_function_calling": {"disable": True},
+        }
+    parser = ToolCallStreamParser()
+    text_parts: List[str] = []
+    function_calls: List[Any] = []
+    for chunk in client.models.generate_content_stream(model=model, contents=prompt, **kwargs):
+        # Gemini delivers each native function call whole within a chunk
+        calls = list(getattr(chunk, 'function_calls', None) or [])
+        chunk_text = getattr(chunk, 'text', None) or ''
+        if chunk_text:
+            text_parts.append(chunk_text)
+            calls.extend(parser.feed(chunk_text))
+        for call in calls:
+            function_calls.append(call)
+            if on_tool_call:
+                on_tool_call(call)
+    return LLMResponse(text=''.join(text_parts), function_calls=function_calls)
@@ -1,13 +1,27 @@
-import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from api import router as api_router
 from config import settings
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Keep hot exchange-rate tables warm while the server runs (imported here: not needed at worker import)
+    prefetch = None
+    if settings.RATE_PREFETCH_ENABLED:
+        from tools import rate_prefetch as prefetch
+        prefetch.start()
+    yield
+    if prefetch is not None:
+        await prefetch.stop()
+
+
 # Initialize the FastAPI app
 app = FastAPI(
     title=f"{settings.APP_NAME} API",
     version="1.0.0",
-    description="Backend for the Financial Intelligence Platform powered by configurable LLM providers (Gemini/Groq)."
+    description="Backend for the Financial Intelligence Platform powered by configurable LLM providers (Gemini/Groq).",
+    lifespan=lifespan
 )
 
 # Include the main query router
@@ -19,7 +33,9 @@ def health_check():
     return {"status": "ok", "environment": settings.ENVIRONMENT}
 
 if __name__ == "__main__":
-    # This runs the application server
+    # This runs the application server (uvicorn is only needed here, not when a worker imports the app)
+    import uvicorn
+
     uvicorn.run(
         app,
         host=settings.HOST,
@@ -0,0 +1,243 @@
+# session_memory.py
+"""Conversation sessions: compact server-side turns, summarized history and reusable tool results.
+
+A session stores, per turn, the question, the (truncated) answer, the tools used
+and the ids of the chunks retrieved for it, plus the recent tool results keyed by
+tool and arguments. Sessions live in a cache backend (``utils.cache.make_cache``),
+so with ``CACHE_BACKEND=sqlite`` a follow-up can land on any worker.
+
+The history sent to the LLM stays under ``SESSION_CONTEXT_TOKEN_BUDGET``: the last
+``SESSION_KEEP_TURNS`` turns are kept verbatim and older ones are folded into a
+rolling extractive summary (question plus the first sentence of the answer). The
+oldest summary lines are dropped to stay within the budget, and the summary never
+takes more than half of it.
+
+While the agent runs inside ``session_scope(session)``, a tool call with the same
+arguments as an earlier one in the session reuses that result while it is younger
+than its ``SESSION_TOOL_RESULT_TTL_S`` entry, so follow-ups skip repeated lookups.
+Failed results are not kept, and results of document tools are only reused while
+the index is unchanged (``rag_retriever.index_version``).
+
+A turn loads the session, answers and saves it back, so two concurrent turns of one
+session would each save their own copy and the last save would drop the other turn.
+``locked(session_id)`` serializes the turns of a session within a process. Across
+workers sharing a sqlite backend the last save still wins; clients should wait for
+an answer before sending the follow-up.
+"""
+import contextvars
+import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from utils.cache import make_cache
+
+# Returned by the reuse lookups when there is no fresh result (None is a valid tool result)
+MISSING = object()
+
+# Tools answering from the document index: their results go stale when the index changes
+_INDEX_TOOLS = frozenset({'generate_rag_answer'})
+
+
+def _estimate_tokens(text: str) -> int:
+    # imported on use: the context builder pulls in the retriever module
+    from tools.context_builder import estimate_tokens
+    return estimate_tokens(text)
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+
+def tool_key(tool_name: str, args: dict) -> str:
+    return f"{tool_name}:{json.dumps(args, sort_keys=True, default=str)}"
+
+
+def _index_version(tool_name: str) -> Optional[int]:
+    if tool_name not in _INDEX_TOOLS:
+        return None
+    # imported on use: the retriever is only loaded once a document tool has run
+    from tools import rag_retriever
+    return rag_retriever.index_version()
+
+
+def _failed(result: Any) -> bool:
+    return isinstance(result, dict) and (bool(result.get('error')) or result.get('audit_success') is False)
+
+
+@dataclass
+class Session:
+    session_id: str
+    summary: List[str] = field(default_factory=list)
+    # {"query", "answer", "tools", "chunk_ids", "at"}
+    turns: List[dict] = field(default_factory=list)
+    # tool_key -> {"tool", "result", "at", "index_version"}
+    tool_results: Dict[str, dict] = field(default_factory=dict)
+    # chunk ids retrieved by RAG calls of the turn in progress
+    pending_chunk_ids: List[str] = field(default_factory=list)
+    # tool calls of one turn run on the planner and tool threads at the same time
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    def __getstate__(self) -> dict:
+        # sessions are pickled by the sqlite cache backend; locks are not picklable
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_turn(self, query: str, answer: str, tools: List[str]):
+        with self._lock:
+            chunk_ids, self.pending_chunk_ids = list(dict.fromkeys(self.pending_chunk_ids)), []
+        self.turns.append({
+            "query": query,
+            "answer": answer[:settings.SESSION_MAX_ANSWER_CHARS],
+            "tools": list(tools),
+            "chunk_ids": chunk_ids,
+            "at": time.time(),
+        })
+        self._compact()
+
+    def _compact(self):
+        """Fold turns beyond the verbatim window (or over the token budget) into the summary."""
+        while len(self.turns) > settings.SESSION_KEEP_TURNS or (
+                len(self.turns) > 1 and _estimate_tokens(self.render()) > settings.SESSION_CONTEXT_TOKEN_BUDGET):
+            turn = self.turns.pop(0)
+            self.summary.append(f"- {_first_sentence(turn['query'], 120)} -> {_first_sentence(turn['answer'])}")
+        budget = settings.SESSION_CONTEXT_TOKEN_BUDGET
+        while self.summary and (_estimate_tokens("\n".join(self.summary)) > budget // 2
+                                or _estimate_tokens(self.render()) > budget):
+            self.summary.pop(0)
+        # a single oversized turn: shorten its stored answer
+        while self.turns and self.turns[-1]["answer"] and _estimate_tokens(self.render()) > budget:
+            answer = self.turns[-1]["answer"]
+            self.turns[-1]["answer"] = answer[:int(len(answer) * 0.8)]
+
+    def render(self) -> str:
+        """History block for the prompt ('' for a new session)."""
+        parts = []
+        if self.summary:
+            parts.append("Earlier in this conversation:\n" + "\n".join(self.summary))
+        if self.turns:
+            parts.append("Recent turns:\n" + "\n".join(
+                f"User: {t['query']}\nAssistant: {t['answer']}" for t in self.turns))
+        return "\n\n".join(parts)
+
+    def record_tool(self, tool_name: str, args: dict, result: Any):
+        if _failed(result):
+            # a retry should run the tool again, not replay the failure
+            return
+        key = tool_key(tool_name, args)
+        entry = {"tool": tool_name, "result": result, "at": time.time(), "index_version": _index_version(tool_name)}
+        with self._lock:
+            self.tool_results.pop(key, None)
+            self.tool_results[key] = entry
+            if isinstance(result, dict) and result.get('chunk_ids'):
+                self.pending_chunk_ids.extend(result['chunk_ids'])
+            while len(self.tool_results) > settings.SESSION_MAX_TOOL_RESULTS:
+                self.tool_results.pop(next(iter(self.tool_results)))
+
+    def fresh_tool_result(self, tool_name: str, args: dict) -> Any:
+        """The stored result of this exact call if still fresh, else ``MISSING``."""
+        with self._lock:
+            entry = self.tool_results.get(tool_key(tool_name, args))
+        if entry is None:
+            return MISSING
+        ttl = settings.SESSION_TOOL_RESULT_TTL_S.get(tool_name, settings.SESSION_TOOL_RESULT_DEFAULT_TTL_S)
+        if time.time() - entry["at"] >= ttl or entry.get("index_version") != _index_version(tool_name):
+            return MISSING
+        return entry["result"]
+
+
+_store = None
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        _store = make_cache('sessions', maxsize=settings.SESSION_MAX_SESSIONS, ttl=settings.SESSION_TTL_S)
+    return _store
+
+
+# session_id -> [lock, number of turns holding or waiting for it]; entries go away when unused
+_locks: Dict[str, list] = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def locked(session_id: str):
+    """Hold the per-session lock of ``session_id`` (load, answer and save one turn at a time)."""
+    with _locks_guard:
+        entry = _locks.setdefault(session_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _locks[session_id]
+
+
+def load(session_id: Optional[str] = None) -> Session:
+    """The stored session, or a new one (with a fresh id when ``session_id`` is None)."""
+    if session_id:
+        session = _get_store().get(session_id)
+        if session is not None:
+            return session
+    return Session(session_id or uuid.uuid4().hex)
+
+
+def save(session: Session):
+    _get_store().set(session.session_id, session)
+
+
+def delete(session_id: str):
+    _get_store().delete(session_id)
+
+
+def with_history(session: Session, user_query: str) -> str:
+    """The prompt for ``user_query`` with the session history in front of it."""
+    history = session.render()
+    if not history:
+        return user_query
+    return f"CONVERSATION HISTORY:\n{history}\n\nCURRENT QUESTION:\n{user_query}"
+
+
+_current: contextvars.ContextVar[Optional[Session]] = contextvars.ContextVar('session', default=None)
+
+
+@contextmanager
+def session_scope(session: Session):
+    """Make ``session`` the current one for tool-result reuse inside the block."""
+    token = _current.set(session)
+    try:
+        yield session
+    finally:
+        _current.reset(token)
+
+
+def reuse_tool_result(tool_name: str, args: dict) -> Any:
+    """Fresh result of the same call in the current session, else ``MISSING``."""
+    session = _current.get()
+    if session is None:
+        return MISSING
+    return session.fresh_tool_result(tool_name, args)
+
+
+def record_tool_result(tool_name: str, args: dict, result: Any):
+    session = _current.get()
+    if session is not None:
+        session.record_tool(tool_name, args, result)
+
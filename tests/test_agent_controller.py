@@ -100,6 +100,8 @@ def test_agent_handles_multiple_tools(monkeypatch):
 
 def test_agent_rejects_invalid_tool_args(monkeypatch):
     settings.LLM_PROVIDER = 'groq'
+    # Without routing there is no larger model to escalate to, so the invalid call is reported
+    monkeypatch.setattr(settings, 'MODEL_ROUTING_ENABLED', False)
     if hasattr(agent_controller, 'client'):
         agent_controller.client = None
 
@@ -184,3 +186,55 @@ def test_get_exchange_rate_raises_tool_error(monkeypatch):
     monkeypatch.setattr('tools.currency_tool.requests.get', fake_get)
     with pytest.raises(ToolExecutionError):
         get_exchange_rate('USD', 'NGN')
+
+
+def test_agent_streaming_runs_tools_as_calls_arrive(monkeypatch):
+    settings.LLM_PROVIDER = 'groq'
+    monkeypatch.setattr(settings, 'AGENT_STREAM_TOOL_CALLS', True)
+
+    def fake_stream_content(prompt, model=None, tools=None, on_tool_call=None):
+        calls = [{'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD', 'target_currency': 'NGN'}}]
+        for call in calls:
+            on_tool_call(call)
+        return DummyResp(function_calls=calls)
+
+    monkeypatch.setattr(agent_controller, 'stream_content', fake_stream_content)
+    monkeypatch.setattr(agent_controller, 'generate_content', lambda prompt, model=None, tools=None: DummyResp(text='1 USD = 800 NGN'))
+    mock_get_rate = Mock(return_value=800)
+    agent_controller.tools['get_exchange_rate'] = mock_get_rate
+
+    result = agent_controller.process_query_with_agent('Stream a conversion')
+    assert result['final_answer'] == '1 USD = 800 NGN'
+    assert result['used_tools'] == ['get_exchange_rate']
+    mock_get_rate.assert_called_once_with(source_currency='USD', target_currency='NGN')
+
+
+def test_agent_routes_simple_steps_to_fast_model_and_escalates(monkeypatch):
+    settings.LLM_PROVIDER = 'groq'
+    monkeypatch.setattr(settings, 'MODEL_ROUTING_ENABLED', True)
+    monkeypatch.setattr(settings, 'ROUTER_FAST_MODEL', 'fast-model')
+    monkeypatch.setattr(settings, 'RAG_MODEL', 'large-model')
+    models = []
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        models.append(model)
+        if tools is None:
+            return DummyResp(text='1 USD = 800 NGN')
+        if model == 'fast-model':
+            # Small model forgets a required argument
+            return DummyResp(function_calls=[{'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD'}}])
+        return DummyResp(function_calls=[{'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD', 'target_currency': 'NGN'}}])
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    monkeypatch.setattr(agent_controller, 'model_router', agent_controller.model_router.__class__())
+    mock_get_rate = Mock(return_value=800)
+    agent_controller.tools['get_exchange_rate'] = mock_get_rate
+
+    result = agent_controller.process_query_with_agent('USD to NGN rate')
+    assert result['final_answer'] == '1 USD = 800 NGN'
+    # decision on the fast model, escalation to the large one, single-lookup synthesis back on the fast model
+    assert models == ['fast-model', 'large-model', 'fast-model']
+    mock_get_rate.assert_called_once_with(source_currency='USD', target_currency='NGN')
+    stats = agent_controller.model_router.stats()
+    assert stats['fast']['calls'] == 2 and stats['fast']['escalations'] == 1
+    assert stats['large']['calls'] == 1
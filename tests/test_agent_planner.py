@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import pytest
+
+import agent_controller
+import agent_planner
+from agent_planner import Plan, PlanError, PlanStep
+from config import settings
+
+KNOWN = {'verify_company_registry', 'generate_rag_answer', 'get_exchange_rate'}
+
+
+class DummyResp:
+    def __init__(self, text='', function_calls=None):
+        self.text = text
+        self.function_calls = function_calls or []
+
+
+def test_parse_plan_validates_and_infers_dependencies():
+    plan = agent_planner.parse_plan('Here is the plan: {"steps": ['
+                                    '{"id": "s1", "tool": "verify_company_registry", "args": {"company_name": "Acme"}},'
+                                    '{"id": "s2", "tool": "generate_rag_answer", "args": {"user_query": "Q3 revenue of {s1.name}"}}'
+                                    ']}', KNOWN)
+    assert [s.id for s in plan.steps] == ['s1', 's2'] and plan.steps[1].depends_on == ['s1']
+
+    with pytest.raises(PlanError, match='unknown tool'):
+        agent_planner.parse_plan('{"steps": [{"id": "s1", "tool": "delete_everything"}]}', KNOWN)
+    with pytest.raises(PlanError, match='cycle'):
+        agent_planner.parse_plan('{"steps": [{"id": "a", "tool": "get_exchange_rate", "depends_on": ["b"]},'
+                                 '{"id": "b", "tool": "get_exchange_rate", "depends_on": ["a"]}]}', KNOWN)
+    with pytest.raises(PlanError, match='No JSON'):
+        agent_planner.parse_plan('I would call the registry first.', KNOWN)
+
+
+def test_resolve_args_keeps_type_of_whole_references():
+    outputs = {'s1': {'name': 'Acme Corp', 'rates': [0.9, 0.8]}, 's2': 0.79}
+    args = agent_planner.resolve_args({'amount': '{s2}', 'rate': '{s1.rates.1}', 'query': 'Revenue of {s1.name}',
+                                       'literal': '{not_a_step}'}, outputs)
+    assert args == {'amount': 0.79, 'rate': 0.8, 'query': 'Revenue of Acme Corp', 'literal': '{not_a_step}'}
+    with pytest.raises(PlanError):
+        agent_planner.resolve_args({'q': '{s1.missing}'}, outputs)
+
+
+def test_independent_steps_run_concurrently_and_failures_skip_dependents():
+    plan = Plan([PlanStep('s1', 'slow'), PlanStep('s2', 'slow'), PlanStep('s3', 'boom'),
+                 PlanStep('s4', 'slow', {'x': '{s3}'}, ['s3']), PlanStep('s5', 'slow', {}, ['s4'])])
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def run_step(tool, args):
+        if tool == 'boom':
+            return tool, {'error': 'down'}, 'down'
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+        return tool, 'ok', None
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        start = time.perf_counter()
+        outcomes = agent_planner.execute_plan(plan, run_step, executor)
+        elapsed = time.perf_counter() - start
+
+    assert peak[0] == 2 and elapsed < 0.18
+    assert [o[2] for o in outcomes[:3]] == [None, None, 'down']
+    assert outcomes[3][2] == 'skipped because step s3 failed' and outcomes[4][2] == 'skipped because step s4 failed'
+
+
+def test_looks_multi_step():
+    assert agent_planner.looks_multi_step('Verify Acme in the registry and convert its Q3 revenue to GBP')
+    assert not agent_planner.looks_multi_step('Convert 100 USD to EUR')
+
+
+def test_agent_executes_plan_with_two_llm_calls(monkeypatch):
+    monkeypatch.setattr(settings, 'LLM_PROVIDER', 'groq')
+    monkeypatch.setattr(settings, 'AGENT_FAST_PATH_ENABLED', False)
+    monkeypatch.setattr(settings, 'MODEL_ROUTING_ENABLED', False)
+    prompts = []
+    plan = ('{"steps": ['
+            '{"id": "s1", "tool": "verify_company_registry", "args": {"company_name": "Acme"}},'
+            '{"id": "s2", "tool": "generate_rag_answer", "args": {"user_query": "Q3 revenue of {s1.name}"}},'
+            '{"id": "s3", "tool": "get_exchange_rate", "args": {"source_currency": "USD", "target_currency": "GBP"}}]}')
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        prompts.append(prompt)
+        assert tools is None
+        if prompt.startswith(agent_planner.PLANNING_INSTRUCTION):
+            return DummyResp(text=plan)
+        return DummyResp(text='Acme is active; Q3 revenue was $500M (about 395M GBP).')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    rag = Mock(return_value={'answer': '$500M'})
+    monkeypatch.setitem(agent_controller.tools, 'verify_company_registry', Mock(return_value={'name': 'Acme Corp'}))
+    monkeypatch.setitem(agent_controller.tools, 'generate_rag_answer', rag)
+    monkeypatch.setitem(agent_controller.tools, 'get_exchange_rate', Mock(return_value=0.79))
+
+    result = agent_controller.process_query_with_agent('Verify Acme in the registry and convert its Q3 revenue to GBP')
+
+    assert len(prompts) == 2
+    assert result['final_answer'].startswith('Acme is active')
+    assert result['used_tools'] == ['verify_company_registry', 'generate_rag_answer', 'get_exchange_rate']
+    rag.assert_called_once_with(user_query='Q3 revenue of Acme Corp')
+    assert 'get_exchange_rate: 0.79' in prompts[1]
+
+
+def test_unusable_plan_falls_back_to_single_round(monkeypatch):
+    monkeypatch.setattr(settings, 'LLM_PROVIDER', 'groq')
+    monkeypatch.setattr(settings, 'AGENT_FAST_PATH_ENABLED', False)
+    monkeypatch.setattr(settings, 'MODEL_ROUTING_ENABLED', False)
+    monkeypatch.setattr(settings, 'AGENT_PLANNING_MODE', 'always')
+    calls = []
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        calls.append(tools is not None)
+        if prompt.startswith(agent_planner.PLANNING_INSTRUCTION):
+            return DummyResp(text='not a plan')
+        return DummyResp(text='Hello!')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    assert agent_controller.process_query_with_agent('Hi there')['final_answer'] == 'Hello!'
+    assert calls == [False, True]
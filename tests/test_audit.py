@@ -0,0 +1,23 @@
+import json
+import logging
+
+import audit
+
+
+def test_audit_file_handler_attached_when_root_logger_already_configured(tmp_path, monkeypatch):
+    path = tmp_path / 'audit.log'
+    monkeypatch.setattr(audit, 'AUDIT_LOG_FILE', str(path))
+    monkeypatch.setattr(audit, '_configured', False)
+    root_handler = logging.StreamHandler()
+    logging.getLogger().addHandler(root_handler)
+    before = list(audit.logger.handlers)
+    try:
+        with audit.request_scope('req-1'):
+            audit.log_interaction("USER_QUERY", "What is the cash flow?")
+    finally:
+        logging.getLogger().removeHandler(root_handler)
+        for handler in audit.logger.handlers[len(before):]:
+            handler.close()
+            audit.logger.removeHandler(handler)
+    record = json.loads(path.read_text().strip().split(' | ', 2)[2])
+    assert record['query'] == "What is the cash flow?" and record['request_id'] == 'req-1'
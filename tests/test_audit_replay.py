@@ -0,0 +1,84 @@
+import json
+
+from tools.audit_replay import parse_audit_log, replay, summarize
+
+
+def _line(ts, kind, query, details):
+    record = {"timestamp": ts, "type": kind, "query": query, "response_details": details}
+    return f"2024-10-01 10:00:00,000 | INFO | {json.dumps(record)}\n"
+
+
+AUDIT_LINES = [
+    "2024-10-01 10:00:00,000 | INFO | Retrieving top 5 documents for query: x\n",
+    _line("2024-10-01T10:00:00", "TOOL_CALL", "Convert USD to NGN",
+          {"tool": "get_exchange_rate", "args": {"source_currency": "USD", "target_currency": "NGN"}, "result": 800.0}),
+    _line("2024-10-01T10:00:01", "USER_QUERY", "Convert USD to NGN",
+          {"final_answer": "1 USD = 800 NGN", "used_tools": ["get_exchange_rate"], "tool_errors": []}),
+    _line("2024-10-01T10:00:02", "USER_QUERY", "Hello there",
+          {"final_answer": "Hi!", "used_tools": [], "tool_errors": []}),
+]
+
+
+def test_parse_audit_log_groups_tool_calls_with_queries():
+    recorded = parse_audit_log(AUDIT_LINES)
+    assert [r.query for r in recorded] == ["Convert USD to NGN", "Hello there"]
+    first = recorded[0]
+    assert first.used_tools == ["get_exchange_rate"]
+    assert first.tool_calls[0].args == {"source_currency": "USD", "target_currency": "NGN"}
+    assert first.tool_calls[0].result == 800.0
+
+
+def test_replay_uses_recorded_results_and_reports_latency():
+    import agent_controller
+
+    original_tools = dict(agent_controller.tools)
+    results = replay(parse_audit_log(AUDIT_LINES), speed=0)
+    report = summarize(results)
+
+    assert report["queries"] == 2
+    assert report["errors"] == 0
+    assert report["tool_selection_match_rate"] == 1.0
+    assert report["latency_ms"]["max"] >= report["latency_ms"]["p50"]
+    # the agent is restored after the replay
+    assert agent_controller.tools == original_tools
+
+
+def test_parse_audit_log_keeps_concurrent_identical_queries_apart():
+    def line(ts, kind, details, request_id):
+        record = {"timestamp": ts, "type": kind, "query": "Rate?", "response_details": details,
+                  "request_id": request_id}
+        return f"2024-10-01 10:00:00,000 | INFO | {json.dumps(record)}\n"
+
+    lines = [
+        line("2024-10-01T10:00:00", "TOOL_CALL", {"tool": "get_exchange_rate", "result": 800.0}, "a"),
+        line("2024-10-01T10:00:00", "TOOL_CALL", {"tool": "get_exchange_rate", "result": 801.0}, "b"),
+        line("2024-10-01T10:00:01", "USER_QUERY", {"used_tools": ["get_exchange_rate"]}, "b"),
+        line("2024-10-01T10:00:02", "USER_QUERY", {"used_tools": ["get_exchange_rate"]}, "a"),
+    ]
+    recorded = parse_audit_log(lines)
+    assert [[c.result for c in r.tool_calls] for r in recorded] == [[801.0], [800.0]]
+
+
+def test_replay_makes_no_speculative_retrievals(monkeypatch):
+    from config import settings
+    from tools import rag_prefetch
+
+    real_calls = []
+
+    def real_retrieve(query, k):
+        real_calls.append(query)
+        return []
+
+    monkeypatch.setattr(settings, 'RAG_SPECULATIVE_PREFETCH', True)
+    monkeypatch.setattr(rag_prefetch, '_retrieve', real_retrieve)
+    lines = [
+        _line("2024-10-01T10:00:00", "TOOL_CALL", "Summarize the annual report risks",
+              {"tool": "generate_rag_answer", "args": {"query": "annual report risks"}, "result": {"answer": "FX risk"}}),
+        _line("2024-10-01T10:00:01", "USER_QUERY", "Summarize the annual report risks",
+              {"final_answer": "FX risk", "used_tools": ["generate_rag_answer"], "tool_errors": []}),
+    ]
+    started = rag_prefetch.stats()["started"]
+    results = replay(parse_audit_log(lines), speed=0)
+    assert [r.error for r in results] == [None]
+    assert rag_prefetch.stats()["started"] == started + 1 and real_calls == []
+    assert rag_prefetch._retrieve is real_retrieve
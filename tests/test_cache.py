@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import llm_client
+from config import settings
+from utils.cache import SQLiteCache, TieredCache, TTLCache, make_cache
+from utils.circuit_breaker import CircuitBreaker
+
+
+def _compute_in_worker(path, log_path, results):
+    cache = SQLiteCache(path, 'shared', ttl=60)
+
+    def compute():
+        with open(log_path, 'a') as f:
+            f.write(f"{os.getpid()}\n")
+        time.sleep(0.3)
+        return {'rates': {'EUR': 0.9}}
+
+    results.put(cache.get_or_compute('USD', compute))
+
+
+def test_ttl_cache_get_or_compute_is_single_flight():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 42
+
+    threads = [threading.Thread(target=cache.get_or_compute, args=('k', compute)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1] and cache.get('k') == 42
+
+
+def test_sqlite_cache_ttl_and_size_eviction(tmp_path, monkeypatch):
+    cache = SQLiteCache(str(tmp_path / 'c.sqlite3'), 'ns', maxsize=10, ttl=60)
+    other = SQLiteCache(str(tmp_path / 'c.sqlite3'), 'other', ttl=60)
+    cache.set('a', {'x': [1, 2]})
+    other.set('a', 'other namespace')
+    assert cache.get('a') == {'x': [1, 2]} and other.get('a') == 'other namespace'
+
+    cache.set('short', 1, ttl=0.05)
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    for i in range(30):
+        cache.set(f"k{i}", i, ttl=100 + i)
+    cache.evict()
+    # the entries closest to expiry went first
+    assert len(cache) == 10 and cache.get('k29') == 29 and cache.get('k0') is None
+    assert other.get('a') == 'other namespace'
+
+
+def test_sqlite_get_or_compute_across_processes(tmp_path):
+    path, log_path = str(tmp_path / 'c.sqlite3'), str(tmp_path / 'computed.log')
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_compute_in_worker, args=(path, log_path, results)) for _ in range(3)]
+    for w in workers:
+        w.start()
+    values = [results.get(timeout=30) for _ in workers]
+    for w in workers:
+        w.join(timeout=30)
+    assert values == [{'rates': {'EUR': 0.9}}] * 3
+    with open(log_path) as f:
+        assert len(f.read().split()) == 1
+
+
+def test_tiered_cache_shares_entries_between_workers(tmp_path):
+    path = str(tmp_path / 'c.sqlite3')
+    worker_a = TieredCache(TTLCache(ttl=5), SQLiteCache(path, 'rate_tables', ttl=60))
+    worker_b = TieredCache(TTLCache(ttl=5), SQLiteCache(path, 'rate_tables', ttl=60))
+    worker_a.set('USD', {'EUR': 0.9})
+    assert worker_b.get('USD') == {'EUR': 0.9}
+    # second read is served by worker B's local tier
+    assert worker_b.get('USD') == {'EUR': 0.9}
+    assert (worker_b.local.hits, worker_b.shared.hits, worker_b.misses) == (1, 1, 0)
+
+    worker_a.set('USD', {'EUR': 0.8})
+    assert worker_b.peek('USD') == {'EUR': 0.8}
+    worker_a.delete('USD')
+    assert worker_a.get('USD') is None
+
+
+def test_circuit_breaker_state_is_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'CACHE_BACKEND', 'sqlite')
+    monkeypatch.setattr(settings, 'CACHE_SQLITE_PATH', str(tmp_path / 'c.sqlite3'))
+    monkeypatch.setattr(settings, 'CACHE_LOCAL_TTL_S', 0.0)
+    worker_a = CircuitBreaker(failure_threshold=2, reset_timeout=60, backend=make_cache('cb', 100, 60))
+    worker_b = CircuitBreaker(failure_threshold=2, reset_timeout=60, backend=make_cache('cb', 100, 60))
+    worker_a.record_failure('get_exchange_rate')
+    worker_b.record_failure('get_exchange_rate')
+    assert worker_a.is_open('get_exchange_rate') and worker_b.is_open('get_exchange_rate')
+    worker_b.record_success('get_exchange_rate')
+    assert not worker_a.is_open('get_exchange_rate')
+
+
+def test_llm_response_cache_is_opt_in(monkeypatch):
+    monkeypatch.setattr(settings, 'LLM_PROVIDER', 'groq')
+    monkeypatch.setattr(llm_client, '_response_cache', TTLCache(ttl=60))
+    calls = []
+
+    def fake_groq(prompt, model=None, tools=None, call_site=None):
+        calls.append(prompt)
+        return llm_client.LLMResponse(text='', function_calls=[{'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD'}}])
+
+    monkeypatch.setattr(llm_client, '_generate_groq', fake_groq)
+    llm_client.generate_content('convert USD')
+    llm_client.generate_content('convert USD')
+    assert len(calls) == 2
+
+    monkeypatch.setattr(settings, 'LLM_RESPONSE_CACHE_ENABLED', True)
+    first = llm_client.generate_content('convert USD')
+    first.function_calls[0]['args']['source_currency'] = 'mutated'
+    second = llm_client.generate_content('convert USD')
+    assert len(calls) == 3
+    assert second.function_calls == [{'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD'}}]
+    # a different model is a different completion
+    llm_client.generate_content('convert USD', model='llama-3.1-8b-instant')
+    assert len(calls) == 4
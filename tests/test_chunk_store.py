@@ -0,0 +1,43 @@
+from tools import chunk_store
+from tools.chunk_store import ChunkStore
+
+
+def test_upsert_delete_and_views():
+    store = ChunkStore(capacity=16)
+    store.upsert('a', 'Q3 revenue was €500M.', 'Q3 report', {'company': 'ACME', 'page': 3})
+    store.upsert('b', 'Margin was 18%.', 'Q3 report')
+    view = store['a']
+    assert isinstance(view.text_bytes, memoryview) and view.text == 'Q3 revenue was €500M.'
+    assert view.source == 'Q3 report' and view.metadata == {'company': 'ACME', 'page': 3}
+
+    # replacing a chunk keeps its position; an earlier view still reads the old text
+    old = store['b']
+    store.upsert('b', 'Margin was 19% (restated).', 'Q3 report v2')
+    store.upsert('c', 'Outlook unchanged.')
+    assert old.text == 'Margin was 18%.' and store['b'].text == 'Margin was 19% (restated).'
+    assert list(store) == ['a', 'b', 'c'] and len(store) == 3
+
+    assert store.delete('a') and not store.delete('a')
+    assert 'a' not in store and store.get('a') is None and list(store) == ['b', 'c']
+    store.upsert('a', 'Back again.')
+    assert list(store) == ['b', 'c', 'a'] and store['a'].text == 'Back again.'
+
+
+def test_term_counts_scan_live_rows_and_compaction_keeps_order():
+    store = ChunkStore()
+    for i in range(10000):
+        store.upsert(f"doc_{i}", f"revenue {'revenue ' * (i % 3)}chunk {i}", f"report {i % 4}")
+    for i in range(0, 10000, 2):
+        store.delete(f"doc_{i}")
+    counts = dict(store.term_counts('revenue'))
+    assert len(counts) == 5000 and counts[1] == 2 and counts[3] == 1
+
+    store.compact()
+    assert len(store) == 5000 and list(store)[:2] == ['doc_1', 'doc_3']
+    assert store['doc_9999'].text == 'revenue chunk 9999' and store['doc_9999'].source == 'report 3'
+    assert 'doc_0' not in store
+
+
+def test_compact_store_uses_several_times_less_memory():
+    report = chunk_store.benchmark(chunks=10000)
+    assert report['memory_ratio'] >= 2.5
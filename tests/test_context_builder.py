@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+from tools.context_builder import build_context, estimate_tokens
+from tools.rag_retriever import ScoredChunk
+
+REVENUE = "Net revenue for the third quarter of 2024 was $500 million, up 12% year over year, driven by lending."
+OUTLOOK = "Management expects capital expenditure to remain flat next year while renewable energy projects expand."
+
+
+def test_estimate_tokens_counts_word_pieces():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('USD to EUR') == 3
+    # long words cost more than one token
+    assert estimate_tokens('internationalization') == 5
+
+
+def test_build_context_drops_near_duplicates_and_orders_by_score():
+    chunks = [
+        ScoredChunk(OUTLOOK, 'CEO Letter', 0.4),
+        ScoredChunk(REVENUE, 'Q3 Report p.2', 0.9),
+        # overlapping chunk: the same passage with a trailing fragment from the next one
+        ScoredChunk(REVENUE + " Deposits", 'Q3 Report p.2-3', 0.8),
+    ]
+    packed = build_context(chunks, budget_tokens=1000)
+    assert [c.source for c in packed.chunks] == ['Q3 Report p.2', 'CEO Letter']
+    assert packed.citations == ['Q3 Report p.2', 'CEO Letter']
+    assert packed.dropped_duplicates == 1
+    assert packed.text.startswith('[1] Net revenue')
+
+
+def test_build_context_respects_token_budget_and_reports_used_citations():
+    chunks = [ScoredChunk(REVENUE, 'Q3 Report', 0.9), ScoredChunk(OUTLOOK, 'CEO Letter', 0.5)]
+    budget = estimate_tokens(REVENUE) + 4
+    packed = build_context(chunks, budget_tokens=budget)
+    assert packed.citations == ['Q3 Report']
+    assert packed.tokens <= budget and packed.dropped_over_budget == 1
+
+    # a single oversized chunk is truncated rather than dropped
+    tiny = build_context(chunks[:1], budget_tokens=10)
+    assert tiny.chunks and tiny.tokens <= 10 and REVENUE.startswith(tiny.chunks[0].text)
+
+
+def test_generate_rag_answer_uses_retrieved_chunks(monkeypatch):
+    import tools.finance_rag as finance_rag
+
+    monkeypatch.setattr(finance_rag, 'retrieve_scored_documents',
+                        lambda q, k: [ScoredChunk(REVENUE, 'Q3 Report', 0.9), ScoredChunk(REVENUE, 'Q3 Report copy', 0.5)])
+    llm = Mock(return_value=Mock(text='Revenue was $500 million.'))
+    monkeypatch.setattr(finance_rag, 'generate_content', llm)
+
+    result = finance_rag.generate_rag_answer('What was Q3 revenue?')
+    prompt = llm.call_args[0][0]
+    assert REVENUE in prompt and prompt.count(REVENUE) == 1
+    assert result['sources'] == ['Q3 Report']
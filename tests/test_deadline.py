@@ -0,0 +1,76 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from config import settings
+from utils import deadline
+from utils.deadline import deadline_scope, DeadlineExceeded
+
+
+def test_nested_scope_only_shortens_deadline():
+    assert deadline.remaining() is None
+    with deadline_scope(10):
+        with deadline_scope(60):
+            assert deadline.remaining() <= 10
+        with deadline_scope(1):
+            assert deadline.timeout_for(30) <= 1
+    assert deadline.remaining() is None
+
+
+def test_timeout_for_raises_when_budget_exhausted():
+    with deadline_scope(0):
+        with pytest.raises(DeadlineExceeded):
+            deadline.timeout_for(5)
+        assert deadline.sleep(1.0) is False
+
+
+def test_exchange_rate_retries_skipped_when_budget_exhausted(monkeypatch):
+    from tools.currency_tool import get_exchange_rate, ToolExecutionError
+
+    calls = []
+
+    def fake_get(url, headers=None, timeout=5):
+        calls.append(timeout)
+        raise requests.exceptions.ConnectionError('boom')
+
+    monkeypatch.setattr('tools.currency_tool.requests.get', fake_get)
+    start = time.monotonic()
+    with deadline_scope(0.5):
+        with pytest.raises(ToolExecutionError, match='deadline'):
+            get_exchange_rate('USD', 'EUR')
+    # one attempt with the remaining budget as timeout, no 1s backoff sleep
+    assert len(calls) == 1 and calls[0] <= 0.5
+    assert time.monotonic() - start < 0.5
+
+
+def test_agent_returns_partial_answer_when_deadline_hit(monkeypatch):
+    import agent_controller
+
+    settings.LLM_PROVIDER = 'groq'
+    synthesis = Mock()
+
+    class Resp:
+        text = ''
+        function_calls = [{'tool': 'verify_company_registry', 'args': {'company_name': 'Acme'}}]
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        if tools is None:
+            return synthesis(prompt)
+        return Resp()
+
+    def slow_tool(company_name):
+        time.sleep(0.3)
+        return {'name': company_name, 'status': 'Active'}
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    monkeypatch.setitem(agent_controller.tools, 'verify_company_registry', slow_tool)
+
+    with deadline_scope(0.2):
+        result = agent_controller.process_query_with_agent('Is Acme active?')
+
+    assert result['partial'] is True
+    assert 'Active' in result['final_answer']
+    assert result['used_tools'] == ['verify_company_registry']
+    synthesis.assert_not_called()
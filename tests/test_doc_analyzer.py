@@ -0,0 +1,86 @@
+from config import settings
+from tools import doc_analyzer
+from tools.doc_analyzer import chunk_pages, find_date, iter_document_chunks
+
+PAGE = """ACME Corp Annual Report
+For the fiscal year ended September 30, 2024.
+
+Net revenue grew 12% to $500 million. Operating margin improved to 18%. The board approved a dividend.
+
+Segment        2024     2023
+Lending        320      290
+Payments       180      150
+
+Management expects growth to continue."""
+
+
+def _fake_pdf_range(file_path, start, end):
+    return [(i + 1, f"Page {i + 1} text.") for i in range(start, end)]
+
+
+def test_chunk_pages_keeps_tables_whole_and_tracks_pages():
+    chunks = list(chunk_pages([(1, PAGE), (2, 'Second page. More text.')], chunk_size=200, overlap=0))
+    tables = [c for c in chunks if c['kind'] == 'table']
+    assert len(tables) == 1 and tables[0]['text'].splitlines()[2].startswith('Payments')
+    assert [c['page'] for c in chunks] == [1, 1, 1, 2]
+    assert chunks[0]['date'] == '2024-09-30'
+
+
+def test_chunk_pages_respects_size_and_overlap():
+    text = " ".join(f"Sentence number {i} talks about revenue." for i in range(20))
+    chunks = list(chunk_pages([(3, text)], chunk_size=120, overlap=40))
+    assert len(chunks) > 1
+    assert all(len(c['text']) <= 120 for c in chunks)
+    # the last sentence of one chunk opens the next one
+    assert chunks[1]['text'].startswith(chunks[0]['text'].split('. ')[-1].rstrip('.'))
+
+
+def test_find_date_formats():
+    assert find_date('as of 30 Sep 2024') == '2024-09-30'
+    assert find_date('Filed 2023-03-01, amended March 5, 2023') == '2023-03-01'
+    assert find_date('no date here') is None
+
+
+def test_iter_document_chunks_streams_text_file(tmp_path):
+    doc = tmp_path / 'report.txt'
+    doc.write_text(PAGE + '\f' + 'Page two mentions liquidity.', encoding='utf-8')
+    chunks = iter_document_chunks(str(doc), 'ACME', 'ANNUAL')
+    first = next(chunks)
+    assert first['id'].startswith(f"ACME_ANNUAL_{doc_analyzer._document_key(str(doc))}_p1_")
+    assert first['source'] == 'report.txt, p. 1'
+    rest = list(chunks)
+    assert rest[-1]['metadata']['page'] == 2
+    # chunks without their own date inherit the document date
+    assert rest[-1]['metadata']['date'] == '2024-09-30'
+
+
+def test_chunk_ids_follow_content_not_position(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DOC_CHUNK_SIZE', 40)
+    monkeypatch.setattr(settings, 'DOC_CHUNK_OVERLAP', 0)
+    paragraphs = ['Revenue grew 12% to $500 million.', 'Margins improved to 18%.', 'Debt fell by $40 million.']
+    corpus = tmp_path / 'corpus'
+    corpus.mkdir()
+    doc = corpus / 'report.txt'
+    doc.write_text('\n\n'.join(paragraphs), encoding='utf-8')
+    before = {c['text']: c['id'] for c in iter_document_chunks(str(doc), 'ACME', 'ANNUAL', root=str(corpus))}
+
+    doc.write_text('\n\n'.join(['A new opening paragraph.'] + paragraphs), encoding='utf-8')
+    after = {c['text']: c['id'] for c in iter_document_chunks(str(doc), 'ACME', 'ANNUAL', root=str(corpus))}
+    assert all(after[text] == chunk_id for text, chunk_id in before.items())
+
+    moved = tmp_path / 'moved'
+    corpus.rename(moved)
+    relocated = {c['text']: c['id'] for c in iter_document_chunks(str(moved / 'report.txt'), 'ACME', 'ANNUAL',
+                                                                  root=str(moved))}
+    assert relocated == after
+
+
+def test_extract_pages_uses_process_pool_in_page_order(monkeypatch):
+    monkeypatch.setattr(doc_analyzer, '_pdf_page_count', lambda path: 20)
+    monkeypatch.setattr(doc_analyzer, '_extract_pdf_range', _fake_pdf_range)
+    monkeypatch.setattr(settings, 'DOC_PARSE_PAGES_PER_TASK', 3)
+    monkeypatch.setattr(settings, 'DOC_PARALLEL_MIN_PAGES', 1)
+
+    pages = list(doc_analyzer.extract_pages('big.pdf', workers=2))
+    assert [p for p, _ in pages] == list(range(1, 21))
+    assert pages[4][1] == 'Page 5 text.'
@@ -0,0 +1,86 @@
+from unittest.mock import Mock
+
+import pytest
+
+from config import settings
+from fast_path import match_intent, format_number, render_answer
+
+
+@pytest.mark.parametrize('query, tool, args, amount', [
+    ('convert 1,200 USD to EUR', 'get_exchange_rate', {'source_currency': 'USD', 'target_currency': 'EUR'}, 1200.0),
+    ('What is the exchange rate from gbp to ngn?', 'get_exchange_rate', {'source_currency': 'GBP', 'target_currency': 'NGN'}, None),
+    ('100 dollars in naira', 'get_exchange_rate', {'source_currency': 'USD', 'target_currency': 'NGN'}, 100.0),
+    ('is Tesla an active company?', 'verify_company_registry', {'company_name': 'Tesla'}, None),
+    ('verify company Acme Corp', 'verify_company_registry', {'company_name': 'Acme Corp'}, None),
+    ('check registry status of Bank of America', 'verify_company_registry', {'company_name': 'Bank of America'}, None),
+    ('is The Home Depot a registered company', 'verify_company_registry', {'company_name': 'The Home Depot'}, None),
+])
+def test_match_intent_extracts_tool_args(query, tool, args, amount):
+    match = match_intent(query)
+    assert match is not None
+    assert (match.tool, match.args, match.amount) == (tool, args, amount)
+
+
+@pytest.mark.parametrize('query', [
+    'Please call the tool to convert USD to NGN',
+    'Is Acme active?',
+    'convert ABC to XYZ',
+    'Compare Q3 revenue of Tesla and Ford',
+    'check company balance sheet',
+    'Check company filings for Tesla',
+    'verify company revenue growth in Q3',
+    'verify that the new CFO is a registered firm',
+])
+def test_match_intent_leaves_other_queries_to_the_llm(query):
+    assert match_intent(query) is None
+
+
+def test_render_answer_formats_without_trailing_zeros():
+    assert format_number(800.0) == '800'
+    assert format_number(0.92040) == '0.9204'
+    match = match_intent('convert 1,200 USD to EUR')
+    assert render_answer(match, 0.92) == '1,200 USD = 1,104 EUR (rate: 1 USD = 0.92 EUR)'
+    assert render_answer(match_intent('USD to NGN'), 800.0) == '1 USD = 800 NGN'
+    assert render_answer(match, {'error': 'x'}) is None
+
+
+def test_agent_fast_path_skips_tool_decision_call(monkeypatch):
+    import agent_controller
+
+    settings.LLM_PROVIDER = 'groq'
+    monkeypatch.setattr(settings, 'AGENT_FAST_PATH_ENABLED', True)
+    llm = Mock()
+    monkeypatch.setattr(agent_controller, 'generate_content', llm)
+    mock_verify = Mock(return_value={'name': 'Tesla, Inc.', 'status': 'Active', 'cik': '0001318605'})
+    monkeypatch.setitem(agent_controller.tools, 'verify_company_registry', mock_verify)
+
+    result = agent_controller.process_query_with_agent('Is Tesla an active company?')
+    assert result['final_answer'] == 'Tesla, Inc. is registered with status Active (CIK 0001318605).'
+    assert result['used_tools'] == ['verify_company_registry']
+    mock_verify.assert_called_once_with(company_name='Tesla')
+    llm.assert_not_called()
+
+
+def test_agent_fast_path_falls_back_to_llm_synthesis_on_tool_error(monkeypatch):
+    import agent_controller
+
+    settings.LLM_PROVIDER = 'groq'
+    monkeypatch.setattr(settings, 'AGENT_FAST_PATH_ENABLED', True)
+    prompts = []
+
+    class Resp:
+        text = 'The exchange rate service is unavailable right now.'
+        function_calls = []
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        prompts.append((prompt, tools))
+        return Resp()
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    monkeypatch.setitem(agent_controller.tools, 'get_exchange_rate', Mock(side_effect=Exception('timeout')))
+
+    result = agent_controller.process_query_with_agent('convert 50 EUR to USD')
+    assert result['final_answer'] == Resp.text
+    assert result['tool_errors'] == ['get_exchange_rate: timeout']
+    # only the synthesis call, without tools
+    assert len(prompts) == 1 and prompts[0][1] is None and 'TOOL_OUTPUTS' in prompts[0][0]
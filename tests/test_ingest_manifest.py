@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from tools import rag_retriever
+from tools.chunk_store import ChunkStore
+from tools.ingest_manifest import IngestManifest
+from tools.ingest_to_vector_db import ingest_document, ingest_json
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, '_tombstoned', set())
+    return rag_retriever._in_memory_store
+
+
+def _write(path, docs):
+    path.write_text(json.dumps(docs), encoding='utf-8')
+    return str(path)
+
+
+DOCS = [
+    {'id': 'q3-1', 'text': 'Q3 revenue was $500M.', 'source': 'Q3 report'},
+    {'id': 'q3-2', 'text': 'Q3 margin was 18%.', 'source': 'Q3 report'},
+    {'id': 'ceo-1', 'text': 'Focus on renewable energy.', 'source': 'CEO letter'},
+]
+
+
+def test_reingesting_unchanged_corpus_skips_all_chunks(tmp_path, store, monkeypatch):
+    corpus = _write(tmp_path / 'docs.json', DOCS)
+    manifest = IngestManifest(str(tmp_path / 'manifest.json'))
+    first = ingest_json(corpus, manifest)
+    manifest.save()
+    assert first.upserted == 3 and len(store) == 3
+
+    upserts = []
+    monkeypatch.setattr('tools.ingest_to_vector_db.upsert_chunks_to_vector_db', upserts.append)
+    second = ingest_json(corpus, IngestManifest.load(manifest.path))
+    assert second.upserted == 0 and second.skipped == 3 and upserts == []
+
+
+def test_changed_and_removed_chunks_are_upserted_and_tombstoned(tmp_path, store):
+    manifest = IngestManifest(str(tmp_path / 'manifest.json'))
+    ingest_json(_write(tmp_path / 'docs.json', DOCS), manifest)
+
+    # q3-1 changes, q3-2 disappears from its document, the CEO letter is removed from the corpus
+    updated = [{'id': 'q3-1', 'text': 'Q3 revenue was $510M (restated).', 'source': 'Q3 report'}]
+    report = ingest_json(_write(tmp_path / 'docs.json', updated), manifest)
+    assert (report.upserted, report.skipped, report.tombstoned) == (1, 0, 2)
+    assert store['q3-1'].text.startswith('Q3 revenue was $510M')
+
+    # tombstoned chunks are hidden from retrieval before compaction
+    texts = [c.text for c in rag_retriever.retrieve_scored_documents('Q3 margin', 5)]
+    assert 'Q3 margin was 18%.' not in texts and 'Focus on renewable energy.' not in texts
+    assert manifest.compact(rag_retriever.delete_chunks_from_vector_db) == 2
+    assert set(store) == {'q3-1'} and manifest.tombstones == {}
+
+
+def test_unchanged_file_is_not_reparsed(tmp_path, store, monkeypatch):
+    doc = tmp_path / 'report.txt'
+    doc.write_text('Net revenue was $500 million. Margins improved.', encoding='utf-8')
+    manifest = IngestManifest(str(tmp_path / 'manifest.json'))
+    assert ingest_document(str(doc), 'ACME', 'ANNUAL', manifest).upserted == 1
+
+    monkeypatch.setattr('tools.doc_analyzer.iter_document_chunks', lambda *a, **k: pytest.fail('reparsed'))
+    assert ingest_document(str(doc), 'ACME', 'ANNUAL', manifest).skipped_documents == 1
+
+
+def test_documents_with_same_company_and_type_keep_their_own_chunks(tmp_path, store):
+    q2, q3 = tmp_path / 'q2.txt', tmp_path / 'q3.txt'
+    q2.write_text('Q2 revenue was $400 million.', encoding='utf-8')
+    q3.write_text('Q3 revenue was $500 million.', encoding='utf-8')
+    manifest = IngestManifest(str(tmp_path / 'manifest.json'))
+    ingest_document(str(q2), 'ACME', 'EARNINGS', manifest)
+    ingest_document(str(q3), 'ACME', 'EARNINGS', manifest)
+    assert sorted(store[i].text for i in store) == ['Q2 revenue was $400 million.', 'Q3 revenue was $500 million.']
+
+    q2.write_text('Q2 revenue was $410 million (restated).', encoding='utf-8')
+    ingest_document(str(q2), 'ACME', 'EARNINGS', manifest)
+    manifest.compact(rag_retriever.delete_chunks_from_vector_db)
+    assert sorted(store[i].text for i in store) == ['Q2 revenue was $410 million (restated).', 'Q3 revenue was $500 million.']
+
+
+def test_manifest_for_another_store_is_ignored(tmp_path, store, monkeypatch):
+    doc = tmp_path / 'report.txt'
+    doc.write_text('Net revenue was $500 million. Margins improved.', encoding='utf-8')
+    path = str(tmp_path / 'manifest.json')
+    manifest = IngestManifest.load(path, store_id=rag_retriever.store_id())
+    assert ingest_document(str(doc), 'ACME', 'ANNUAL', manifest).upserted == 1
+    manifest.save()
+    assert ingest_document(str(doc), 'ACME', 'ANNUAL',
+                           IngestManifest.load(path, store_id=rag_retriever.store_id())).skipped_documents == 1
+
+    # a restart: the in-memory index is gone, the manifest file is not
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, '_process_store_id', 'restarted')
+    assert ingest_document(str(doc), 'ACME', 'ANNUAL',
+                           IngestManifest.load(path, store_id=rag_retriever.store_id())).upserted == 1
+    assert len(rag_retriever._in_memory_store) == 1
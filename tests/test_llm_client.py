@@ -119,3 +119,150 @@ def test_groq_rate_limit_fallback(monkeypatch):
     # Assert
     assert isinstance(resp.text, str)
     assert resp.text == 'Hello after fallback'
+
+
+def test_tool_registry_compiles_manifest_once():
+    from llm_client import ToolRegistry
+    from agent_controller import GetExchangeRateArgs
+
+    def get_exchange_rate(source_currency, target_currency):
+        """Fetch a rate."""
+
+    registry = ToolRegistry()
+    registry.register('get_exchange_rate', get_exchange_rate, GetExchangeRateArgs)
+    schema = registry.groq_tools()[0]['function']
+    assert schema['name'] == 'get_exchange_rate'
+    assert schema['description'] == 'Fetch a rate.'
+    assert schema['parameters']['required'] == ['source_currency', 'target_currency']
+    # rendered prefixes and schemas are cached (same object on every call)
+    assert registry.prompt_prefix('groq', native=False) is registry.prompt_prefix('groq', native=False)
+    assert registry.groq_tools() is registry.groq_tools()
+    assert 'get_exchange_rate(source_currency, target_currency)' in registry.prompt_prefix('groq', native=False)
+
+
+def test_groq_native_tool_calls_are_parsed(monkeypatch):
+    import llm_client
+    from llm_client import generate_content, ToolRegistry
+
+    settings.LLM_PROVIDER = 'groq'
+    settings.GROQ_API_KEY = 'mock-key'
+    settings.GROQ_MODEL = 'mock-model'
+
+    registry = ToolRegistry()
+    registry.register('verify_company_registry', lambda company_name: None, description='Verify a company')
+    sent = {}
+    body = {'choices': [{'message': {'content': None, 'tool_calls': [
+        {'id': 'call_1', 'type': 'function',
+         'function': {'name': 'verify_company_registry', 'arguments': '{"company_name": "Tesla"}'}}]}}]}
+
+    def fake_post(url, json=None, headers=None, timeout=30):
+        sent.update(json)
+        return Mock(status_code=200, raise_for_status=Mock(return_value=None), json=Mock(return_value=body))
+
+    monkeypatch.setattr(llm_client.requests, 'post', fake_post)
+    resp = generate_content('Is Tesla registered?', tools=registry)
+
+    assert sent['tools'] == registry.groq_tools()
+    assert sent['messages'][0]['role'] == 'system'
+    assert resp.function_calls == [{'tool': 'verify_company_registry', 'args': {'company_name': 'Tesla'}}]
+
+
+def test_stream_parser_emits_each_call_as_it_closes():
+    from llm_client import ToolCallStreamParser
+
+    parser = ToolCallStreamParser()
+    text = ('Calling tools [{"tool": "verify_company_registry", "args": {"company_name": "Acme {Holdings}"}}, '
+            '{"tool": "get_exchange_rate", "args": {"source_currency": "USD", "target_currency": "EUR"}}]')
+    emitted_at = []
+    for i in range(0, len(text), 7):
+        for call in parser.feed(text[i:i + 7]):
+            emitted_at.append((i, call['tool']))
+
+    assert [name for _, name in emitted_at] == ['verify_company_registry', 'get_exchange_rate']
+    # the first call is available before the second one has been generated
+    assert emitted_at[0][0] < text.index('get_exchange_rate')
+    assert parser.calls[0]['args']['company_name'] == 'Acme {Holdings}'
+
+
+def test_groq_stream_hands_tool_calls_to_callback(monkeypatch):
+    import json as _json
+    import llm_client
+    from llm_client import stream_content
+
+    settings.LLM_PROVIDER = 'groq'
+    settings.GROQ_API_KEY = 'mock-key'
+    settings.GROQ_MODEL = 'mock-model'
+
+    events = [
+        {'choices': [{'delta': {'tool_calls': [{'index': 0, 'function': {'name': 'get_exchange_rate', 'arguments': '{"source_currency": '}}]}}]},
+        {'choices': [{'delta': {'tool_calls': [{'index': 0, 'function': {'arguments': '"USD", "target_currency": "EUR"}'}}]}}]},
+        {'choices': [{'delta': {'tool_calls': [{'index': 1, 'function': {'name': 'verify_company_registry', 'arguments': '{"company_name": "Tesla"}'}}]}}]},
+    ]
+    lines = ['data: ' + _json.dumps(e) for e in events] + ['data: [DONE]']
+    seen = []
+
+    class Resp:
+        def raise_for_status(self):
+            return None
+
+        def iter_lines(self, decode_unicode=False):
+            for i, line in enumerate(lines):
+                # the first call is handed over as soon as the second one starts streaming
+                if i == 2:
+                    assert [c['tool'] for c in seen] == []
+                if i == 3:
+                    assert [c['tool'] for c in seen] == ['get_exchange_rate']
+                yield line
+
+    monkeypatch.setattr(llm_client.requests, 'post', lambda *a, **k: Resp())
+    resp = stream_content('Convert and verify', tools={'get_exchange_rate': lambda source_currency, target_currency: 1.0},
+                          on_tool_call=seen.append)
+
+    assert [c['tool'] for c in seen] == ['get_exchange_rate', 'verify_company_registry']
+    assert seen[0]['args'] == {'source_currency': 'USD', 'target_currency': 'EUR'}
+    assert resp.function_calls == seen
+
+
+def test_retry_policy_full_jitter_bounds_and_budget():
+    from llm_client import RetryPolicy, RetryBudget
+
+    policy = RetryPolicy(base_delay_s=0.5, max_delay_s=2.0)
+    delays = [policy.backoff(retry) for retry in range(6) for _ in range(50)]
+    assert all(0.0 <= d <= 2.0 for d in delays)
+
+    budget = RetryBudget(ratio=0.5, min_per_s=0.0, capacity=1.0)
+    assert budget.try_withdraw() is True
+    assert budget.try_withdraw() is False
+    budget.deposit()
+    budget.deposit()
+    assert budget.try_withdraw() is True
+
+
+def test_groq_hedges_slow_primary_with_fallback_model(monkeypatch):
+    import threading
+    import llm_client
+    from llm_client import generate_content, RetryPolicy
+
+    settings.LLM_PROVIDER = 'groq'
+    settings.GROQ_API_KEY = 'mock-key'
+    settings.GROQ_MODEL = 'slow-model'
+    monkeypatch.setattr(settings, 'GROQ_FALLBACK_MODELS', ['slow-model', 'fast-model'])
+    monkeypatch.setitem(llm_client.RETRY_POLICIES, 'tool_decision', RetryPolicy(hedge=True, hedge_delay_s=0.05))
+    release = threading.Event()
+    models = []
+
+    def fake_post(url, json=None, headers=None, timeout=30):
+        models.append(json['model'])
+        if json['model'] == 'slow-model':
+            release.wait(2)
+        body = {'choices': [{'message': {'content': f"answer from {json['model']}"}}]}
+        return Mock(status_code=200, raise_for_status=Mock(return_value=None), json=Mock(return_value=body))
+
+    monkeypatch.setattr(llm_client.requests, 'post', fake_post)
+    try:
+        resp = generate_content('Which tool?', tools={'noop': lambda: None}, call_site='tool_decision')
+    finally:
+        release.set()
+
+    assert resp.text == 'answer from fast-model'
+    assert models == ['slow-model', 'fast-model']
@@ -0,0 +1,137 @@
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from config import settings
+from tools import local_embedder, rag_retriever
+from tools.chunk_store import ChunkStore
+from tools.local_embedder import LocalEmbedder, _vectorizer
+
+TOPICS = {
+    'revenue': ['revenue grew on strong sales', 'net sales and revenue rose', 'quarterly sales revenue increased'],
+    'debt': ['long term debt was refinanced', 'the company repaid debt and borrowings', 'borrowings and debt maturities'],
+    'energy': ['renewable energy capacity expanded', 'solar and wind energy projects', 'energy output from wind farms'],
+}
+
+
+def _corpus(copies=3):
+    return [f"{text} in period {i}" for i in range(copies) for texts in TOPICS.values() for text in texts]
+
+
+def test_embed_matches_sklearn_pipeline_and_groups_topics():
+    texts = _corpus()
+    model = LocalEmbedder.fit(texts, dim=4, n_features=2 ** 12)
+    counts = _vectorizer(2 ** 12).transform(texts)
+    weighted = TfidfTransformer(sublinear_tf=True).fit_transform(counts)
+    expected = TruncatedSVD(4, n_iter=7, random_state=0).fit_transform(weighted)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    vectors = model.embed(texts)
+    assert vectors.shape == (len(texts), 4) and vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors, expected, atol=1e-5)
+
+    query, related, unrelated = model.embed(['sales revenue', 'revenue grew', 'wind energy'])
+    assert query @ related > query @ unrelated
+    assert not model.embed(['zzz qqq']).any()
+
+
+def test_save_load_and_get_reloads_after_refit(tmp_path, monkeypatch):
+    path = str(tmp_path / 'model.npz')
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_PATH', path)
+    monkeypatch.setattr(local_embedder, '_model', None)
+    monkeypatch.setattr(local_embedder, '_model_key', None)
+    assert local_embedder.get() is None
+
+    model = local_embedder.fit_and_save(_corpus(2))
+    loaded = local_embedder.get()
+    assert loaded.n_docs == model.n_docs and local_embedder.get() is loaded
+    np.testing.assert_allclose(loaded.embed(['debt']), model.embed(['debt']), atol=1e-6)
+
+    refit = LocalEmbedder.fit(_corpus(4))
+    refit.save(path)
+    assert local_embedder.get().n_docs == refit.n_docs
+
+
+def test_retriever_fits_local_embedder_and_refits_as_corpus_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'GEMINI_API_KEY', None)
+    monkeypatch.setattr(settings, 'RAG_VECTOR_INDEX_ENABLED', True)
+    monkeypatch.setattr(settings, 'RAG_VECTOR_DIR', str(tmp_path))
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_PATH', str(tmp_path / 'model.npz'))
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_MIN_DOCS', 9)
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_AUTO_FIT', True)
+    monkeypatch.setattr(local_embedder, '_model', None)
+    monkeypatch.setattr(local_embedder, '_model_key', None)
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, '_tombstoned', set())
+    monkeypatch.setattr(rag_retriever, '_vector_index', None)
+    monkeypatch.setattr(rag_retriever, '_vector_index_embedder', None)
+    monkeypatch.setattr(rag_retriever, '_version_store', None)
+    rag_retriever.embed_query.cache_clear()
+
+    def chunks(texts, start):
+        return [{'id': f'c{start + i}', 'text': t, 'source': 'report'} for i, t in enumerate(texts)]
+
+    texts = _corpus(1)
+    rag_retriever.upsert_chunks_to_vector_db(chunks(texts[:4], 0))
+    assert rag_retriever._vector_index is None  # too few chunks to fit: term search only
+
+    rag_retriever.upsert_chunks_to_vector_db(chunks(texts[4:], 4))
+    assert local_embedder.get().n_docs == 9 and len(rag_retriever._vector_index) == 9
+    hits = rag_retriever.retrieve_scored_documents('wind power', 2)
+    assert {h.chunk_id for h in hits} == {'c7', 'c8'}
+
+    more = _corpus(2)[9:]
+    rag_retriever.upsert_chunks_to_vector_db(chunks(more, 9))
+    assert local_embedder.get().n_docs == 18 and len(rag_retriever._vector_index) == 18
+    assert len(rag_retriever.embed_query('wind power')) == local_embedder.get().dim
+
+    # another worker (or the CLI) replaces the model: the index is rebuilt before the next search
+    version = rag_retriever.index_version()
+    LocalEmbedder.fit(_corpus(3), dim=4).save(settings.LOCAL_EMBEDDER_PATH)
+    hits = rag_retriever.retrieve_scored_documents('wind power', 2)
+    assert rag_retriever._vector_index.dim == 4 and len(rag_retriever._vector_index) == 18
+    assert rag_retriever._vector_index_embedder is local_embedder.get() and rag_retriever.index_version() > version
+    assert len(hits) == 2 and len(rag_retriever.embed_query('wind power')) == 4
+    rag_retriever._vector_index.close()
+    rag_retriever.embed_query.cache_clear()
+
+
+def test_auto_fit_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'GEMINI_API_KEY', None)
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_PATH', str(tmp_path / 'model.npz'))
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_MIN_DOCS', 1)
+    monkeypatch.setattr(local_embedder, '_model', None)
+    monkeypatch.setattr(local_embedder, '_model_key', None)
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, '_vector_index', None)
+    monkeypatch.setattr(rag_retriever, '_version_store', None)
+    rag_retriever.upsert_chunks_to_vector_db([{'id': f'c{i}', 'text': t} for i, t in enumerate(_corpus(1))])
+    assert local_embedder.get() is None and rag_retriever._vector_index is None
+
+
+def test_local_embeddings_disable_near_duplicate_answer_reuse(tmp_path, monkeypatch):
+    from tools import rag_answer_cache
+    from utils.cache import TTLCache
+
+    rng = np.random.default_rng(0)
+    filings = [f"{company} {quarter} {text}" for company in ('Acme', 'Globex', 'Initech', 'Umbrella')
+               for quarter in ('Q1', 'Q2', 'Q3', 'Q4') for text in (
+                   f"earnings: revenue was ${rng.integers(100, 900)} million and net income was ${rng.integers(10, 90)} million.",
+                   'operating margin improved on lower costs.', 'cash flow from operations rose.',
+                   'guidance was raised for the full year.')]
+    monkeypatch.setattr(settings, 'GEMINI_API_KEY', None)
+    monkeypatch.setattr(settings, 'LOCAL_EMBEDDER_PATH', str(tmp_path / 'model.npz'))
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_ENABLED', True)
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD', 0.95)
+    monkeypatch.setattr(local_embedder, '_model', None)
+    monkeypatch.setattr(local_embedder, '_model_key', None)
+    monkeypatch.setattr(rag_answer_cache, '_answers', TTLCache(ttl=60))
+    monkeypatch.setattr(rag_answer_cache, '_semantic', None)
+    rag_retriever.embed_query.cache_clear()
+    model = local_embedder.fit_and_save(filings)
+
+    revenue, net_income = model.embed(['acme q3 revenue', 'acme q3 net income'])
+    assert revenue @ net_income >= 0.95  # different questions, near-identical vectors
+    rag_answer_cache.store('acme q3 revenue', 1, {'answer': 'Revenue was $500M.', 'audit_success': True})
+    assert rag_answer_cache.lookup('acme q3 net income', 1) is None
+    assert rag_answer_cache.lookup('acme q3 revenue?', 1)['answer'] == 'Revenue was $500M.'
+    rag_retriever.embed_query.cache_clear()
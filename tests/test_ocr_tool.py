@@ -0,0 +1,72 @@
+import pytest
+
+from tools import ocr_tool
+from tools.doc_analyzer import chunk_pages
+from tools.ocr_tool import OCRCache, ocr_pages, preprocess
+
+Image = pytest.importorskip('PIL.Image')
+PngImagePlugin = pytest.importorskip('PIL.PngImagePlugin')
+
+
+def _page(path, text, size=(400, 300)):
+    image = Image.new('L', size, 255)
+    image.paste(0, (20, 20, 200, 40))
+    info = PngImagePlugin.PngInfo()
+    info.add_text('ocr_text', text)
+    image.save(path, pnginfo=info)
+    return str(path)
+
+
+def test_ocr_pages_caches_by_content_hash(tmp_path, monkeypatch):
+    cover = _page(tmp_path / 'p1.png', 'ACME Corp Annual Report 2024.')
+    body = _page(tmp_path / 'p2.png', 'Total Assets: $1.2 Billion. Net Income: $50 Million.')
+    cover_again = _page(tmp_path / 'p3.png', 'ACME Corp Annual Report 2024.')
+    cache = OCRCache(str(tmp_path / 'cache'))
+
+    calls = []
+    original = ocr_tool._recognize_bytes
+    monkeypatch.setattr(ocr_tool, '_recognize_bytes', lambda *a: calls.append(1) or original(*a))
+    pages = list(ocr_pages([cover, body, cover_again], workers=1, cache=cache, engine='standin'))
+    assert [p for p, _ in pages] == [1, 2, 3]
+    assert pages[1][1].startswith('Total Assets')
+    # the repeated cover page is recognised once
+    assert len(calls) == 2
+
+    calls.clear()
+    again = list(ocr_pages([body], workers=1, cache=cache, engine='standin'))
+    assert again == [(1, pages[1][1])] and calls == []
+
+
+def test_ocr_pages_on_process_pool_streams_into_chunker(tmp_path):
+    paths = [_page(tmp_path / f'p{i}.png', f'Page {i} reports revenue of ${i}00 million.') for i in range(1, 5)]
+    chunks = list(chunk_pages(ocr_pages(paths, workers=2, engine='standin', use_cache=False)))
+    assert [c['page'] for c in chunks] == [1, 2, 3, 4]
+    assert chunks[2]['text'] == 'Page 3 reports revenue of $300 million.'
+
+
+def test_preprocess_downscales_and_binarizes():
+    image = Image.linear_gradient('L').resize((4000, 1000))
+    out = preprocess(image, max_side=2000, binarize=True)
+    assert out.size == (2000, 500)
+    lo, hi = out.getextrema()
+    assert set(out.histogram()[lo + 1:hi]) <= {0}
+
+
+def test_auto_engine_refuses_to_fall_back_to_the_stand_in(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr_tool.settings, 'OCR_ENGINE', 'auto')
+    monkeypatch.setattr(ocr_tool, 'optional_import', lambda name: None)
+    with pytest.raises(ImportError):
+        list(ocr_pages([_page(tmp_path / 'p1.png', 'scan')], workers=1, use_cache=False))
+    assert ocr_tool.extract_text_from_image(_page(tmp_path / 'p2.png', 'scan')) == ""
+
+
+def test_ocr_pages_keeps_a_bounded_window(tmp_path, monkeypatch):
+    paths = [_page(tmp_path / f'p{i}.png', f'Page {i} of the filing.') for i in range(1, 9)]
+    calls = []
+    original = ocr_tool._recognize_bytes
+    monkeypatch.setattr(ocr_tool, '_recognize_bytes', lambda *a: calls.append(1) or original(*a))
+    lead = []
+    for page, _ in ocr_pages(paths, workers=1, engine='standin', use_cache=False):
+        lead.append(len(calls) - page)
+    assert len(calls) == 8
+    assert max(lead) <= 1
@@ -0,0 +1,107 @@
+from unittest.mock import Mock
+
+import pytest
+
+import tools.finance_rag as finance_rag
+from config import settings
+from tools import rag_answer_cache, rag_retriever
+from tools.chunk_store import ChunkStore
+from tools.rag_retriever import ScoredChunk
+from utils.cache import TTLCache
+
+VOCAB = ['q3', 'revenue', 'acme', 'outlook', 'third', 'quarter', 'sales']
+SYNONYMS = {'third': 'q3', 'quarter': '', 'sales': 'revenue'}
+
+
+def fake_embed_query(query):
+    # bag of words with a few synonyms folded together: paraphrases get (nearly) the same vector
+    words = [SYNONYMS.get(w, w) for w in query.replace("'s", '').split()]
+    return tuple(float(words.count(v)) for v in VOCAB)
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    monkeypatch.setattr(rag_answer_cache, '_answers', TTLCache(ttl=60))
+    monkeypatch.setattr(rag_answer_cache, '_semantic', None)
+    monkeypatch.setattr(rag_retriever, '_version_store', TTLCache(ttl=60))
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, 'embed_query', fake_embed_query)
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_ENABLED', True)
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD', 0.95)
+    retrieve = Mock(return_value=[ScoredChunk('Acme Q3 revenue was $500M.', 'Q3 Report', 0.9, 'c1')])
+    llm = Mock(return_value=Mock(text='Q3 revenue was $500M.'))
+    monkeypatch.setattr(finance_rag, 'retrieve_scored_documents', retrieve)
+    monkeypatch.setattr(finance_rag, 'generate_content', llm)
+    return retrieve, llm
+
+
+def test_repeated_question_is_served_from_cache(rag, monkeypatch):
+    retrieve, llm = rag
+    first = finance_rag.generate_rag_answer("What was Acme's Q3 revenue?")
+    first['sources'].append('mutated by caller')
+    second = finance_rag.generate_rag_answer("  what was acme's q3 REVENUE ")
+    assert llm.call_count == 1 and retrieve.call_count == 1
+    assert second['sources'] == ['Q3 Report'] and second['answer'] == 'Q3 revenue was $500M.'
+
+    # a different retrieval setting is a different entry
+    monkeypatch.setattr(settings, 'RAG_K_CHUNKS', settings.RAG_K_CHUNKS + 1)
+    finance_rag.generate_rag_answer("What was Acme's Q3 revenue?")
+    assert llm.call_count == 2
+
+
+def test_ingestion_invalidates_cached_answers(rag):
+    _, llm = rag
+    finance_rag.generate_rag_answer('Acme outlook')
+    version = rag_retriever.index_version()
+    rag_retriever.upsert_chunks_to_vector_db([{'id': 'c2', 'text': 'New outlook', 'source': 'CEO Letter'}])
+    assert rag_retriever.index_version() > version
+    finance_rag.generate_rag_answer('Acme outlook')
+    assert llm.call_count == 2
+
+    rag_retriever.tombstone_chunks(['c2'])
+    finance_rag.generate_rag_answer('Acme outlook')
+    assert llm.call_count == 3
+
+
+def test_paraphrase_hits_near_duplicate_lookup(rag, monkeypatch):
+    _, llm = rag
+    finance_rag.generate_rag_answer('What was Acme q3 revenue')
+    finance_rag.generate_rag_answer('ACME Q3 sales?')
+    assert llm.call_count == 1
+    assert rag_answer_cache.stats()['semantic_hits'] >= 1
+
+    # different question, and the lookup switched off
+    finance_rag.generate_rag_answer('acme outlook')
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD', 1.0)
+    finance_rag.generate_rag_answer('acme q3 sales')
+    assert llm.call_count == 3
+
+
+def test_near_duplicate_needs_the_same_periods_and_names(rag):
+    _, llm = rag
+    # FY2023/FY2024 and the company names are outside the fake vocabulary: the embeddings are identical
+    finance_rag.generate_rag_answer('What was Acme FY2023 revenue')
+    finance_rag.generate_rag_answer('What was Acme FY2024 revenue')
+    finance_rag.generate_rag_answer('What was Globex FY2023 revenue')
+    assert llm.call_count == 3
+    assert rag_answer_cache.query_entities("What was Acme's Q3 revenue?") == {'acme', 'q3'}
+
+
+def test_failed_answers_are_not_cached(rag):
+    retrieve, llm = rag
+    retrieve.side_effect = RuntimeError('vector db down')
+    assert finance_rag.generate_rag_answer('Acme outlook')['audit_success'] is False
+    retrieve.side_effect = None
+    assert finance_rag.generate_rag_answer('Acme outlook')['audit_success'] is True
+    assert llm.call_count == 1
+
+
+def test_no_relevant_documents_is_answered_without_the_llm_and_not_cached(rag):
+    retrieve, llm = rag
+    retrieve.return_value = []
+    for _ in range(2):
+        result = finance_rag.generate_rag_answer('Acme outlook')
+        assert result['audit_success'] is False and result['sources'] == []
+        assert result['answer'] == 'No relevant documents were found for this question.'
+    assert llm.call_count == 0 and retrieve.call_count == 2
+    assert rag_retriever.retrieve_scored_documents('zebra', 3) == []
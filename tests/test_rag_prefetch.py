@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import wait
+from unittest.mock import Mock
+
+from config import settings
+from tools import rag_prefetch
+
+
+class DummyResp:
+    def __init__(self, text='', function_calls=None):
+        self.text = text
+        self.function_calls = function_calls or []
+
+
+def test_query_overlap_matches_rephrased_questions():
+    assert rag_prefetch.query_overlap('What was Q3 revenue?', 'what was q3 revenue') == 1.0
+    assert rag_prefetch.query_overlap('Q3 revenue report', 'Is Tesla active?') == 0.0
+
+
+def test_agent_overlaps_retrieval_with_tool_decision(monkeypatch):
+    import agent_controller
+    import tools.finance_rag as finance_rag
+
+    settings.LLM_PROVIDER = 'groq'
+    monkeypatch.setattr(settings, 'RAG_SPECULATIVE_PREFETCH', True)
+    from tools.rag_retriever import ScoredChunk
+
+    retrieve = Mock(side_effect=lambda q, k: (time.sleep(0.3), [ScoredChunk('Revenue was $1M', 'Q3 report', 1.0)])[1])
+    monkeypatch.setattr('tools.rag_retriever.retrieve_scored_documents', retrieve)
+    monkeypatch.setattr(finance_rag, 'retrieve_scored_documents', retrieve)
+    monkeypatch.setattr(finance_rag, 'generate_content', lambda prompt, model=None: DummyResp(text='Revenue was $1M'))
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        if tools is not None:
+            time.sleep(0.3)
+            return DummyResp(function_calls=[{'tool': 'generate_rag_answer', 'args': {'user_query': 'What was the Q3 revenue in the report?'}}])
+        return DummyResp(text='Q3 revenue was $1M')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    monkeypatch.setitem(agent_controller.tools, 'generate_rag_answer', finance_rag.generate_rag_answer)
+
+    before = rag_prefetch.stats()['used']
+    start = time.monotonic()
+    result = agent_controller.process_query_with_agent('What was the Q3 revenue in the report?')
+    elapsed = time.monotonic() - start
+
+    assert result['final_answer'] == 'Q3 revenue was $1M'
+    retrieve.assert_called_once()
+    assert rag_prefetch.stats()['used'] == before + 1
+    # retrieval ran concurrently with the 0.3s decision call instead of after it
+    assert elapsed < 0.55
+
+
+def test_unused_prefetch_is_discarded_and_budget_caps_starts(monkeypatch):
+    monkeypatch.setattr(settings, 'RAG_SPECULATIVE_PREFETCH', True)
+    monkeypatch.setattr(rag_prefetch, '_budget', rag_prefetch.PrefetchBudget(max_in_flight=1, max_per_minute=1))
+    monkeypatch.setattr(rag_prefetch, '_retrieve', lambda q, k: [])
+
+    with rag_prefetch.speculate('Summarize the annual report') as prefetch:
+        assert prefetch is not None
+        # a different question does not take the prefetched context
+        assert rag_prefetch.take('Is Tesla an active company', settings.RAG_K_CHUNKS) is None
+    assert rag_prefetch.take('Summarize the annual report', settings.RAG_K_CHUNKS) is None
+
+    # the slot is free again once the discarded retrieval is cancelled or finished,
+    # but the per-minute start limit still blocks a new speculation
+    wait([prefetch.future])
+    assert rag_prefetch._budget._in_flight == 0
+    with rag_prefetch.speculate('Summarize the quarterly report') as second:
+        assert second is None
+
+
+def test_answer_from_borrowed_chunks_is_not_cached(monkeypatch):
+    import tools.finance_rag as finance_rag
+    from tools import rag_answer_cache
+    from tools.rag_retriever import ScoredChunk
+    from utils.cache import TTLCache
+
+    monkeypatch.setattr(settings, 'RAG_SPECULATIVE_PREFETCH', True)
+    monkeypatch.setattr(settings, 'RAG_ANSWER_CACHE_ENABLED', True)
+    monkeypatch.setattr(rag_answer_cache, '_answers', TTLCache(ttl=60))
+    monkeypatch.setattr(rag_prefetch, '_budget', rag_prefetch.PrefetchBudget(max_in_flight=4, max_per_minute=100))
+    monkeypatch.setattr(rag_prefetch, '_retrieve', lambda q, k: [ScoredChunk('Revenue was $1M', 'Q3 report', 1.0, 'c1')])
+    monkeypatch.setattr(finance_rag, 'generate_content', lambda prompt, model=None: DummyResp(text='Revenue was $1M'))
+    stored = []
+    monkeypatch.setattr(rag_answer_cache, 'store', lambda query, version, result: stored.append(query))
+
+    with rag_prefetch.speculate('What was the Q3 revenue in the annual report?'):
+        finance_rag.generate_rag_answer('Q3 revenue in the annual report summary')
+    assert stored == []
+    with rag_prefetch.speculate('What was the Q3 revenue in the annual report?'):
+        finance_rag.generate_rag_answer('what was the q3 revenue in the annual report')
+    assert stored == ['what was the q3 revenue in the annual report']
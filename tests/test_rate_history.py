@@ -0,0 +1,85 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import agent_controller
+from config import settings
+from tools.currency_tool import ToolExecutionError
+from tools.rate_history import RateHistory, RateHistoryError, backfill, get_historical_exchange_rate, load_history
+
+# Rates per 1 USD; 2024-09-28/29 is a weekend with no quotes
+QUOTES = {
+    date(2024, 9, 26): {'EUR': 0.90, 'GBP': 0.75},
+    date(2024, 9, 27): {'EUR': 0.89, 'GBP': 0.74},
+    date(2024, 9, 30): {'EUR': 0.88, 'GBP': 0.76},
+    date(2024, 10, 1): {'EUR': 0.90, 'GBP': 0.75, 'JPY': 150.0},
+}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_HISTORY_DIR', str(tmp_path / 'rates'))
+    added = backfill(start='2024-09-26', end='2024-10-01', fetch=lambda day: QUOTES.get(day, {}))
+    assert added == 4
+    return load_history()
+
+
+def test_backfill_writes_a_memory_mapped_store(store):
+    assert isinstance(store.rates, np.memmap)
+    assert store.start == date(2024, 9, 26) and store.end == date(2024, 10, 1)
+    assert store.currencies == ['EUR', 'GBP', 'JPY']
+    # JPY only appeared on the last day
+    assert np.isnan(store.rates[0, 2]) and store.rates[-1, 2] == 150.0
+
+
+def test_point_queries_cross_rates_and_fill_weekends(store):
+    assert store.rate('USD', 'EUR', '2024-09-30') == (0.88, date(2024, 9, 30))
+    rate, quoted = store.rate('EUR', 'GBP', '2024-09-29')
+    assert quoted == date(2024, 9, 27) and rate == pytest.approx(0.74 / 0.89)
+    with pytest.raises(RateHistoryError):
+        store.rate('USD', 'JPY', '2024-09-30')
+    with pytest.raises(RateHistoryError):
+        store.rate('USD', 'EUR', '2025-01-01')
+
+
+def test_range_and_average_queries(store):
+    dates, values = store.series('USD', 'EUR', '2024-09-27', '2024-09-30')
+    assert [str(d) for d in dates] == ['2024-09-27', '2024-09-28', '2024-09-29', '2024-09-30']
+    assert values.tolist() == [0.89, 0.89, 0.89, 0.88]
+
+    stats = store.average('USD', 'EUR', '2024-09-26', '2024-09-30')
+    assert stats['average'] == pytest.approx((0.90 + 0.89 * 3 + 0.88) / 5)
+    assert stats['min'] == 0.88 and stats['max'] == 0.90 and stats['days'] == 5
+
+
+def test_backfill_is_incremental(store):
+    fetched = []
+
+    def fetch(day):
+        fetched.append(day)
+        return {'EUR': 0.91, 'GBP': 0.77}
+
+    assert backfill(end='2024-10-03', fetch=fetch) == 2
+    assert fetched == [date(2024, 10, 2), date(2024, 10, 3)]
+    assert load_history().rate('USD', 'GBP', '2024-10-03')[0] == 0.77
+
+
+def test_add_day_before_start_prepends_rows():
+    history = RateHistory('USD', date(2024, 1, 3), ['EUR'], np.array([[0.9]]))
+    history.add_day('2024-01-01', {'EUR': 0.8})
+    assert history.start == date(2024, 1, 1) and history.rates.shape == (3, 1)
+    assert history.rate('EUR', 'USD', '2024-01-02')[0] == pytest.approx(1 / 0.8)
+
+
+def test_agent_tool(store):
+    assert get_historical_exchange_rate('usd', 'eur', '2024-09-29') == {
+        'source': 'USD', 'target': 'EUR', 'rate': 0.89, 'date': '2024-09-27'}
+    period = get_historical_exchange_rate('USD', 'GBP', '2024-09-26', end_date='2024-10-01')
+    assert period['days'] == 6 and period['start'] == '2024-09-26'
+    with pytest.raises(ToolExecutionError):
+        get_historical_exchange_rate('USD', 'CHF', '2024-09-30')
+
+    ok, _, args = agent_controller.validate_tool_args(
+        'get_historical_exchange_rate', {'source_currency': 'USD', 'target_currency': 'EUR', 'date': '30/09/2024'})
+    assert not ok
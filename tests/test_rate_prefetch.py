@@ -0,0 +1,117 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from config import settings
+from main import app
+from tools import currency_tool, rate_prefetch
+from tools.rate_prefetch import HotBaseTracker, RatePrefetcher
+from utils.cache import TTLCache
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Fresh rate-table cache and hot-base tracker, and a fake provider that counts fetches."""
+    monkeypatch.setattr(currency_tool, '_rate_tables', TTLCache(ttl=settings.RATE_TABLE_TTL_S))
+    monkeypatch.setattr(rate_prefetch, 'tracker', HotBaseTracker(window_s=60))
+    fetched = []
+
+    def fake_fetch(base, retries=3):
+        fetched.append(base)
+        return {'USD': 1.0, 'EUR': 0.9, 'GBP': 0.8, 'NGN': 800.0}
+
+    monkeypatch.setattr(currency_tool, 'fetch_rate_table', fake_fetch)
+    return fetched
+
+
+def test_rate_tables_are_cached_per_base(provider):
+    assert currency_tool.get_exchange_rate('usd', 'EUR') == 0.9
+    assert currency_tool.get_exchange_rate('USD', 'NGN') == 800.0
+    assert provider == ['USD']
+    with pytest.raises(currency_tool.ToolExecutionError):
+        currency_tool.get_exchange_rate('USD', 'XXX')
+
+
+def test_tracker_ranks_bases_within_window(monkeypatch):
+    tracker = HotBaseTracker(window_s=10)
+    now = [1000.0]
+    monkeypatch.setattr('tools.rate_prefetch.time.monotonic', lambda: now[0])
+    for base in ['EUR', 'USD', 'USD', 'GBP', 'USD', 'EUR']:
+        tracker.record(base)
+    assert tracker.top(2) == ['USD', 'EUR']
+    now[0] += 11
+    tracker.record('GBP')
+    assert tracker.top(5) == ['GBP'] and tracker.counts() == {'GBP': 1}
+
+
+def test_prefetcher_refreshes_hot_tables_before_expiry(provider, monkeypatch):
+    for base in ['EUR', 'EUR', 'GBP', 'JPY']:
+        rate_prefetch.tracker.record(base)
+    prefetcher = RatePrefetcher(top_n=2, seed_bases=['USD'], max_per_minute=100)
+
+    # cold start: the two hottest bases and the seed base are fetched
+    assert prefetcher.run_once() == ['EUR', 'GBP', 'USD']
+    # all fresh: nothing to do
+    assert prefetcher.run_once() == []
+
+    # EUR's table is past the refresh point but not yet expired
+    currency_tool._rate_tables.peek('EUR')['fetched_at'] -= settings.RATE_TABLE_TTL_S * 0.9
+    assert prefetcher.run_once() == ['EUR']
+    # agent lookups are served from the warm tables
+    provider.clear()
+    currency_tool.get_exchange_rate('GBP', 'EUR')
+    assert provider == []
+
+
+def test_prefetcher_respects_budget_and_stops_on_failure(provider, monkeypatch):
+    prefetcher = RatePrefetcher(top_n=0, seed_bases=['USD', 'EUR', 'GBP'], max_per_minute=2)
+    assert prefetcher.run_once() == ['USD', 'EUR']
+    assert prefetcher.stats['skipped_budget'] == 1
+
+    def failing_fetch(base, retries=3):
+        raise currency_tool.ToolExecutionError('rate limited')
+
+    monkeypatch.setattr(currency_tool, 'fetch_rate_table', failing_fetch)
+    prefetcher = RatePrefetcher(top_n=0, seed_bases=['GBP', 'JPY'], max_per_minute=10)
+    assert prefetcher.run_once() == []
+    assert prefetcher.stats['failed'] == 1
+
+
+def test_prefetch_is_one_request_per_budget_token(monkeypatch):
+    calls = []
+
+    def flaky_get(url, **kwargs):
+        calls.append(url)
+        raise currency_tool.RequestException('503')
+
+    monkeypatch.setattr(currency_tool.requests, 'get', flaky_get)
+    monkeypatch.setattr(currency_tool.cb, 'record_failure', lambda key: None)
+    monkeypatch.setattr(currency_tool.cb, 'is_open', lambda key: False)
+    prefetcher = RatePrefetcher(top_n=0, seed_bases=['SEK'], max_per_minute=1)
+    assert prefetcher.run_once() == [] and len(calls) == 1
+
+
+def test_only_the_lease_holder_prefetches(provider, tmp_path, monkeypatch):
+    # two workers sharing the sqlite cache
+    monkeypatch.setattr(settings, 'CACHE_BACKEND', 'sqlite')
+    monkeypatch.setattr(settings, 'CACHE_SQLITE_PATH', str(tmp_path / 'shared.sqlite3'))
+    first = RatePrefetcher(top_n=0, seed_bases=['USD'], max_per_minute=10)
+    second = RatePrefetcher(top_n=0, seed_bases=['USD'], max_per_minute=10)
+    assert first.run_once() == ['USD']
+    currency_tool._rate_tables.delete('USD')
+    assert second.run_once() == [] and second.stats['skipped_not_leader'] == 1
+    # the leader renews its lease every cycle
+    assert first.run_once() == ['USD'] and provider == ['USD', 'USD']
+
+
+def test_lifespan_runs_prefetcher(provider, monkeypatch):
+    monkeypatch.setattr(settings, 'RATE_PREFETCH_SEED_BASES', ['CHF'])
+    with TestClient(app) as client:
+        deadline = time.monotonic() + 5
+        while 'CHF' not in provider and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = client.get('/v1/rates/prefetch').json()
+    assert provider[0] == 'CHF'
+    assert stats['running'] is True and stats['refreshed'] >= 1
+    assert rate_prefetch._prefetcher is None
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from config import settings
+from main import app
+from tools import registry_check
+from tools.registry_check import iter_verify_companies, verify_companies
+from utils.cache import TTLCache
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def counted_lookup(monkeypatch):
+    """Replace the uncached lookup with a slow stub that records concurrency."""
+    monkeypatch.setattr(registry_check, '_cache', TTLCache())
+    state = {'calls': [], 'active': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def fake_lookup(name):
+        with lock:
+            state['calls'].append(name)
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.02)
+        with lock:
+            state['active'] -= 1
+        return {'name': name, 'status': 'Active'}, True
+
+    monkeypatch.setattr(registry_check, '_lookup', fake_lookup)
+    return state
+
+
+def test_cache_expires_and_evicts(monkeypatch):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # evicts 'b', the least recently used
+    assert cache.get('b') is None and len(cache) == 2
+
+    now = time.monotonic()
+    monkeypatch.setattr('utils.cache.time.monotonic', lambda: now + 61)
+    assert cache.get('a') is None
+    assert cache.hits == 1 and cache.misses == 2
+
+
+def test_bulk_dedupes_and_reuses_cache(counted_lookup):
+    results = verify_companies(['Tesla, Inc.', 'TESLA INC', 'Ford Motor Co'])
+    assert set(results) == {'Tesla, Inc.', 'TESLA INC', 'Ford Motor Co'}
+    assert results['TESLA INC'] is results['Tesla, Inc.']
+    assert sorted(counted_lookup['calls']) == ['Ford Motor Co', 'Tesla, Inc.']
+
+    # a second batch only looks up the new name
+    verify_companies(['Ford Motor Co', 'Acme Widgets Ltd'])
+    assert counted_lookup['calls'][-1] == 'Acme Widgets Ltd'
+    assert len(counted_lookup['calls']) == 3
+
+
+def test_bulk_caps_concurrency(counted_lookup, monkeypatch):
+    monkeypatch.setattr(settings, 'REGISTRY_BULK_CONCURRENCY', 4)
+    names = [f'Company {i}' for i in range(20)]
+    results = dict(iter_verify_companies(names))
+    assert len(results) == 20
+    assert 1 < counted_lookup['peak'] <= 4
+
+
+def test_bulk_endpoint_streams_ndjson(counted_lookup):
+    registry_check._cache.set('tesla', {'name': 'Tesla, Inc.', 'status': 'Active'})
+    resp = client.post('/v1/registry/verify', json={'company_names': ['Tesla', 'Globex', 'Globex']})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    # cached results come first, then each completed lookup
+    assert lines[0] == {'company_name': 'Tesla', 'result': {'name': 'Tesla, Inc.', 'status': 'Active'}}
+    assert [line['company_name'] for line in lines[1:]] == ['Globex', 'Globex']
+    assert counted_lookup['calls'] == ['Globex']
+
+
+def test_bulk_endpoint_rejects_empty_batches():
+    resp = client.post('/v1/registry/verify', json={'company_names': []})
+    assert resp.status_code == 422
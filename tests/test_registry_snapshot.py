@@ -0,0 +1,87 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from config import settings
+from tools.registry_snapshot import load_snapshot, normalize_name
+from tools import registry_check
+from tools.registry_check import verify_company_registry
+from utils.cache import TTLCache
+
+CSV = """name,cik,status,country
+"Tesla, Inc.",0001318605,Active,USA
+Ford Motor Co,0000037996,Active,USA
+The Coca-Cola Company,0000021344,Active,USA
+Acme Widgets Ltd,0009999999,Dissolved,UK
+"""
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    monkeypatch.setattr('tools.registry_check._cache', TTLCache())
+    path = tmp_path / 'registry.csv'
+    path.write_text(CSV, encoding='utf-8')
+    monkeypatch.setattr(settings, 'REGISTRY_SNAPSHOT_PATH', str(path))
+    return str(path)
+
+
+def test_normalize_name_strips_legal_suffixes():
+    assert normalize_name('Tesla, Inc.') == normalize_name('TESLA INC') == 'tesla'
+    assert normalize_name('The Coca-Cola Company') == 'coca cola'
+    assert normalize_name('Procter & Gamble Co.') == 'procter and gamble'
+
+
+def test_lookup_exact_and_fuzzy(snapshot_path):
+    snapshot = load_snapshot(snapshot_path)
+    exact = snapshot.lookup('tesla inc')[0]
+    assert exact.score == 1.0 and exact.record['cik'] == '0001318605'
+
+    fuzzy = snapshot.lookup('Acme Widget Limited', limit=1)[0]
+    assert fuzzy.record['name'] == 'Acme Widgets Ltd' and 0.75 <= fuzzy.score < 1.0
+    assert snapshot.by_cik('37996')['name'] == 'Ford Motor Co'
+
+
+def test_verify_company_registry_answers_from_fresh_snapshot(snapshot_path, monkeypatch):
+    monkeypatch.setattr(settings, 'REGISTRY_API_URL', 'http://registry.example')
+    monkeypatch.setattr('tools.registry_check._get_session', lambda: pytest.fail('API called'))
+
+    result = verify_company_registry('Coca Cola')
+    assert result['cik'] == '0000021344' and result['matched_from'] == 'snapshot'
+
+
+def test_verify_company_registry_uses_api_for_misses_and_stale_snapshots(snapshot_path, monkeypatch):
+    calls = []
+
+    class Resp:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {'name': 'Tesla, Inc.', 'status': 'Active', 'source': 'api'}
+
+    def fake_get(url, params=None, timeout=5):
+        calls.append(params['q'])
+        return Resp()
+
+    monkeypatch.setattr(settings, 'REGISTRY_API_URL', 'http://registry.example')
+    monkeypatch.setattr('tools.registry_check._get_session', lambda: SimpleNamespace(get=fake_get))
+
+    assert verify_company_registry('Globex Corporation')['source'] == 'api'
+
+    # snapshot older than REGISTRY_SNAPSHOT_MAX_AGE_DAYS: check freshness with the API
+    stale = time.time() - (settings.REGISTRY_SNAPSHOT_MAX_AGE_DAYS + 1) * 86400
+    os.utime(snapshot_path, (stale, stale))
+    assert verify_company_registry('Tesla')['source'] == 'api'
+    assert calls == ['Globex Corporation', 'Tesla']
+    # repeated lookups are served from the result cache
+    assert verify_company_registry('TESLA INC')['source'] == 'api'
+    assert calls == ['Globex Corporation', 'Tesla']
+
+    # API down: the stale snapshot still answers
+    registry_check._cache.clear()
+    monkeypatch.setattr('tools.registry_check._get_session',
+                        lambda: (_ for _ in ()).throw(requests.ConnectionError('down')))
+    assert verify_company_registry('Tesla')['matched_from'] == 'snapshot'
@@ -0,0 +1,181 @@
+from unittest.mock import Mock
+
+import pytest
+from fastapi.testclient import TestClient
+
+import agent_controller
+import session_memory
+from config import settings
+from main import app
+from session_memory import Session
+from utils.cache import TTLCache
+
+client = TestClient(app)
+
+
+class DummyResp:
+    def __init__(self, text='', function_calls=None):
+        self.text = text
+        self.function_calls = function_calls or []
+
+
+@pytest.fixture(autouse=True)
+def fresh_store(monkeypatch):
+    monkeypatch.setattr(session_memory, '_store', TTLCache(ttl=60))
+    monkeypatch.setattr(settings, 'LLM_PROVIDER', 'groq')
+    monkeypatch.setattr(settings, 'AGENT_FAST_PATH_ENABLED', False)
+    monkeypatch.setattr(settings, 'MODEL_ROUTING_ENABLED', False)
+
+
+def test_history_is_summarized_under_budget(monkeypatch):
+    monkeypatch.setattr(settings, 'SESSION_KEEP_TURNS', 2)
+    monkeypatch.setattr(settings, 'SESSION_CONTEXT_TOKEN_BUDGET', 120)
+    session = Session('s1')
+    for i in range(6):
+        session.add_turn(f"Question {i} about revenue?", f"Revenue in period {i} was ${i}00M. " + "Detail. " * 20, [])
+
+    assert [t['query'] for t in session.turns] == ['Question 5 about revenue?']
+    assert session.summary[-1] == '- Question 4 about revenue? -> Revenue in period 4 was $400M.'
+    from tools.context_builder import estimate_tokens
+    assert estimate_tokens(session.render()) <= 120
+    prompt = session_memory.with_history(session, 'And in EUR?')
+    assert prompt.startswith('CONVERSATION HISTORY:') and prompt.endswith('CURRENT QUESTION:\nAnd in EUR?')
+
+
+def test_tool_results_reused_while_fresh(monkeypatch):
+    session = Session('s1')
+    session.record_tool('get_exchange_rate', {'source_currency': 'USD', 'target_currency': 'EUR'}, 0.9)
+    assert session.fresh_tool_result('get_exchange_rate', {'target_currency': 'EUR', 'source_currency': 'USD'}) == 0.9
+    assert session.fresh_tool_result('get_exchange_rate', {'source_currency': 'USD', 'target_currency': 'GBP'}) is session_memory.MISSING
+
+    monkeypatch.setitem(settings.SESSION_TOOL_RESULT_TTL_S, 'get_exchange_rate', 0.0)
+    assert session.fresh_tool_result('get_exchange_rate', {'source_currency': 'USD', 'target_currency': 'EUR'}) is session_memory.MISSING
+
+
+def test_follow_up_reuses_tool_result_and_sees_history(monkeypatch):
+    prompts = []
+    call = {'tool': 'get_exchange_rate', 'args': {'source_currency': 'USD', 'target_currency': 'EUR'}}
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        prompts.append(prompt)
+        if tools is not None:
+            return DummyResp(function_calls=[call])
+        return DummyResp(text='1 USD = 0.9 EUR.')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    get_rate = Mock(return_value=0.9)
+    monkeypatch.setitem(agent_controller.tools, 'get_exchange_rate', get_rate)
+
+    first = agent_controller.process_query_with_agent('Convert USD to EUR', session_id='abc')
+    assert first['session_id'] == 'abc' and first['final_answer'] == '1 USD = 0.9 EUR.'
+    prompts.clear()
+
+    logged = []
+    monkeypatch.setattr(agent_controller, 'log_interaction', lambda kind, query, details=None: logged.append((kind, details)))
+    second = agent_controller.process_query_with_agent('What about 100 of them?', session_id='abc')
+    assert second['used_tools'] == ['get_exchange_rate']
+    # the reused result is still audited, so the answer can be replayed
+    assert logged == [('TOOL_CALL', {'tool': 'get_exchange_rate', 'args': call['args'], 'result': 0.9, 'reused': True})]
+    get_rate.assert_called_once()
+    assert 'User: Convert USD to EUR\nAssistant: 1 USD = 0.9 EUR.' in prompts[0]
+    assert prompts[0].endswith('What about 100 of them?')
+    assert len(session_memory.load('abc').turns) == 2
+
+    # without a session nothing is remembered or reused
+    agent_controller.process_query_with_agent('Convert USD to EUR')
+    assert get_rate.call_count == 2
+
+
+def test_rag_results_are_not_reused_across_index_changes_or_failures(monkeypatch):
+    from tools import rag_retriever
+
+    version = [1]
+    monkeypatch.setattr(rag_retriever, 'index_version', lambda: version[0])
+    session = Session('s1')
+    args = {'user_query': 'q3 revenue'}
+    session.record_tool('generate_rag_answer', args, {'answer': '$500M', 'audit_success': True})
+    assert session.fresh_tool_result('generate_rag_answer', args)['answer'] == '$500M'
+    version[0] += 1
+    assert session.fresh_tool_result('generate_rag_answer', args) is session_memory.MISSING
+
+    session.record_tool('generate_rag_answer', args, {'answer': 'No relevant documents.', 'audit_success': False})
+    session.record_tool('get_exchange_rate', {'source_currency': 'USD'}, {'error': 'timeout'})
+    # failures are not kept: only the (now stale) successful answer is stored
+    assert [e['result'] for e in session.tool_results.values()] == [{'answer': '$500M', 'audit_success': True}]
+
+
+def test_tool_results_recorded_from_parallel_threads(tmp_path, monkeypatch):
+    import threading
+
+    from utils.cache import SQLiteCache
+
+    monkeypatch.setattr(settings, 'SESSION_MAX_TOOL_RESULTS', 5)
+    session = Session('s1')
+
+    def record(worker):
+        for i in range(200):
+            session.record_tool('get_exchange_rate', {'worker': worker, 'i': i}, {'chunk_ids': [f'{worker}-{i}']})
+
+    threads = [threading.Thread(target=record, args=(w,)) for w in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(session.tool_results) == 5 and len(session.pending_chunk_ids) == 800
+
+    # the lock is not stored with the session
+    store = SQLiteCache(str(tmp_path / 'sessions.sqlite3'), 'sessions')
+    store.set('s1', session)
+    restored = store.get('s1')
+    restored.record_tool('get_exchange_rate', {'worker': 9}, 1.0)
+    assert len(restored.tool_results) == 5
+
+
+def test_rag_chunk_ids_are_recorded_per_turn():
+    session = Session('s1')
+    with session_memory.session_scope(session):
+        session_memory.record_tool_result('generate_rag_answer', {'user_query': 'q3 revenue'},
+                                          {'answer': '$500M', 'chunk_ids': ['c1', 'c2', 'c1']})
+    session.add_turn('q3 revenue', '$500M', ['generate_rag_answer'])
+    assert session.turns[0]['chunk_ids'] == ['c1', 'c2'] and session.pending_chunk_ids == []
+
+
+def test_api_returns_and_continues_sessions(monkeypatch):
+    seen = []
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        seen.append(prompt)
+        return DummyResp(text=f'answer {len(seen)}')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    # a stateless query stores nothing
+    assert client.post('/v1/query', json={'query': 'One-off'}).json()['session_id'] is None
+    assert len(session_memory._get_store()) == 0
+
+    first = client.post('/v1/query', json={'query': 'Hello', 'new_session': True}).json()
+    assert first['session_id']
+    client.post('/v1/query', json={'query': 'Follow up', 'session_id': first['session_id']})
+    assert 'User: Hello\nAssistant: answer 2' in seen[-1]
+
+    assert client.delete(f"/v1/sessions/{first['session_id']}").status_code == 200
+    client.post('/v1/query', json={'query': 'Fresh start', 'session_id': first['session_id']})
+    assert seen[-1] == 'Fresh start'
+
+
+def test_concurrent_turns_of_a_session_are_not_lost(monkeypatch):
+    import threading
+    import time
+
+    def fake_generate_content(prompt, model=None, tools=None):
+        time.sleep(0.05)
+        return DummyResp(text='ok')
+
+    monkeypatch.setattr(agent_controller, 'generate_content', fake_generate_content)
+    threads = [threading.Thread(target=agent_controller.process_query_with_agent, args=(f'Question {i}', 'shared'))
+               for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(t['query'] for t in session_memory.load('shared').turns) == ['Question 0', 'Question 1', 'Question 2']
+    assert session_memory._locks == {}
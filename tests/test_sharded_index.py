@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from config import settings
+from tools import rag_retriever
+from tools.sharded_index import ShardedVectorIndex, benchmark, shard_for
+from tools.vector_index import VectorIndex, _synthetic_vectors
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    index = ShardedVectorIndex(str(tmp_path), shards=3, quantization='none')
+    yield index
+    index.close()
+
+
+def test_scatter_gather_matches_single_index(tmp_path, sharded):
+    vectors = _synthetic_vectors(3000, 32, seed=0)
+    ids = [f"c{i}" for i in range(3000)]
+    single = VectorIndex(str(tmp_path), quantization='none')
+    single.add(ids, vectors)
+    sharded.add(ids, vectors)
+    assert len(sharded) == 3000 and {shard_for(i, 3) for i in ids} == {0, 1, 2}
+
+    queries = _synthetic_vectors(20, 32, seed=1)
+    for query, hits in zip(queries, sharded.search_many(queries, 5)):
+        expected = single.search(query, 5)
+        assert [i for i, _ in hits] == [i for i, _ in expected]
+        assert np.allclose([s for _, s in hits], [s for _, s in expected], atol=1e-5)
+    single.close()
+
+    # a batch larger than the shared block gets a new block
+    assert len(sharded.search_many(_synthetic_vectors(600, 32, seed=2), 3)) == 600
+
+
+def test_remove_exclude_and_company_routing(sharded):
+    sharded.add(['a', 'b', 'c'], [[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0]], shard_keys=['ACME', 'ACME', 'GLOBEX'])
+    assert sharded._shard_of['a'] == sharded._shard_of['b'] == shard_for('ACME', 3)
+    assert [i for i, _ in sharded.search([1, 0, 0], 2, exclude={'a'})] == ['b', 'c']
+
+    # re-routing a chunk moves it between shards instead of duplicating it
+    sharded.add(['b'], [[0.9, 0.1, 0]], shard_keys=['INITECH'])
+    assert [i for i, _ in sharded.search([1, 0, 0], 3)] == ['a', 'b', 'c']
+    sharded.remove(['a'])
+    assert 'a' not in sharded and [i for i, _ in sharded.search([1, 0, 0], 3)] == ['b', 'c']
+
+    with pytest.raises(ValueError):
+        sharded.add(['d'], [[1, 0]])
+
+
+def test_failed_command_leaves_no_stale_replies(sharded):
+    ids = [f"c{i}" for i in range(30)]
+    sharded.add(ids, np.eye(3)[np.arange(30) % 3])
+    with pytest.raises(ValueError, match='dimension 4'):
+        sharded.add([f"x{i}" for i in range(30)], np.ones((30, 4)))
+    # every shard failed; the next commands get their own replies
+    (best, score), = sharded.search([1, 0, 0], 1)
+    assert int(best[1:]) % 3 == 0 and score == pytest.approx(1.0)
+    sharded.remove(['c0'])
+    assert len(sharded.search([0, 1, 0], 40)) == 29
+
+
+def test_shard_count_is_capped_at_the_cores(monkeypatch):
+    monkeypatch.setattr('os.cpu_count', lambda: 2)
+    monkeypatch.setattr(settings, 'RAG_VECTOR_SHARDS', 8)
+    assert rag_retriever._vector_shards() == 2
+    monkeypatch.setattr(settings, 'RAG_VECTOR_SHARDS', 1)
+    assert rag_retriever._vector_shards() == 1
+
+
+def test_benchmark_skips_shard_counts_above_the_cores(monkeypatch):
+    monkeypatch.setattr('tools.sharded_index.multiprocessing.cpu_count', lambda: 1)
+    report = benchmark(n=500, dim=16, queries=4, shards=(1, 2))
+    assert report['shards_1_qps'] > 0
+    assert report['shards_2'].startswith('skipped') and 'shards_2_qps' not in report
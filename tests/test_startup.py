@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from tools.import_profile import parse_importtime
+
+ROOT = Path(__file__).resolve().parent.parent
+# Cold import budget for a new API worker; override with STARTUP_BUDGET_S on slow machines
+STARTUP_BUDGET_S = float(os.getenv('STARTUP_BUDGET_S', '2.0'))
+# Modules that must only load on first use
+LAZY_MODULES = ['uvicorn', 'chromadb', 'google.genai', 'tools.currency_tool', 'tools.finance_rag',
+                'tools.rag_retriever', 'tools.registry_check']
+
+
+def test_worker_startup_within_budget():
+    code = (
+        "import json, sys, time\n"
+        "t = time.perf_counter()\n"
+        "import main\n"
+        "elapsed = time.perf_counter() - t\n"
+        "import audit\n"
+        f"print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules], "
+        "'audit_configured': audit._configured}))\n"
+    )
+    proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    assert report['loaded'] == []
+    assert report['elapsed'] < STARTUP_BUDGET_S
+    # audit log handlers are only attached on the first logged interaction
+    assert report['audit_configured'] is False
+
+
+def test_parse_importtime_output():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   config\n"
+        "import time:       300 |        420 | main\n"
+    )
+    timings = parse_importtime(stderr)
+    assert [(t.module, t.cumulative_us, t.depth) for t in timings] == [('config', 120, 1), ('main', 420, 0)]
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from config import settings
+from tools import rag_retriever
+from tools.chunk_store import ChunkStore
+from tools.vector_index import VectorIndex, _normalize, _synthetic_vectors, benchmark
+
+
+def _recall(index, vectors, queries, k=10):
+    unit = _normalize(vectors)
+    found = []
+    for q in queries:
+        truth = set(np.argsort(-(unit @ _normalize(q[None])[0]))[:k].tolist())
+        found.append(len(truth & {int(i) for i, _ in index.search(q, k)}) / k)
+    return float(np.mean(found))
+
+
+@pytest.mark.parametrize('mode, min_recall', [('int8', 0.99), ('pq', 0.85)])
+def test_quantized_search_recall_vs_exact(tmp_path, mode, min_recall):
+    vectors = _synthetic_vectors(4000, 64, seed=0)
+    index = VectorIndex(str(tmp_path), quantization=mode, rescore=200, pq_subvectors=16, pq_train_size=2000)
+    index.add([str(i) for i in range(2000)], vectors[:2000])
+    index.add([str(i) for i in range(2000, 4000)], vectors[2000:])
+    assert _recall(index, vectors, _synthetic_vectors(30, 64, seed=1)) >= min_recall
+    if mode == 'int8':
+        assert index.nbytes() < vectors.nbytes / 3
+    else:
+        assert index.pq is not None and index._codes.shape[1] == 16
+    index.close()
+
+
+def test_pq_sub_vectors_must_divide_the_dimension(tmp_path):
+    index = VectorIndex(str(tmp_path), quantization='pq', pq_subvectors=48)
+    with pytest.raises(ValueError, match='48 sub-vectors'):
+        index.add(['a'], _synthetic_vectors(1, 128, seed=0))
+    assert len(index) == 0 and index.quantization == 'pq'
+    index.close()
+
+
+def test_benchmark_pq_uses_sub_vectors_that_fit_the_dimension():
+    report = benchmark(n=600, dim=128, queries=5)
+    assert report['pq_subvectors'] == 16
+    # 16 one-byte PQ codes per vector, not 128 int8 codes and a scale
+    assert report['pq_bytes_per_vector'] < report['int8_bytes_per_vector'] / 4
+
+
+def test_replace_remove_and_exclude(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    index.add(['a', 'b', 'c'], [[1, 0, 0], [0, 1, 0], [0.9, 0.1, 0]])
+    assert [i for i, _ in index.search([1, 0, 0], 2)] == ['a', 'c']
+    assert [i for i, _ in index.search([1, 0, 0], 2, exclude={'a'})] == ['c', 'b']
+
+    index.add(['a'], [[0, 0, 1]])
+    index.remove(['c'])
+    hits = index.search([1, 0, 0], 3)
+    assert [i for i, _ in hits] == ['b', 'a'] and len(index) == 2
+    with pytest.raises(ValueError):
+        index.add(['d'], [[1, 0]])
+    index.close()
+
+
+def test_retriever_uses_embedding_index(tmp_path, monkeypatch):
+    vocab = ['revenue', 'margin', 'outlook', 'energy']
+
+    def embed(text):
+        words = text.lower().replace('.', '').split()
+        return [float(words.count(v) + (v == 'revenue' and words.count('sales'))) for v in vocab]
+
+    monkeypatch.setattr(settings, 'RAG_VECTOR_INDEX_ENABLED', True)
+    monkeypatch.setattr(settings, 'RAG_VECTOR_DIR', str(tmp_path))
+    monkeypatch.setattr(rag_retriever, '_in_memory_store', ChunkStore())
+    monkeypatch.setattr(rag_retriever, '_tombstoned', set())
+    monkeypatch.setattr(rag_retriever, '_vector_index', None)
+    monkeypatch.setattr(rag_retriever, '_version_store', None)
+    monkeypatch.setattr(rag_retriever, 'embed_text', embed)
+    monkeypatch.setattr(rag_retriever, 'embed_query', lambda q: tuple(embed(q)))
+    monkeypatch.setattr(rag_retriever, '_has_semantic_embedder', lambda: True)
+
+    rag_retriever.upsert_chunks_to_vector_db([
+        {'id': 'r', 'text': 'Q3 revenue was $500M.', 'source': 'Q3 report'},
+        {'id': 'm', 'text': 'Margin was 18%.', 'source': 'Q3 report'},
+        {'id': 'o', 'text': 'Outlook: renewable energy.', 'source': 'CEO letter'},
+    ])
+    hits = rag_retriever.retrieve_scored_documents('What were Q3 sales', 2)
+    assert hits[0].chunk_id == 'r' and hits[0].score == pytest.approx(1.0)
+
+    rag_retriever.tombstone_chunks(['r'])
+    assert 'r' not in [c.chunk_id for c in rag_retriever.retrieve_scored_documents('What were Q3 sales', 2)]
+    rag_retriever.delete_chunks_from_vector_db(['r'])
+    assert 'r' not in rag_retriever._vector_index
+    rag_retriever._vector_index.close()
+
+
+@pytest.mark.parametrize('mode', ['int8', 'pq', 'none'])
+def test_replaced_and_removed_rows_are_compacted(tmp_path, mode):
+    import os
+
+    vectors = _synthetic_vectors(600, 32, seed=0)
+    index = VectorIndex(str(tmp_path), quantization=mode, pq_subvectors=8, pq_train_size=200)
+    ids = [str(i) for i in range(200)]
+    for round_ in range(3):  # incremental re-ingestion replaces every vector
+        index.add(ids, vectors[round_ * 200:(round_ + 1) * 200])
+    assert len(index._ids) < 400 and os.path.getsize(index.path) == len(index._ids) * 32 * 4
+    assert [i for i, _ in index.search(vectors[450], 1)] == ['50']
+
+    index.remove(ids[:150])
+    assert len(index) == len(index._ids) == 50 and os.listdir(tmp_path) == [os.path.basename(index.path)]
+    assert [i for i, _ in index.search(vectors[580], 1)] == ['180']
+    index.close()
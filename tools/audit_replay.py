@@ -0,0 +1,346 @@
+"""Replay the production query mix recorded in ``audit_trail.log`` against the agent.
+
+The audit trail holds one JSON record per line (``USER_QUERY`` and ``TOOL_CALL``
+entries written by ``audit.log_interaction``). This module rebuilds each query
+from those records and replays it through ``process_query_with_agent`` with a
+mock LLM that re-emits the recorded tool selection and final answer, and with
+tool stubs that return the recorded tool results. No external calls are made.
+
+Usage:
+    python -m tools.audit_replay audit_trail.log --speed 10 --concurrency 16
+"""
+import argparse
+import contextlib
+import json
+import logging
+import math
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RecordedToolCall:
+    tool: str
+    args: Optional[dict]
+    result: Any
+
+
+@dataclass
+class RecordedQuery:
+    query: str
+    arrival: float
+    tool_calls: List[RecordedToolCall] = field(default_factory=list)
+    used_tools: List[str] = field(default_factory=list)
+    final_answer: str = ""
+
+
+@dataclass
+class ReplayResult:
+    query: str
+    latency_s: float
+    recorded_tools: List[str]
+    replayed_tools: List[str]
+    error: Optional[str] = None
+
+    @property
+    def tools_match(self) -> bool:
+        return sorted(set(self.recorded_tools)) == sorted(set(self.replayed_tools))
+
+
+def _parse_line(line: str) -> Optional[dict]:
+    # Lines look like "<asctime> | <level> | <json message>"; other loggers share the file.
+    parts = line.rstrip("\n").split(" | ", 2)
+    if len(parts) != 3:
+        return None
+    try:
+        record = json.loads(parts[2])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(record, dict) or "type" not in record:
+        return None
+    return record
+
+
+def _parse_timestamp(value: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def parse_audit_log(lines: Iterable[str]) -> List[RecordedQuery]:
+    """Group audit records into recorded queries, ordered by arrival time.
+
+    ``TOOL_CALL`` records are written while a query is processed and the
+    ``USER_QUERY`` record once it completes, so tool calls are buffered per
+    request id until the matching ``USER_QUERY`` record closes them. Records
+    written before request ids were audited are matched by query text.
+    """
+    pending: Dict[str, List[tuple]] = {}
+    queries: List[RecordedQuery] = []
+    for line in lines:
+        record = _parse_line(line)
+        if record is None:
+            continue
+        query = record.get("query")
+        if not isinstance(query, str):
+            continue
+        ts = _parse_timestamp(record.get("timestamp"))
+        details = record.get("response_details") or {}
+        key = record.get("request_id") or query
+        if record["type"] == "TOOL_CALL":
+            call = RecordedToolCall(details.get("tool"), details.get("args"), details.get("result"))
+            pending.setdefault(key, []).append((ts, call))
+        elif record["type"] == "USER_QUERY":
+            calls = pending.pop(key, [])
+            arrival = min([ts] + [c[0] for c in calls])
+            queries.append(RecordedQuery(
+                query=query,
+                arrival=arrival,
+                tool_calls=[c[1] for c in calls],
+                used_tools=list(details.get("used_tools") or []),
+                final_answer=details.get("final_answer") or "",
+            ))
+    queries.sort(key=lambda q: q.arrival)
+    return queries
+
+
+def load_audit_log(path: str) -> List[RecordedQuery]:
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_audit_log(f)
+
+
+def _args_key(tool: str, args: Optional[dict]) -> str:
+    return tool + ":" + json.dumps(args or {}, sort_keys=True, default=str)
+
+
+def _placeholder_args(tool: str, query: str) -> dict:
+    # Records written before tool args were audited only carry the tool name; fill
+    # each required field with the query text so arg validation still passes.
+    from agent_controller import TOOL_ARG_MODELS
+
+    model = TOOL_ARG_MODELS.get(tool)
+    if model is None:
+        return {}
+    return {name: query for name, f in model.model_fields.items() if f.is_required()}
+
+
+class ReplayLLM:
+    """Mock LLM that replays the recorded tool selection and final answer for each query."""
+
+    def __init__(self, recorded: List[RecordedQuery], latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self._by_query = {r.query: r for r in recorded}
+
+    def _lookup(self, prompt: str) -> Optional[RecordedQuery]:
+        record = self._by_query.get(prompt)
+        if record is not None:
+            return record
+        # Synthesis prompts embed the original query; pick the longest recorded match.
+        matches = [r for q, r in self._by_query.items() if q and q in prompt]
+        return max(matches, key=lambda r: len(r.query)) if matches else None
+
+    def __call__(self, prompt: str, model: Optional[str] = None, tools: Any = None, **kwargs):
+        from llm_client import LLMResponse
+
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        record = self._lookup(prompt)
+        if record is None:
+            return LLMResponse(text="")
+        if tools is not None and record.tool_calls:
+            calls = []
+            for call in record.tool_calls:
+                args = call.args if call.args is not None else _placeholder_args(call.tool, record.query)
+                calls.append({"tool": call.tool, "args": args})
+            return LLMResponse(text="", function_calls=calls)
+        return LLMResponse(text=record.final_answer)
+
+    def stream(self, prompt: str, model: Optional[str] = None, tools: Any = None, on_tool_call=None, **kwargs):
+        response = self(prompt, model=model, tools=tools)
+        if on_tool_call:
+            for call in response.function_calls:
+                on_tool_call(call)
+        return response
+
+
+class RecordedTool:
+    """Tool stub returning the recorded result for matching args (or the last result for the tool)."""
+
+    def __init__(self, name: str, recorded: List[RecordedQuery], latency_s: float = 0.0):
+        self.name = name
+        self.latency_s = latency_s
+        self._by_args: Dict[str, Any] = {}
+        self._last: Any = None
+        self._seen = False
+        for record in recorded:
+            for call in record.tool_calls:
+                if call.tool != name:
+                    continue
+                self._seen = True
+                self._last = call.result
+                if call.args is not None:
+                    self._by_args[_args_key(name, call.args)] = call.result
+
+    def __call__(self, **kwargs):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        key = _args_key(self.name, kwargs)
+        if key in self._by_args:
+            result = self._by_args[key]
+        elif self._seen:
+            result = self._last
+        else:
+            raise RuntimeError(f"No recorded result for tool '{self.name}'")
+        if isinstance(result, dict) and set(result) == {"error"}:
+            raise RuntimeError(result["error"])
+        return result
+
+
+@contextlib.contextmanager
+def _patched_agent(llm: ReplayLLM, stubs: Dict[str, RecordedTool]):
+    import agent_controller
+    from tools import rag_prefetch
+
+    saved_generate = agent_controller.generate_content
+    saved_retrieve = rag_prefetch._retrieve
+    saved_stream = agent_controller.stream_content
+    saved_log = agent_controller.log_interaction
+    saved_tools = dict(agent_controller.tools)
+    agent_controller.generate_content = llm
+    agent_controller.stream_content = llm.stream
+    # Replays must not append to the audit trail they are read from
+    agent_controller.log_interaction = lambda *a, **k: None
+    agent_controller.tools.update(stubs)
+    # generate_rag_answer is stubbed, so speculative retrieval would only make real embedding/vector DB calls
+    rag_prefetch._retrieve = lambda query, k: []
+    try:
+        yield agent_controller
+    finally:
+        agent_controller.generate_content = saved_generate
+        agent_controller.stream_content = saved_stream
+        agent_controller.log_interaction = saved_log
+        rag_prefetch._retrieve = saved_retrieve
+        agent_controller.tools.clear()
+        agent_controller.tools.update(saved_tools)
+
+
+def replay(recorded: List[RecordedQuery], speed: float = 1.0, concurrency: int = 16,
+           llm_latency_s: float = 0.0, tool_latency_s: float = 0.0) -> List[ReplayResult]:
+    """Replay recorded queries against the agent.
+
+    Args:
+        recorded: Queries parsed from the audit trail.
+        speed: Rate multiplier for the original inter-arrival gaps (2.0 replays twice as fast).
+            0 submits every query immediately.
+        concurrency: Maximum number of queries in flight.
+        llm_latency_s: Simulated latency for each mock LLM call.
+        tool_latency_s: Simulated latency for each stubbed tool call.
+
+    Returns:
+        One ReplayResult per recorded query, in arrival order.
+    """
+    if not recorded:
+        return []
+    llm = ReplayLLM(recorded, latency_s=llm_latency_s)
+    tool_names = {c.tool for r in recorded for c in r.tool_calls if c.tool}
+    results: List[Optional[ReplayResult]] = [None] * len(recorded)
+    lock = threading.Lock()
+
+    with _patched_agent(llm, {}) as agent:
+        tool_names.update(agent.tools)
+        agent.tools.update({name: RecordedTool(name, recorded, tool_latency_s) for name in tool_names})
+
+        def run(idx: int, record: RecordedQuery):
+            start = time.perf_counter()
+            error = None
+            replayed: List[str] = []
+            try:
+                out = agent.process_query_with_agent(record.query)
+                replayed = list(out.get("used_tools") or [])
+            except Exception as exc:
+                error = str(exc)
+            latency = time.perf_counter() - start
+            with lock:
+                results[idx] = ReplayResult(record.query, latency, record.used_tools, replayed, error)
+
+        origin = recorded[0].arrival
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            for idx, record in enumerate(recorded):
+                if speed > 0:
+                    delay = (record.arrival - origin) / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                pool.submit(run, idx, record)
+    return [r for r in results if r is not None]
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # nearest-rank percentile
+    idx = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[idx]
+
+
+def summarize(results: List[ReplayResult]) -> dict:
+    """Latency distribution (milliseconds) and tool-selection differences for a replay run."""
+    latencies = sorted(r.latency_s * 1000.0 for r in results)
+    mismatches = [r for r in results if not r.tools_match]
+    return {
+        "queries": len(results),
+        "errors": sum(1 for r in results if r.error),
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        "tool_selection_match_rate": (1 - len(mismatches) / len(results)) if results else 1.0,
+        "tool_selection_diffs": [
+            {"query": r.query, "recorded": r.recorded_tools, "replayed": r.replayed_tools}
+            for r in mismatches
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay audit-trail traffic against the agent with a mock LLM')
+    parser.add_argument('file', nargs='?', default='audit_trail.log', help='Path to the audit trail log')
+    parser.add_argument('--speed', type=float, default=1.0, help='Arrival-rate multiplier (0 = no pacing)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum queries in flight')
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help='Simulated latency per LLM call')
+    parser.add_argument('--tool-latency-ms', type=float, default=0.0, help='Simulated latency per tool call')
+    parser.add_argument('--limit', type=int, default=0, help='Replay only the first N queries')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    recorded = load_audit_log(args.file)
+    if args.limit:
+        recorded = recorded[:args.limit]
+    results = replay(recorded, speed=args.speed, concurrency=args.concurrency,
+                     llm_latency_s=args.llm_latency_ms / 1000.0, tool_latency_s=args.tool_latency_ms / 1000.0)
+    report = summarize(results)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    lat = report["latency_ms"]
+    print(f"Replayed {report['queries']} queries ({report['errors']} errors)")
+    print("Latency ms: mean={mean:.1f} p50={p50:.1f} p90={p90:.1f} p95={p95:.1f} p99={p99:.1f} max={max:.1f}".format(**lat))
+    print(f"Tool selection match rate: {report['tool_selection_match_rate']:.1%}")
+    for diff in report["tool_selection_diffs"][:20]:
+        print(f"  {diff['query'][:60]!r}: recorded={diff['recorded']} replayed={diff['replayed']}")
+
+
+if __name__ == '__main__':
+    main()
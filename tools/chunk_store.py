@@ -0,0 +1,303 @@
+# Compact chunk storage for the in-memory vector-store fallback
+"""Columnar, low-overhead storage for indexed chunks.
+
+All chunk text lives in one contiguous UTF-8 buffer addressed by start/end offset
+arrays. Ids sit in a second byte buffer indexed by a sorted hash array, and sources and
+metadata are dictionary-encoded into integer code arrays. No Python object is kept
+per chunk. A dict-of-dicts store pays several hundred bytes of object overhead per
+chunk, before the text itself.
+
+Scans such as ``term_counts`` run over the buffer without building ``str`` objects.
+``view(row)`` materializes a ``__slots__`` ``ChunkView`` only for the hits a caller
+keeps. A view's text is a zero-copy ``memoryview`` that is decoded on first access.
+
+Text is never overwritten in place. Re-upserting a chunk appends its new text, and
+growing or compacting the buffer allocates a new one. A view taken earlier
+therefore keeps reading the text it was created with.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from array import array
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_INITIAL_CAPACITY = 1 << 16
+# Compact once dead text (replaced or deleted chunks) is at least this much, and half the buffer
+_COMPACT_MIN_GARBAGE = 1 << 20
+
+
+class _Dictionary:
+    """Dictionary encoding: each distinct value is stored once and referenced by an int code."""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]  # code 0 is "no value"
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ChunkView:
+    """One stored chunk; ``text`` is decoded from the shared buffer on first access."""
+
+    __slots__ = ('id', 'source', '_text', '_metadata')
+
+    def __init__(self, chunk_id: str, text: memoryview, source: Optional[str], metadata: Optional[str]):
+        self.id = chunk_id
+        self.source = source
+        self._text = text
+        self._metadata = metadata
+
+    @property
+    def text_bytes(self) -> memoryview:
+        return self._text if isinstance(self._text, memoryview) else memoryview(self._text.encode('utf-8'))
+
+    @property
+    def text(self) -> str:
+        if isinstance(self._text, memoryview):
+            self._text = str(self._text, 'utf-8')
+        return self._text
+
+    @property
+    def metadata(self) -> dict:
+        return json.loads(self._metadata) if self._metadata else {}
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'text': self.text, 'source': self.source, 'metadata': self.metadata}
+
+    def __repr__(self) -> str:
+        return f"ChunkView(id={self.id!r}, source={self.source!r})"
+
+
+class ChunkStore:
+    """Chunks keyed by id, upserted and deleted in place; iteration follows first-insertion order.
+
+    Ids are kept in their own byte buffer. The id -> row index is a sorted array of
+    id hashes (plus a small dict of recent inserts, merged in batches), so a chunk
+    costs a few fixed-size array slots rather than a dict entry and a str object.
+    """
+
+    def __init__(self, capacity: int = _INITIAL_CAPACITY):
+        self._buf = bytearray(capacity)
+        self._size = 0
+        self._garbage = 0
+        self._starts = array('q')
+        self._ends = array('q')
+        self._source_codes = array('l')
+        self._meta_codes = array('l')
+        self._id_buf = bytearray()
+        self._id_ends = array('q')
+        self._live = bytearray()
+        self._count = 0
+        self._sorted_hashes = np.empty(0, dtype=np.int64)
+        self._sorted_rows = np.empty(0, dtype=np.int64)
+        self._recent: Dict[int, List[int]] = {}
+        self._sources = _Dictionary()
+        self._metadata = _Dictionary()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, chunk_id) -> bool:
+        return isinstance(chunk_id, str) and self._find(chunk_id) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.chunk_id(row) for row in range(len(self._live)) if self._live[row])
+
+    def __getitem__(self, chunk_id: str) -> ChunkView:
+        row = self._find(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self.view(row)
+
+    def get(self, chunk_id: str) -> Optional[ChunkView]:
+        row = self._find(chunk_id)
+        return None if row is None else self.view(row)
+
+    def _id_bytes(self, row: int) -> bytes:
+        return bytes(self._id_buf[self._id_ends[row - 1] if row else 0:self._id_ends[row]])
+
+    def _find(self, chunk_id: str) -> Optional[int]:
+        key, h = chunk_id.encode('utf-8'), hash(chunk_id)
+        rows = list(self._recent.get(h, ()))
+        if len(self._sorted_hashes):
+            lo = int(self._sorted_hashes.searchsorted(h, 'left'))
+            hi = int(self._sorted_hashes.searchsorted(h, 'right'))
+            rows += self._sorted_rows[lo:hi].tolist()
+        # a hash can repeat (a collision, or a deleted and re-added id): confirm on the stored bytes
+        for row in rows:
+            if self._live[row] and self._id_bytes(row) == key:
+                return row
+        return None
+
+    def _index(self, chunk_id: str, row: int):
+        self._recent.setdefault(hash(chunk_id), []).append(row)
+        if len(self._recent) >= max(4096, len(self._sorted_hashes) // 4):
+            self._merge_recent()
+
+    def _merge_recent(self):
+        hashes = [h for h, rows in self._recent.items() for _ in rows]
+        rows = [row for rows in self._recent.values() for row in rows]
+        self._recent = {}
+        all_hashes = np.concatenate([self._sorted_hashes, np.array(hashes, dtype=np.int64)])
+        all_rows = np.concatenate([self._sorted_rows, np.array(rows, dtype=np.int64)])
+        order = np.argsort(all_hashes, kind='stable')
+        self._sorted_hashes, self._sorted_rows = all_hashes[order], all_rows[order]
+
+    def _write(self, data: bytes) -> Tuple[int, int]:
+        start, end = self._size, self._size + len(data)
+        if end > len(self._buf):
+            # a new buffer instead of resizing: memoryviews of the old one stay valid
+            grown = bytearray(max(end, 2 * len(self._buf)))
+            grown[:self._size] = memoryview(self._buf)[:self._size]
+            self._buf = grown
+        self._buf[start:end] = data
+        self._size = end
+        return start, end
+
+    def upsert(self, chunk_id: str, text: str, source: Optional[str] = None, metadata: Optional[dict] = None):
+        start, end = self._write(text.encode('utf-8'))
+        source_code = self._sources.encode(source)
+        meta_code = self._metadata.encode(json.dumps(metadata, sort_keys=True, default=str) if metadata else None)
+        row = self._find(chunk_id)
+        if row is None:
+            row = len(self._live)
+            self._id_buf += chunk_id.encode('utf-8')
+            self._id_ends.append(len(self._id_buf))
+            self._live.append(1)
+            self._count += 1
+            self._starts.append(start)
+            self._ends.append(end)
+            self._source_codes.append(source_code)
+            self._meta_codes.append(meta_code)
+            self._index(chunk_id, row)
+            return
+        self._garbage += self._ends[row] - self._starts[row]
+        self._starts[row], self._ends[row] = start, end
+        self._source_codes[row], self._meta_codes[row] = source_code, meta_code
+        self._maybe_compact()
+
+    def delete(self, chunk_id: str) -> bool:
+        row = self._find(chunk_id)
+        if row is None:
+            return False
+        self._live[row] = 0
+        self._count -= 1
+        self._garbage += self._ends[row] - self._starts[row]
+        self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        if self._garbage >= _COMPACT_MIN_GARBAGE and 2 * self._garbage >= self._size:
+            self.compact()
+
+    def compact(self):
+        """Drop deleted rows and replaced text, keeping the live chunks in order."""
+        live = [row for row in range(len(self._live)) if self._live[row]]
+        ids = [self._id_bytes(row) for row in live]
+        buf = bytearray(max(_INITIAL_CAPACITY, self._size - self._garbage))
+        old = memoryview(self._buf)
+        starts, ends, pos = array('q'), array('q'), 0
+        for row in live:
+            length = self._ends[row] - self._starts[row]
+            buf[pos:pos + length] = old[self._starts[row]:self._ends[row]]
+            starts.append(pos)
+            ends.append(pos + length)
+            pos += length
+        old.release()
+        self._buf, self._size, self._garbage = buf, pos, 0
+        self._starts, self._ends = starts, ends
+        self._source_codes = array('l', (self._source_codes[row] for row in live))
+        self._meta_codes = array('l', (self._meta_codes[row] for row in live))
+        self._id_buf = bytearray(b''.join(ids))
+        self._id_ends = array('q', accumulate(len(i) for i in ids))
+        self._live = bytearray(b'\x01' * len(live))
+        hashes = np.array([hash(i.decode('utf-8')) for i in ids], dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+        self._sorted_hashes, self._sorted_rows, self._recent = hashes[order], order.astype(np.int64), {}
+
+    def chunk_id(self, row: int) -> Optional[str]:
+        return self._id_bytes(row).decode('utf-8') if self._live[row] else None
+
+    def view(self, row: int) -> ChunkView:
+        return ChunkView(self.chunk_id(row), memoryview(self._buf)[self._starts[row]:self._ends[row]],
+                         self._sources.values[self._source_codes[row]], self._metadata.values[self._meta_codes[row]])
+
+    def term_counts(self, term: str) -> Iterator[Tuple[int, int]]:
+        """(row, non-overlapping occurrences of ``term``) for every live chunk, scanning the raw buffer."""
+        needle = term.encode('utf-8')
+        buf, starts, ends, live = self._buf, self._starts, self._ends, self._live
+        for row in range(len(live)):
+            if live[row]:
+                yield row, buf.count(needle, starts[row], ends[row]) if needle else 0
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the store (text and id buffers, column arrays, index)."""
+        arrays = (self._starts, self._ends, self._source_codes, self._meta_codes, self._id_ends)
+        return (len(self._buf) + len(self._id_buf) + len(self._live)
+                + sum(a.itemsize * len(a) for a in arrays)
+                + self._sorted_hashes.nbytes + self._sorted_rows.nbytes + sys.getsizeof(self._recent)
+                + sum(sys.getsizeof(v) for d in (self._sources, self._metadata) for v in d.values if v))
+
+
+def _synthetic_chunks(n: int):
+    for i in range(n):
+        doc, page = i // 40, (i // 4) % 10
+        yield {
+            'id': f"CO{doc % 500:03d}_ANNUAL_{i}",
+            'text': f"Chunk {i}: net revenue for segment {i % 17} was ${(i * 37) % 900}M, "
+                    f"up {i % 9}% year over year, driven by pricing and volume in region {i % 5}.",
+            'source': f"CO{doc % 500:03d}_annual_report.pdf, p. {page}",
+            'metadata': {'company': f"CO{doc % 500:03d}", 'type': 'ANNUAL', 'page': page, 'date': '2024-03-31', 'kind': 'text'},
+        }
+
+
+def benchmark(chunks: int = 200_000) -> dict:
+    """Memory of a dict-of-dicts store vs ChunkStore for synthetic filing chunks, and scan time."""
+    report = {"chunks": chunks}
+    tracemalloc.start()
+    dict_store = {c['id']: c for c in _synthetic_chunks(chunks)}
+    report["dict_store_mb"] = tracemalloc.get_traced_memory()[0] / 2**20
+    begin = time.perf_counter()
+    sum(doc['text'].count('revenue') for doc in dict_store.values())
+    report["dict_scan_ms"] = (time.perf_counter() - begin) * 1e3
+    del dict_store
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    store = ChunkStore()
+    for c in _synthetic_chunks(chunks):
+        store.upsert(c['id'], c['text'], c['source'], c['metadata'])
+    store.compact()  # release the doubling slack before measuring
+    report["chunk_store_mb"] = tracemalloc.get_traced_memory()[0] / 2**20
+    tracemalloc.stop()
+    begin = time.perf_counter()
+    sum(count for _, count in store.term_counts('revenue'))
+    report["chunk_store_scan_ms"] = (time.perf_counter() - begin) * 1e3
+    report["memory_ratio"] = report["dict_store_mb"] / report["chunk_store_mb"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact in-memory chunk store')
+    parser.add_argument('--benchmark', action='store_true', help='Compare memory with a dict-of-dicts store')
+    parser.add_argument('--chunks', type=int, default=200_000)
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark(args.chunks).items():
+            print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Context builder: pack retrieved chunks into a token-budgeted RAG prompt
+"""Turn scored retrieval results into the CONTEXT block of a RAG prompt.
+
+Chunks are taken best-score first, near-duplicates (including chunks that are
+mostly contained in one already taken, as produced by overlapping chunking) are
+dropped using word shingles, and chunks are added until the model's token budget
+is used up. Only citations of chunks that made it into the prompt are returned.
+"""
+import math
+import re
+import zlib
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+from config import settings
+from tools.rag_retriever import ScoredChunk
+
+# Rough BPE behaviour: a word piece of n characters costs about ceil(n / 4) tokens
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+SHINGLE_SIZE = 5
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count without a model tokenizer (word pieces of up to 4 characters)."""
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _PIECE_RE.findall(text))
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """Hashed word n-grams of ``text`` (the whole text as one shingle if it is shorter than ``size``)."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode('utf-8'))} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode('utf-8')) for i in range(len(words) - size + 1)}
+
+
+def is_near_duplicate(candidate: set, kept: set, threshold: float) -> bool:
+    """True when the shingle sets are near-identical (Jaccard) or ``candidate`` is mostly inside ``kept``."""
+    if not candidate or not kept:
+        return False
+    common = len(candidate & kept)
+    jaccard = common / len(candidate | kept)
+    containment = common / len(candidate)
+    return jaccard >= threshold or containment >= threshold
+
+
+def context_budget_for(model: Optional[str]) -> int:
+    """Context token budget for ``model`` (RAG_CONTEXT_TOKEN_BUDGETS override, else the default)."""
+    return settings.RAG_CONTEXT_TOKEN_BUDGETS.get(model or '', settings.RAG_CONTEXT_TOKEN_BUDGET)
+
+
+@dataclass
+class PackedContext:
+    chunks: List[ScoredChunk] = field(default_factory=list)
+    citations: List[str] = field(default_factory=list)
+    tokens: int = 0
+    dropped_duplicates: int = 0
+    dropped_over_budget: int = 0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(f"[{i}] {c.text}" for i, c in enumerate(self.chunks, start=1))
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    pieces = []
+    used = 0
+    for match in re.finditer(r"\S+\s*", text):
+        cost = estimate_tokens(match.group())
+        if used + cost > budget:
+            break
+        pieces.append(match.group())
+        used += cost
+    return "".join(pieces).rstrip()
+
+
+def build_context(chunks: Iterable[ScoredChunk], budget_tokens: int, dedup_threshold: Optional[float] = None) -> PackedContext:
+    """Pack scored chunks into ``budget_tokens``, best score first.
+
+    Chunks that do not fit are skipped so a smaller, lower-scored chunk can still use
+    the remaining budget. If not even the best chunk fits, it is truncated to the budget.
+    """
+    threshold = settings.RAG_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+    packed = PackedContext()
+    kept_shingles: List[set] = []
+    ranked = sorted((c for c in chunks if c.text and c.text.strip()), key=lambda c: c.score, reverse=True)
+    # Each chunk is rendered as "[n] text\n": count the label and separator too
+    overhead = 4
+
+    for chunk in ranked:
+        sh = shingles(chunk.text)
+        if any(is_near_duplicate(sh, kept, threshold) for kept in kept_shingles):
+            packed.dropped_duplicates += 1
+            continue
+        cost = estimate_tokens(chunk.text) + overhead
+        if packed.tokens + cost > budget_tokens:
+            packed.dropped_over_budget += 1
+            continue
+        packed.chunks.append(chunk)
+        kept_shingles.append(sh)
+        packed.tokens += cost
+
+    if not packed.chunks and ranked and budget_tokens > overhead:
+        best = ranked[0]
+        text = _truncate_to_tokens(best.text, budget_tokens - overhead)
+        packed.chunks.append(ScoredChunk(text, best.source, best.score))
+        packed.tokens = estimate_tokens(text) + overhead
+        packed.dropped_over_budget -= 1
+
+    # One citation per source, in prompt order
+    for chunk in packed.chunks:
+        if chunk.source not in packed.citations:
+            packed.citations.append(chunk.source)
+    return packed
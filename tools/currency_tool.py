@@ -1,28 +1,29 @@
 import logging
 import time
+from typing import Dict, Optional
 import requests
 from requests.exceptions import RequestException
 from config import settings
+from tools import rate_prefetch
+from utils.cache import make_cache
 from utils.circuit_breaker import CircuitBreaker
+from utils import deadline
 
-cb = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+logger = logging.getLogger(__name__)
+
+cb = CircuitBreaker(failure_threshold=3, reset_timeout=60,
+                    backend=make_cache('circuit_breaker:currency', maxsize=1024, ttl=60))
+# Latest rate table per base currency: {"rates": {code: rate}, "fetched_at": unix time}.
+# tools/rate_prefetch.py refreshes hot bases before their entries expire.
+_rate_tables = make_cache('rate_tables', maxsize=settings.RATE_TABLE_CACHE_SIZE, ttl=settings.RATE_TABLE_TTL_S)
 
 
 class ToolExecutionError(Exception):
     pass
 
 
-def get_exchange_rate(source_currency: str, target_currency: str) -> float:
-    """
-    Fetches the real-time exchange rate between two currencies.
-
-    Args:
-        source_currency: The currency to convert from (e.g., "USD").
-        target_currency: The currency to convert to (e.g., "EUR").
-
-    Returns:
-        The exchange rate (e.g., 0.92 for USD/EUR).
-    """
+def fetch_rate_table(base_currency: str, retries: int = 3) -> Dict[str, float]:
+    """Fetch all rates for ``base_currency`` from the provider (up to ``retries`` requests, circuit breaker)."""
     # Build an API URL based on configured provider. If a key is provided, many providers
     # require the key to be placed in the path (e.g. https://v6.exchangerate-api.com/v6/KEY/latest/USD)
     base_url = settings.EXCHANGE_RATE_BASE_URL.rstrip('/')
@@ -30,46 +31,86 @@ def get_exchange_rate(source_currency: str, target_currency: str) -> float:
 
     if api_key:
         # This works for Exchangerate-API-esque URLs: /v6/{KEY}/latest/{BASE}
-        api_url = f"{base_url}/{api_key}/latest/{source_currency.upper()}"
+        api_url = f"{base_url}/{api_key}/latest/{base_currency.upper()}"
         headers = {}
     else:
         # Some services use a query parameter `base` instead of a key-in-path
-        api_url = f"{base_url}/latest?base={source_currency.upper()}"
+        api_url = f"{base_url}/latest?base={base_currency.upper()}"
         headers = {}
 
-    logger = logging.getLogger(__name__)
     key_name = 'get_exchange_rate'
     if cb.is_open(key_name):
         raise ToolExecutionError('Circuit breaker is open for get_exchange_rate')
 
-    retries = 3
     backoff = 1.0
     for attempt in range(1, retries + 1):
         try:
-            response = requests.get(api_url, headers=headers, timeout=5)
+            try:
+                timeout = deadline.timeout_for(5)
+            except deadline.DeadlineExceeded as e:
+                raise ToolExecutionError(str(e))
+            response = requests.get(api_url, headers=headers, timeout=timeout)
             response.raise_for_status()
             data = response.json()
-            rates = data.get('rates', {})
-            rate = rates.get(target_currency.upper())
-            if rate is None:
-                raise KeyError(f"Target currency '{target_currency}' not found in response")
+            # Exchangerate-API v6 uses 'conversion_rates'; most other providers use 'rates'
+            rates = data.get('rates') or data.get('conversion_rates') or {}
             cb.record_success(key_name)
-            return float(rate)
+            return {code.upper(): float(rate) for code, rate in rates.items()}
 
         except RequestException as e:
             logger.error("Network/API error fetching exchange rate (attempt %s): %s", attempt, e)
             if attempt == retries:
                 cb.record_failure(key_name)
                 raise ToolExecutionError(str(e))
-            time.sleep(backoff)
+            # Only back off and retry if the request deadline leaves room for another attempt
+            if not deadline.sleep(backoff):
+                raise ToolExecutionError(f"{e} (request deadline reached, not retrying)")
             backoff *= 2.0
-        except KeyError as e:
-            # No point retrying if the currency isn't present
-            logger.warning("Target currency not found in API response: %s", e)
-            raise ToolExecutionError(str(e))
+
+
+def refresh_rate_table(base_currency: str, retries: int = 3) -> Dict[str, float]:
+    """Fetch the rate table for ``base_currency`` and store it in the rate-table cache."""
+    base = base_currency.upper()
+    return _rate_tables.set(base, _fetch_entry(base, retries))["rates"]
+
+
+def _fetch_entry(base: str, retries: int = 3) -> dict:
+    return {"rates": fetch_rate_table(base, retries), "fetched_at": time.time()}
+
+
+def rate_table_age(base_currency: str) -> Optional[float]:
+    """Seconds since the cached table for ``base_currency`` was fetched; None if not cached."""
+    entry = _rate_tables.peek(base_currency.upper())
+    return time.time() - entry["fetched_at"] if entry is not None else None
+
+
+def get_rate_table(base_currency: str) -> Dict[str, float]:
+    """All rates for ``base_currency``: from the cache when warm, else fetched now."""
+    base = base_currency.upper()
+    rate_prefetch.tracker.record(base)
+    # concurrent misses for the same base (across workers with a shared cache) fetch once
+    return _rate_tables.get_or_compute(base, lambda: _fetch_entry(base))["rates"]
+
+
+def get_exchange_rate(source_currency: str, target_currency: str) -> float:
+    """
+    Fetches the real-time exchange rate between two currencies.
+
+    Args:
+        source_currency: The currency to convert from (e.g., "USD").
+        target_currency: The currency to convert to (e.g., "EUR").
+
+    Returns:
+        The exchange rate (e.g., 0.92 for USD/EUR).
+    """
+    rate = get_rate_table(source_currency).get(target_currency.upper())
+    if rate is None:
+        # No point retrying if the currency isn't present
+        logger.warning("Target currency '%s' not found in API response", target_currency)
+        raise ToolExecutionError(f"Target currency '{target_currency}' not found in response")
+    return rate
 
 if __name__ == '__main__':
     # Example usage:
     rate = get_exchange_rate("USD", "EUR")
-    logger = logging.getLogger(__name__)
     logger.info("1 USD = %s EUR", rate)
\ No newline at end of file
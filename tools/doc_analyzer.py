@@ -1,8 +1,253 @@
+import hashlib
 import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import settings
+from utils.lazy import optional_import
+
+logger = logging.getLogger(__name__)
+
+# pypdf is optional (only needed for PDFs); it is imported on first use via optional_import('pypdf').
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(\[$])")
+_CELL_SPLIT_RE = re.compile(r"\t+|\s{2,}|\s*\|\s*")
+_MONTHS = ("January|February|March|April|May|June|July|August|September|October|November|December|"
+           "Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec")
+_MONTH_NUM = {m[:3].lower(): i for i, m in enumerate(
+    ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+     "November", "December"], start=1)}
+_DATE_RES = [
+    (re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b"), lambda m: (m.group(1), m.group(2), m.group(3))),
+    (re.compile(rf"\b({_MONTHS})\.? (\d{{1,2}}), (\d{{4}})\b"),
+     lambda m: (m.group(3), _MONTH_NUM[m.group(1)[:3].lower()], m.group(2))),
+    (re.compile(rf"\b(\d{{1,2}}) ({_MONTHS})\.? (\d{{4}})\b"),
+     lambda m: (m.group(3), _MONTH_NUM[m.group(2)[:3].lower()], m.group(1))),
+]
+
+
+def find_date(text: str) -> Optional[str]:
+    """First date in ``text`` as YYYY-MM-DD (ISO, 'September 30, 2024' or '30 Sep 2024'), or None."""
+    found = []
+    for pattern, parts in _DATE_RES:
+        m = pattern.search(text)
+        if m:
+            year, month, day = parts(m)
+            if 1 <= int(month) <= 12 and 1 <= int(day) <= 31:
+                found.append((m.start(), f"{int(year):04d}-{int(month):02d}-{int(day):02d}"))
+    return min(found)[1] if found else None
+
+
+# --- 1. Parsing ---
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract pages [start, end) of a PDF; runs in a worker process, which opens its own reader."""
+    pypdf = optional_import('pypdf')
+    reader = pypdf.PdfReader(file_path)
+    return [(i + 1, reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def _pdf_page_count(file_path: str) -> int:
+    pypdf = optional_import('pypdf')
+    if pypdf is None:
+        raise ImportError("pypdf is required to parse PDF documents (pip install pypdf)")
+    return len(pypdf.PdfReader(file_path).pages)
+
+
+def extract_pages(file_path: str, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) in page order.
+
+    PDFs with at least DOC_PARALLEL_MIN_PAGES pages are parsed in page batches on a
+    process pool (DOC_PARSE_WORKERS, default: one per core); at most two batches
+    per worker are in flight so memory stays bounded on very long reports.
+    Plain-text files are split into pages on form feeds.
+    """
+    if not file_path.lower().endswith('.pdf'):
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            for i, page in enumerate(f.read().split('\f'), start=1):
+                yield i, page
+        return
+
+    n_pages = _pdf_page_count(file_path)
+    batch = max(1, settings.DOC_PARSE_PAGES_PER_TASK)
+    ranges = [(s, min(s + batch, n_pages)) for s in range(0, n_pages, batch)]
+    workers = workers or settings.DOC_PARSE_WORKERS or os.cpu_count() or 1
+    if n_pages < settings.DOC_PARALLEL_MIN_PAGES or workers == 1:
+        for start, end in ranges:
+            yield from _extract_pdf_range(file_path, start, end)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        pending: deque = deque()
+        remaining = iter(ranges)
+        for start, end in remaining:
+            pending.append(pool.submit(_extract_pdf_range, file_path, start, end))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            yield from pending.popleft().result()
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append(pool.submit(_extract_pdf_range, file_path, *nxt))
+
+
+# --- 2. Layout: paragraphs and tables ---
+
+def _is_table(lines: List[str]) -> bool:
+    """A block is a table when most rows split into 2+ cells (tabs, wide gaps or pipes) and carry numbers."""
+    rows = [line.strip() for line in lines if line.strip()]
+    if len(rows) < 2:
+        return False
+    multi_cell = sum(1 for r in rows if len(_CELL_SPLIT_RE.split(r)) >= 2)
+    numeric = sum(1 for r in rows if re.search(r"\d", r))
+    return multi_cell >= 0.7 * len(rows) and numeric >= 0.5 * len(rows)
+
+
+def split_blocks(page_text: str) -> Iterator[Tuple[str, str]]:
+    """Yield ('text' | 'table', block) for the blank-line separated blocks of a page."""
+    for block in re.split(r"\n\s*\n", page_text):
+        lines = block.splitlines()
+        if not any(line.strip() for line in lines):
+            continue
+        if _is_table(lines):
+            yield 'table', "\n".join(line.rstrip() for line in lines if line.strip())
+        else:
+            # Re-join hyphenated line breaks ("reve-\nnue") and wrapped lines
+            text = re.sub(r"-\n(?=[a-z])", "", block)
+            yield 'text', re.sub(r"\s*\n\s*", " ", text).strip()
+
+
+# --- 3. Chunking ---
+
+def _sentences(paragraph: str, chunk_size: int) -> Iterator[str]:
+    for sentence in _SENTENCE_RE.split(paragraph):
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(' ', 0, chunk_size)
+            cut = cut if cut > 0 else chunk_size
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            yield sentence
+
+
+def _table_chunks(table: str, chunk_size: int) -> Iterator[str]:
+    """Keep a table in one chunk; split oversized tables by rows, repeating the header row."""
+    if len(table) <= chunk_size:
+        yield table
+        return
+    header, *rows = table.split("\n")
+    current = [header]
+    for row in rows:
+        if len(current) > 1 and sum(len(r) + 1 for r in current) + len(row) > chunk_size:
+            yield "\n".join(current)
+            current = [header]
+        current.append(row)
+    if len(current) > 1:
+        yield "\n".join(current)
+
+
+def chunk_pages(pages: Iterable[Tuple[int, str]], chunk_size: Optional[int] = None,
+                overlap: Optional[int] = None) -> Iterator[dict]:
+    """Split (page_number, text) pages into chunks lazily.
+
+    Text is packed sentence by sentence up to ``chunk_size`` characters; each new
+    chunk repeats up to ``overlap`` characters of trailing sentences from the previous
+    one. Tables are emitted as their own chunks and never split mid-row. Chunks do
+    not span pages, so every chunk has an exact page number.
+
+    Yields:
+        {"text", "page", "kind" ('text' | 'table'), "date" (first date in the chunk, or None)}
+    """
+    chunk_size = chunk_size or settings.DOC_CHUNK_SIZE
+    overlap = settings.DOC_CHUNK_OVERLAP if overlap is None else overlap
+
+    def make(text: str, page: int, kind: str) -> dict:
+        return {"text": text, "page": page, "kind": kind, "date": find_date(text)}
+
+    for page_no, page_text in pages:
+        current: List[str] = []
+        size = 0
+        fresh = False  # current holds at least one sentence not yet emitted
+        for kind, block in split_blocks(page_text):
+            if kind == 'table':
+                if fresh:
+                    yield make(" ".join(current), page_no, 'text')
+                current, size, fresh = [], 0, False
+                for table in _table_chunks(block, chunk_size):
+                    yield make(table, page_no, 'table')
+                continue
+            for sentence in _sentences(block, chunk_size):
+                if fresh and size + len(sentence) + 1 > chunk_size:
+                    yield make(" ".join(current), page_no, 'text')
+                    # carry trailing sentences into the next chunk as overlap
+                    carried: List[str] = []
+                    carried_size = 0
+                    for prev in reversed(current):
+                        if carried_size + len(prev) + 1 > overlap:
+                            break
+                        carried.insert(0, prev)
+                        carried_size += len(prev) + 1
+                    current, size = carried, carried_size
+                current.append(sentence)
+                size += len(sentence) + 1
+                fresh = True
+        if fresh:
+            yield make(" ".join(current), page_no, 'text')
+
+
+def document_path(file_path: str, root: Optional[str] = None) -> str:
+    """Path of a document relative to the corpus root (``DOC_CORPUS_ROOT``, default: working directory)."""
+    root = root if root is not None else (settings.DOC_CORPUS_ROOT or os.getcwd())
+    return os.path.relpath(os.path.abspath(file_path), os.path.abspath(root)).replace(os.sep, '/')
+
+
+def _document_key(file_path: str, root: Optional[str] = None) -> str:
+    # chunk ids must differ between documents of the same company and type (the store is keyed by id);
+    # relative to the corpus root so that moving the whole corpus keeps them
+    return hashlib.sha1(document_path(file_path, root).encode('utf-8')).hexdigest()[:12]
+
+
+def iter_document_chunks(file_path: str, company_id: str, doc_type: str,
+                         pages: Optional[Iterable[Tuple[int, str]]] = None,
+                         root: Optional[str] = None) -> Iterator[dict]:
+    """Lazily yield indexed chunks for a document, ready for ``upsert_chunks_to_vector_db``.
+
+    ``pages`` overrides extraction (e.g. OCR output for scanned documents). A chunk
+    without a date of its own inherits the first date seen earlier in the document.
+    Chunk ids are ``{company}_{doc_type}_{path hash}_p{page}_{text hash}``, with a
+    ``_{n}`` suffix for repeated text on a page: derived from content, so an edit
+    only changes the ids of the chunks it touches.
+    """
+    source = os.path.basename(file_path)
+    doc_key = _document_key(file_path, root)
+    doc_date = None
+    seen: Dict[str, int] = {}
+    for chunk in chunk_pages(pages if pages is not None else extract_pages(file_path)):
+        doc_date = doc_date or chunk["date"]
+        chunk_id = (f"{company_id}_{doc_type}_{doc_key}_p{chunk['page']}_"
+                    f"{hashlib.sha1(chunk['text'].encode('utf-8')).hexdigest()[:12]}")
+        repeat = seen.get(chunk_id, 0)
+        seen[chunk_id] = repeat + 1
+        yield {
+            "id": f"{chunk_id}_{repeat}" if repeat else chunk_id,
+            "text": chunk["text"],
+            "source": f"{source}, p. {chunk['page']}",
+            "metadata": {
+                "company": company_id,
+                "type": doc_type,
+                "page": chunk["page"],
+                "date": chunk["date"] or doc_date,
+                "kind": chunk["kind"],
+            }
+        }
+
 
 def process_document(file_path: str, company_id: str, doc_type: str) -> list[dict]:
     """
-    Parses a document (PDF), splits it into semantic chunks, and extracts metadata.
+    Parses a document (PDF or text), splits it into semantic chunks, and extracts metadata.
 
     Args:
         file_path: Local path to the document.
@@ -11,37 +256,14 @@ def process_document(file_path: str, company_id: str, doc_type: str) -> list[dic
 
     Returns:
         A list of dictionaries, where each dict is a chunk with its metadata.
+        Use ``iter_document_chunks`` to stream chunks instead of building the list.
     """
-    logger = logging.getLogger(__name__)
     logger.info("Starting analysis for: %s", file_path)
-    
-    # --- 1. Parsing (Placeholder) ---
-    raw_text = "This is the extracted text from the document. Q3 net revenue was $500M."
-    # In a real app, use pypdf or a library to extract text
-    
-    # --- 2. Chunking (Placeholder) ---
-    # This process is critical: chunks must retain semantic context
-    chunks = [
-        raw_text[:40], 
-        raw_text[40:]
-    ]
-    
-    indexed_chunks = []
-    for i, chunk in enumerate(chunks):
-        indexed_chunks.append({
-            "id": f"{company_id}_{doc_type}_{i}",
-            "text": chunk,
-            "metadata": {
-                "company": company_id,
-                "type": doc_type,
-                "page": i + 1, # Placeholder for page number
-                "date": "2024-09-30" 
-            }
-        })
-        
+    indexed_chunks = list(iter_document_chunks(file_path, company_id, doc_type))
     logger.info("Successfully chunked into %d pieces.", len(indexed_chunks))
     return indexed_chunks
 
+
 if __name__ == '__main__':
     # Example usage
-    chunks = process_document("temp/Q3_report.pdf", "COMPX", "EARNINGS")
\ No newline at end of file
+    chunks = process_document("temp/Q3_report.pdf", "COMPX", "EARNINGS")
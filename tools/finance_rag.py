@@ -1,7 +1,9 @@
 import logging
 from config import settings
 from llm_client import generate_content
-from tools.rag_retriever import retrieve_documents
+from tools.rag_retriever import retrieve_scored_documents
+from tools.context_builder import build_context, context_budget_for
+from tools import rag_answer_cache, rag_prefetch, rag_retriever
 
 logger = logging.getLogger(__name__)
 # No SDK client initialization here; use provider-agnostic `generate_content` in llm_client
@@ -19,18 +21,35 @@ def generate_rag_answer(user_query: str) -> dict:
         A dictionary containing the final answer and the source citations.
     """
     try:
-        # 1. Retrieval (Placeholder for a complex vector search)
-        relevant_chunks, citations = retrieve_documents(user_query, settings.RAG_K_CHUNKS)
-        relevant_chunks = ["...retrieved chunk 1...", "...retrieved chunk 2..."]
-        citations = ["Source: Q4 2024 Earnings Call Transcript", "Source: Annual Report 2023, p. 15"]
-        
-        context_string = "\n".join(relevant_chunks)
-
-        # 2. Augmented Prompt Generation
+        # 0. Cache: the same (or a near-identical) question against an unchanged index
+        version = rag_retriever.index_version()
+        cached = rag_answer_cache.lookup(user_query, version)
+        if cached is not None:
+            return cached
+
+        # 1. Retrieval: use the retrieval the agent started speculatively during its tool decision, if any
+        taken = rag_prefetch.take(user_query, settings.RAG_K_CHUNKS)
+        # chunks retrieved for another wording of the question must not be cached under this one
+        cacheable = taken is None or taken.exact
+        scored_chunks = taken.chunks if taken is not None else retrieve_scored_documents(user_query, settings.RAG_K_CHUNKS)
+
+        # 2. Augmented Prompt Generation: deduplicated chunks, best first, within the model's token budget
+        context = build_context(scored_chunks, context_budget_for(RAG_MODEL))
+        if not context.chunks:
+            # nothing to ground an answer on: say so instead of letting the model improvise (not cached)
+            return {
+                "answer": "No relevant documents were found for this question.",
+                "sources": [],
+                "chunk_ids": [],
+                "audit_success": False
+            }
+        logger.debug("RAG context: %d chunks, ~%d tokens (%d duplicates, %d over budget dropped)",
+                     len(context.chunks), context.tokens, context.dropped_duplicates, context.dropped_over_budget)
+        citations = context.citations
         prompt = (
             "You are a highly specialized financial analyst. Use ONLY the provided context to answer the user's query.\n"
             "CONTEXT:\n"
-            f"{context_string}\n"
+            f"{context.text}\n"
             "USER QUERY:\n"
             f"{user_query}"
         )
@@ -38,11 +57,15 @@ def generate_rag_answer(user_query: str) -> dict:
         # 3. Generation - use the provider-agnostic generate_content wrapper
         response = generate_content(prompt, model=RAG_MODEL)
 
-        return {
+        result = {
             "answer": getattr(response, 'text', str(response)),
             "sources": citations,
+            "chunk_ids": [c.chunk_id for c in context.chunks if c.chunk_id],
             "audit_success": True
         }
+        if cacheable:
+            rag_answer_cache.store(user_query, version, result)
+        return result
 
     except Exception as e:
         logger.exception("RAG generation failed: %s", e)
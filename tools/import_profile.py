@@ -0,0 +1,76 @@
+"""Import-time profile report for the API server (or any module).
+
+Runs ``python -X importtime -c "import <module>"`` in a fresh interpreter and
+summarises which imports dominate cold-start time.
+
+Usage:
+    python -m tools.import_profile main --top 20
+"""
+import argparse
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportTiming]:
+    """Parse ``-X importtime`` output lines: 'import time: <self> | <cumulative> | <indent><module>'."""
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            # header line ("self [us] | cumulative | imported package")
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        timings.append(ImportTiming(name.strip(), self_us, cumulative_us, depth))
+    return timings
+
+
+def profile_import(module: str = 'main') -> List[ImportTiming]:
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def format_report(timings: List[ImportTiming], module: str, top: int = 20) -> str:
+    total = next((t.cumulative_us for t in reversed(timings) if t.module == module), 0)
+    lines = [f"Import of '{module}': {total / 1000:.1f} ms total, {len(timings)} modules"]
+    lines.append(f"Top {top} by cumulative time:")
+    for t in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        lines.append(f"  {t.cumulative_us / 1000:9.1f} ms  {t.module}")
+    lines.append(f"Top {top} by self time:")
+    for t in sorted(timings, key=lambda t: t.self_us, reverse=True)[:top]:
+        lines.append(f"  {t.self_us / 1000:9.1f} ms  {t.module}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import-time costs for a module')
+    parser.add_argument('module', nargs='?', default='main', help='Module to import (default: main)')
+    parser.add_argument('--top', type=int, default=20, help='Number of entries per table')
+    args = parser.parse_args()
+    print(format_report(profile_import(args.module), args.module, args.top))
+
+
+if __name__ == '__main__':
+    main()
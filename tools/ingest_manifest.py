@@ -0,0 +1,172 @@
+# Ingestion manifest: incremental re-ingestion with content hashes and tombstones
+"""Track what is already in the vector index so re-ingestion only embeds what changed.
+
+The manifest (JSON, ``INGEST_MANIFEST_PATH``) records, per document, the hash of
+the source (file bytes or chunk set) and the hash of every chunk id. A sync then:
+
+- skips documents whose source hash is unchanged (no parsing, no embedding),
+- skips unchanged chunks and upserts new or changed ones,
+- tombstones chunks that disappeared from a changed document, and all chunks
+  of documents that are no longer in the corpus (``prune``),
+- compacts: deletes tombstoned chunks from the index in one batch.
+
+Tombstoned chunks are hidden from retrieval as soon as they are recorded, so a
+deferred compaction never serves stale text.
+
+The manifest also records the id of the store it describes
+(``rag_retriever.store_id``). Loaded against a different store, e.g. after a
+restart with a non-persistent index, it starts empty and everything is re-ingested.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_hash(chunk: dict) -> str:
+    """Hash of everything that ends up in the index for a chunk (text, source and metadata)."""
+    payload = json.dumps([chunk.get('text', ''), chunk.get('source', ''), chunk.get('metadata') or {}],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+@dataclass
+class SyncReport:
+    upserted: int = 0
+    skipped: int = 0
+    skipped_documents: int = 0
+    tombstoned: int = 0
+    compacted: int = 0
+
+    def merge(self, other: 'SyncReport') -> 'SyncReport':
+        for name in ('upserted', 'skipped', 'skipped_documents', 'tombstoned', 'compacted'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+
+@dataclass
+class IngestManifest:
+    path: str
+    # doc_key -> {"hash": source hash, "origin": input it came from, "chunks": {chunk_id: chunk hash}}
+    documents: Dict[str, dict] = field(default_factory=dict)
+    # chunk_id -> unix time it was tombstoned (pending compaction)
+    tombstones: Dict[str, float] = field(default_factory=dict)
+    # rag_retriever.store_id() of the index the entries describe
+    store_id: Optional[str] = None
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, store_id: Optional[str] = None) -> 'IngestManifest':
+        """Load the manifest; with ``store_id``, entries recorded for another store are dropped."""
+        path = path or settings.INGEST_MANIFEST_PATH
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(path, store_id=store_id)
+        if store_id is not None and data.get('store_id') != store_id:
+            logger.info("Ingestion manifest %s describes another index; re-ingesting everything", path)
+            return cls(path, store_id=store_id)
+        return cls(path, data.get('documents', {}), data.get('tombstones', {}), data.get('store_id'))
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"store_id": self.store_id, "documents": self.documents, "tombstones": self.tombstones}, f)
+        os.replace(tmp, self.path)
+
+    def document_unchanged(self, doc_key: str, source_hash: str) -> bool:
+        entry = self.documents.get(doc_key)
+        return entry is not None and entry.get('hash') == source_hash
+
+    def _tombstone(self, ids: Iterable[str]) -> List[str]:
+        now = time.time()
+        ids = list(ids)
+        for chunk_id in ids:
+            self.tombstones[chunk_id] = now
+        return ids
+
+    def sync_document(self, doc_key: str, chunks: Iterable[dict], upsert: Callable[[List[dict]], None],
+                      source_hash: Optional[str] = None, origin: str = '',
+                      tombstone: Optional[Callable[[List[str]], None]] = None) -> SyncReport:
+        """Upsert the new/changed chunks of one document and tombstone its vanished chunks.
+
+        ``chunks`` may be a lazy iterator; changed chunks are upserted in batches of
+        ``DOC_INGEST_BATCH_SIZE`` as they arrive.
+        """
+        report = SyncReport()
+        old_chunks = (self.documents.get(doc_key) or {}).get('chunks', {})
+        new_chunks: Dict[str, str] = {}
+        batch: List[dict] = []
+        for chunk in chunks:
+            chunk_id = chunk['id']
+            digest = chunk_hash(chunk)
+            new_chunks[chunk_id] = digest
+            if old_chunks.get(chunk_id) == digest and chunk_id not in self.tombstones:
+                report.skipped += 1
+                continue
+            batch.append(chunk)
+            if len(batch) >= settings.DOC_INGEST_BATCH_SIZE:
+                upsert(batch)
+                report.upserted += len(batch)
+                batch = []
+        if batch:
+            upsert(batch)
+            report.upserted += len(batch)
+        # upserted ids are live again even if they were tombstoned before
+        for chunk_id in new_chunks:
+            self.tombstones.pop(chunk_id, None)
+
+        removed = self._tombstone(cid for cid in old_chunks if cid not in new_chunks)
+        if removed and tombstone:
+            tombstone(removed)
+        report.tombstoned = len(removed)
+        if source_hash is None:
+            source_hash = hashlib.sha256(json.dumps(sorted(new_chunks.items())).encode('utf-8')).hexdigest()
+        self.documents[doc_key] = {"hash": source_hash, "origin": origin, "chunks": new_chunks}
+        return report
+
+    def prune(self, origin: str, keep: Iterable[str], tombstone: Optional[Callable[[List[str]], None]] = None) -> int:
+        """Tombstone every chunk of documents from ``origin`` that are not in ``keep``."""
+        keep = set(keep)
+        removed: List[str] = []
+        for doc_key in [k for k, v in self.documents.items() if v.get('origin') == origin and k not in keep]:
+            removed.extend(self._tombstone(self.documents.pop(doc_key).get('chunks', {})))
+        if removed and tombstone:
+            tombstone(removed)
+        return len(removed)
+
+    def compact(self, delete: Callable[[List[str]], None]) -> int:
+        """Physically delete all tombstoned chunks from the index and clear the tombstones."""
+        ids = list(self.tombstones)
+        for start in range(0, len(ids), settings.DOC_INGEST_BATCH_SIZE):
+            batch = ids[start:start + settings.DOC_INGEST_BATCH_SIZE]
+            delete(batch)
+            for chunk_id in batch:
+                self.tombstones.pop(chunk_id, None)
+        return len(ids)
+
+
+def group_by_document(docs: Iterable[dict]) -> Dict[str, List[dict]]:
+    """Group flat chunk records by their document (``document`` field, else ``source``)."""
+    grouped: Dict[str, List[dict]] = {}
+    for i, doc in enumerate(docs):
+        doc.setdefault('id', f'doc-{i}')
+        grouped.setdefault(doc.get('document') or doc.get('source') or doc['id'], []).append(doc)
+    return grouped
@@ -1,24 +1,84 @@
 import json
 import logging
 import argparse
-from tools.rag_retriever import upsert_chunks_to_vector_db
+from typing import Optional
+from config import settings
+from tools.ingest_manifest import IngestManifest, SyncReport, file_hash, group_by_document
+from tools.rag_retriever import upsert_chunks_to_vector_db, tombstone_chunks, delete_chunks_from_vector_db, store_id
 
 logger = logging.getLogger(__name__)
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Ingest JSON documents into vector DB')
-    parser.add_argument('file', help='Path to JSON file containing list of docs, each with id, text, source')
-    args = parser.parse_args()
+def ingest_document(file_path: str, company_id: str, doc_type: str,
+                    manifest: Optional[IngestManifest] = None, root: Optional[str] = None) -> SyncReport:
+    """Chunk a PDF/text document and upsert changed chunks in batches while later pages are still being parsed.
+
+    An unchanged file (same content hash in the manifest) is skipped without parsing. Without an
+    explicit ``manifest`` the one at INGEST_MANIFEST_PATH is loaded and saved. The document is
+    keyed by its path relative to ``root`` (default ``DOC_CORPUS_ROOT``).
+    """
+    from tools.doc_analyzer import document_path, iter_document_chunks
+
+    owns_manifest = manifest is None
+    manifest = manifest or IngestManifest.load(store_id=store_id())
+    doc_key = document_path(file_path, root)
+    source_hash = file_hash(file_path)
+    if manifest.document_unchanged(doc_key, source_hash):
+        return SyncReport(skipped_documents=1)
+    report = manifest.sync_document(doc_key, iter_document_chunks(file_path, company_id, doc_type, root=root),
+                                    upsert_chunks_to_vector_db, source_hash=source_hash, origin=doc_key,
+                                    tombstone=tombstone_chunks)
+    if owns_manifest:
+        manifest.save()
+    return report
+
+
+def ingest_json(file_path: str, manifest: IngestManifest, prune: bool = True) -> SyncReport:
+    """Sync a JSON corpus (list of chunks with id, text, source and optional document).
 
-    with open(args.file, 'r', encoding='utf-8') as f:
+    Documents that were ingested from this file before but are gone from it are
+    tombstoned when ``prune`` is set.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
         docs = json.load(f)
 
     if not isinstance(docs, list):
         raise ValueError('JSON must contain a list of documents')
 
-    upsert_chunks_to_vector_db(docs)
-    logger.info('Ingested %d docs', len(docs))
+    report = SyncReport()
+    grouped = group_by_document(docs)
+    for doc_key, chunks in grouped.items():
+        report.merge(manifest.sync_document(doc_key, chunks, upsert_chunks_to_vector_db, origin=file_path,
+                                            tombstone=tombstone_chunks))
+    if prune:
+        report.tombstoned += manifest.prune(file_path, grouped.keys(), tombstone=tombstone_chunks)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest documents into vector DB')
+    parser.add_argument('file', help='Path to a JSON file containing a list of docs (each with id, text, source), '
+                                     'or a PDF/text document to chunk')
+    parser.add_argument('--company', default='UNKNOWN', help='Company id for document metadata (PDF/text input)')
+    parser.add_argument('--doc-type', default='DOCUMENT', help='Document type for metadata (PDF/text input)')
+    parser.add_argument('--root', default=None, help='Corpus root that document ids are relative to '
+                                                      '(default: DOC_CORPUS_ROOT or the working directory)')
+    parser.add_argument('--manifest', default=settings.INGEST_MANIFEST_PATH, help='Ingestion manifest path')
+    parser.add_argument('--no-prune', action='store_true', help='Keep documents that are missing from the JSON input')
+    parser.add_argument('--no-compact', action='store_true', help='Only tombstone removed chunks; delete them later')
+    args = parser.parse_args()
+
+    manifest = IngestManifest.load(args.manifest, store_id=store_id())
+    if args.file.lower().endswith('.json'):
+        report = ingest_json(args.file, manifest, prune=not args.no_prune)
+    else:
+        report = ingest_document(args.file, args.company, args.doc_type, manifest, root=args.root)
+    if not args.no_compact:
+        report.compacted = manifest.compact(delete_chunks_from_vector_db)
+    manifest.save()
+    logger.info('Ingested %s: %d upserted, %d unchanged, %d documents skipped, %d tombstoned, %d compacted',
+                args.file, report.upserted, report.skipped, report.skipped_documents, report.tombstoned,
+                report.compacted)
 
 
 if __name__ == '__main__':
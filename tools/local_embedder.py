@@ -0,0 +1,174 @@
+# Local embedding model: offline, CPU-only, fitted on our own corpus
+"""Latent-semantic embeddings: hashed word/bigram TF-IDF reduced by truncated SVD.
+
+``LocalEmbedder.fit`` learns IDF weights and ``dim`` SVD directions from the chunk
+texts. Words that co-occur in filings ("revenue", "sales", "turnover") end up close
+together, so a question matches chunks that phrase it differently, with no network
+and no embedding API. ``embed`` takes a batch and is a few sparse and dense matrix
+products.
+
+Only the hashed columns seen during fitting carry weight, so ``save`` stores just
+those columns of the SVD basis: the model file stays small even with 2**18 hash
+features. ``get()`` serves the model at LOCAL_EMBEDDER_PATH and reloads it when the
+file is replaced. ``rag_retriever.embed_text`` uses it whenever Gemini embeddings
+are not configured.
+
+    python -m tools.local_embedder --fit corpus.json [more.json ...]
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.decomposition import TruncatedSVD
+
+from config import settings
+
+_NGRAM_RANGE = (1, 2)
+
+
+def _vectorizer(n_features: int) -> HashingVectorizer:
+    # raw counts: IDF weighting and normalization are applied afterwards, as in TfidfTransformer
+    return HashingVectorizer(n_features=n_features, ngram_range=_NGRAM_RANGE, alternate_sign=False,
+                             norm=None, lowercase=True, dtype=np.float32)
+
+
+class LocalEmbedder:
+    """A fitted model: ``embed(texts)`` returns unit-length float32 vectors of size ``dim``."""
+
+    def __init__(self, n_features: int, columns: np.ndarray, idf: np.ndarray, default_idf: float,
+                 components: np.ndarray, n_docs: int):
+        self.n_features = n_features
+        self.columns = columns          # hashed features seen while fitting
+        self.idf = idf                  # IDF of those columns
+        self.default_idf = default_idf  # IDF of any other feature (df = 0)
+        self.components = components    # (dim, len(columns)) SVD basis restricted to the seen columns
+        self.n_docs = n_docs
+        self._vectorizer = _vectorizer(n_features)
+        self._position = np.full(n_features, -1, dtype=np.int64)
+        self._position[columns] = np.arange(len(columns))
+
+    @property
+    def dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, texts: Sequence[str], dim: Optional[int] = None, n_features: Optional[int] = None,
+            seed: int = 0) -> 'LocalEmbedder':
+        dim = dim or settings.LOCAL_EMBEDDER_DIM
+        n_features = n_features or settings.LOCAL_EMBEDDER_FEATURES
+        counts = _vectorizer(n_features).transform(texts)
+        tfidf = TfidfTransformer(sublinear_tf=True)
+        weighted = tfidf.fit_transform(counts)
+        # an SVD of rank above the number of documents (or seen terms) has no signal left
+        components = max(1, min(dim, weighted.shape[0] - 1, weighted.getnnz(axis=0).astype(bool).sum() - 1))
+        svd = TruncatedSVD(n_components=components, algorithm='randomized', n_iter=7, random_state=seed)
+        svd.fit(weighted)
+        columns = np.flatnonzero(counts.getnnz(axis=0))
+        # smooth IDF with df = 0, as TfidfTransformer computes it for unseen features
+        default_idf = float(np.log((1 + counts.shape[0]) / 1.0) + 1.0)
+        return cls(n_features, columns, tfidf.idf_[columns].astype(np.float32), default_idf,
+                   svd.components_[:, columns].astype(np.float32), counts.shape[0])
+
+    def embed(self, texts: Iterable[str]) -> np.ndarray:
+        """Embeddings for a batch of texts, one unit-length row per text (zeros for no known words)."""
+        counts = self._vectorizer.transform(list(texts)).tocsr()
+        # sublinear TF x IDF, L2-normalized over all features (seen or not), as the fitted TfidfTransformer does
+        counts.data = np.log(counts.data) + 1.0
+        positions = self._position[counts.indices]
+        seen = positions >= 0
+        counts.data *= np.where(seen, self.idf[np.maximum(positions, 0)], self.default_idf)
+        row_norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+        # unseen features have zero weight in the SVD basis: keep only the seen columns
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        reduced = sparse.csr_matrix((counts.data[seen], (rows[seen], positions[seen])),
+                                    shape=(counts.shape[0], len(self.columns)))
+        vectors = np.asarray(reduced @ self.components.T, dtype=np.float32)
+        vectors /= np.where(row_norms == 0, 1.0, row_norms)[:, None]
+        lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(lengths == 0, 1.0, lengths)
+
+    def save(self, path: Optional[str] = None):
+        """Write the model atomically (a reader never loads a half-written file)."""
+        path = path or settings.LOCAL_EMBEDDER_PATH
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, columns=self.columns, idf=self.idf, components=self.components,
+                     meta=np.array(json.dumps({"n_features": self.n_features, "default_idf": self.default_idf,
+                                               "n_docs": self.n_docs})))
+        os.replace(tmp, path)
+
+
+def load(path: Optional[str] = None) -> Optional[LocalEmbedder]:
+    """The model stored at ``path`` (default LOCAL_EMBEDDER_PATH), or None when none was fitted."""
+    path = path or settings.LOCAL_EMBEDDER_PATH
+    try:
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return LocalEmbedder(meta['n_features'], data['columns'], data['idf'], meta['default_idf'],
+                                 data['components'], meta['n_docs'])
+    except FileNotFoundError:
+        return None
+
+
+_model: Optional[LocalEmbedder] = None
+_model_key = None
+_lock = threading.Lock()
+
+
+def get() -> Optional[LocalEmbedder]:
+    """The fitted model at LOCAL_EMBEDDER_PATH, loaded once and reloaded after a refit replaces it."""
+    global _model, _model_key
+    path = settings.LOCAL_EMBEDDER_PATH
+    try:
+        # os.replace gives every saved model a new inode, even within one mtime tick
+        stat = os.stat(path)
+        key = (path, stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        return None
+    if key != _model_key:
+        with _lock:
+            if key != _model_key:
+                _model = load(path)
+                _model_key = key
+    return _model
+
+
+def fit_and_save(texts: Sequence[str], path: Optional[str] = None) -> LocalEmbedder:
+    model = LocalEmbedder.fit(texts)
+    model.save(path)
+    return model
+
+
+def _corpus_texts(paths: List[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        if path.endswith('.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.extend(chunk.get('text', '') for chunk in json.load(f))
+        else:
+            from tools.doc_analyzer import iter_document_chunks
+            texts.extend(chunk['text'] for chunk in iter_document_chunks(path, 'LOCAL', 'FIT'))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline TF-IDF + SVD embedding model')
+    parser.add_argument('--fit', nargs='+', metavar='FILE', help='JSON corpora (lists of chunks) or PDF/text documents')
+    args = parser.parse_args()
+    if args.fit:
+        texts = _corpus_texts(args.fit)
+        model = fit_and_save(texts)
+        print(f"Fitted a {model.dim}-dim model on {model.n_docs} chunks ({len(model.columns)} features) "
+              f"-> {settings.LOCAL_EMBEDDER_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# RAG answer cache: repeated questions about the same filings skip retrieval and generation
+"""Cache ``generate_rag_answer`` results per question and index version.
+
+Entries are keyed by the normalized question (case, whitespace and trailing
+punctuation ignored), the retrieval settings (``RAG_K_CHUNKS``, ``RAG_MODEL``) and
+``rag_retriever.index_version()``. Every upsert, tombstone and delete bumps the
+version, so ingestion invalidates all earlier answers without scanning the cache.
+Answers live in a cache backend (``make_cache('rag_answers', ...)``) and are shared
+by workers with ``CACHE_BACKEND=sqlite``.
+
+On an exact miss, the question's embedding is compared with the embeddings of
+questions answered at the same index version in this process. A paraphrase whose
+cosine similarity reaches ``RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD`` (1.0, off, by
+default) reuses that answer, provided both questions name the same entities
+(``query_entities``): embeddings barely separate "Q2" from "Q3" or one company
+from another, and a financial answer for the wrong period is worse than a miss.
+"""
+import copy
+import logging
+import re
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from config import settings
+from tools import rag_retriever
+from utils.cache import make_cache
+
+logger = logging.getLogger(__name__)
+
+_answers = None
+_semantic = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "stored": 0}
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"[\s?.!]+$", "", " ".join(query.lower().split()))
+
+
+# Words capitalized only because they start the question
+_QUESTION_WORDS = frozenset({
+    'what', 'whats', 'how', 'which', 'who', 'when', 'where', 'why', 'is', 'are', 'was', 'were', 'did',
+    'does', 'do', 'can', 'could', 'please', 'show', 'give', 'tell', 'list', 'compare', 'summarize',
+    'summarise', 'explain', 'describe', 'find', 'get', 'the', 'and', 'in', 'for', 'of',
+})
+
+
+def query_entities(query: str) -> frozenset:
+    """Tokens that must match for a near-duplicate hit: any with a digit (Q3, 2024, 500M) and
+    capitalized words other than question words (company and product names), case-folded."""
+    tokens = re.findall(r"[A-Za-z0-9&$]+", query.replace("'s", ""))
+    return frozenset(t.lower() for t in tokens
+                     if any(c.isdigit() for c in t) or (t[0].isupper() and t.lower() not in _QUESTION_WORDS))
+
+
+def _scope(version: int) -> str:
+    # answers are only interchangeable for the same index contents and retrieval settings
+    return f"{version}:{settings.RAG_K_CHUNKS}:{settings.RAG_MODEL}"
+
+
+def _key(query: str, version: int) -> str:
+    return f"{_scope(version)}:{normalize_query(query)}"
+
+
+class SemanticIndex:
+    """Unit-normalized query embeddings of one scope (index version and settings), with the answer
+    key and the entities of each."""
+
+    def __init__(self, scope: str, maxsize: int):
+        self.scope = scope
+        self.maxsize = maxsize
+        self.keys: List[str] = []
+        self.entities: List[frozenset] = []
+        self._vectors: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def add(self, key: str, embedding, entities: frozenset = frozenset()) -> None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0 or key in self.keys:
+            return
+        if self._vectors and vector.shape != self._vectors[0].shape:
+            # embedding provider changed (e.g. hash fallback): start over rather than mix dimensions
+            self.keys, self.entities, self._vectors = [], [], []
+        self.keys.append(key)
+        self.entities.append(entities)
+        self._vectors.append(vector / norm)
+        if len(self.keys) > self.maxsize:
+            del self.keys[0], self.entities[0], self._vectors[0]
+        self._matrix = None
+
+    def nearest(self, embedding, threshold: float, entities: frozenset = frozenset()) -> Optional[str]:
+        """Key of the most similar stored question with the same ``entities``, if its cosine
+        similarity reaches ``threshold``."""
+        if not self._vectors:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0 or vector.shape != self._vectors[0].shape:
+            return None
+        if self._matrix is None:
+            self._matrix = np.stack(self._vectors)
+        scores = self._matrix @ (vector / norm)
+        scores[[e != entities for e in self.entities]] = -np.inf
+        best = int(np.argmax(scores))
+        return self.keys[best] if scores[best] >= threshold else None
+
+
+def _get_answers():
+    global _answers
+    if _answers is None:
+        _answers = make_cache('rag_answers', maxsize=settings.RAG_ANSWER_CACHE_SIZE, ttl=settings.RAG_ANSWER_CACHE_TTL_S)
+    return _answers
+
+
+def _semantic_enabled() -> bool:
+    # the corpus-fitted local model scores different questions about one filing as near-duplicates
+    # ("acme q3 revenue" vs "acme q3 net income": 0.99), so only Gemini embeddings qualify
+    return settings.RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD < 1.0 and not rag_retriever.local_embeddings_active()
+
+
+def _semantic_index(version: int) -> SemanticIndex:
+    # caller holds _lock; questions answered before the last ingestion (or a settings change) are forgotten
+    global _semantic
+    scope = _scope(version)
+    if _semantic is None or _semantic.scope != scope:
+        _semantic = SemanticIndex(scope, settings.RAG_ANSWER_CACHE_SEMANTIC_SIZE)
+    return _semantic
+
+
+def lookup(query: str, version: int) -> Optional[dict]:
+    """Cached answer for ``query`` at index ``version`` (exact, then near-duplicate), else None."""
+    if not settings.RAG_ANSWER_CACHE_ENABLED:
+        return None
+    answers = _get_answers()
+    result = answers.get(_key(query, version))
+    if result is not None:
+        _stats["hits"] += 1
+        return copy.deepcopy(result)
+    if _semantic_enabled():
+        embedding = rag_retriever.embed_query(normalize_query(query))
+        with _lock:
+            key = _semantic_index(version).nearest(embedding, settings.RAG_ANSWER_CACHE_SEMANTIC_THRESHOLD,
+                                                   query_entities(query))
+        result = answers.get(key) if key is not None else None
+        if result is not None:
+            logger.debug("RAG answer cache: %r answered as a near-duplicate of %r", query, key)
+            _stats["semantic_hits"] += 1
+            return copy.deepcopy(result)
+    _stats["misses"] += 1
+    return None
+
+
+def store(query: str, version: int, result: dict):
+    """Cache a successful answer computed against index ``version``."""
+    if not settings.RAG_ANSWER_CACHE_ENABLED or not result.get("audit_success"):
+        return
+    key = _key(query, version)
+    _get_answers().set(key, copy.deepcopy(result))
+    _stats["stored"] += 1
+    if _semantic_enabled():
+        embedding = rag_retriever.embed_query(normalize_query(query))
+        with _lock:
+            _semantic_index(version).add(key, embedding, query_entities(query))
+
+
+def stats() -> dict:
+    return dict(_stats)
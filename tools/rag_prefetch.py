@@ -0,0 +1,186 @@
+# Speculative retrieval: overlap RAG retrieval with the tool-decision LLM call
+"""Start ``retrieve_scored_documents`` for a RAG-looking query while the model is still deciding.
+
+The agent wraps its tool-decision step in ``speculate(query)``. If the model then
+calls ``generate_rag_answer`` with (nearly) the same question, ``take()`` hands it
+the prefetched chunks instead of retrieving again; otherwise the result is
+dropped. Chunks retrieved for a different wording are marked as borrowed
+(``Taken.exact`` is False), and ``finance_rag`` does not cache answers built on
+them under the model's wording. Speculation is bounded by ``RAG_PREFETCH_MAX_IN_FLIGHT`` concurrent
+retrievals and ``RAG_PREFETCH_MAX_PER_MINUTE`` starts, so wasted work stays capped.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+from config import settings
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+# Intents (llm_client.classify_intent) that usually end in a generate_rag_answer call
+RAG_INTENTS = ('document', 'analysis')
+
+
+class Taken(NamedTuple):
+    chunks: list
+    # the prefetch was for the same normalized question (not just an overlapping one)
+    exact: bool
+
+
+class Prefetch:
+    def __init__(self, query: str, k: int, future: Future):
+        self.query = query
+        self.k = k
+        self.future = future
+        self.used = False
+
+
+class PrefetchBudget:
+    """Caps speculative work: concurrent retrievals and starts per rolling minute."""
+
+    def __init__(self, max_in_flight: int, max_per_minute: int):
+        self.max_in_flight = max_in_flight
+        self.max_per_minute = max_per_minute
+        self._in_flight = 0
+        self._starts: deque = deque()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._starts and now - self._starts[0] > 60.0:
+                self._starts.popleft()
+            if self._in_flight >= self.max_in_flight or len(self._starts) >= self.max_per_minute:
+                return False
+            self._in_flight += 1
+            self._starts.append(now)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+
+_current: contextvars.ContextVar[Optional[Prefetch]] = contextvars.ContextVar('rag_prefetch', default=None)
+_budget: Optional[PrefetchBudget] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_stats = {"started": 0, "used": 0, "discarded": 0, "skipped_budget": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    # take() runs in agent tool threads, so counters are shared across threads
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _get_budget() -> PrefetchBudget:
+    global _budget
+    if _budget is None:
+        with _lock:
+            if _budget is None:
+                _budget = PrefetchBudget(settings.RAG_PREFETCH_MAX_IN_FLIGHT, settings.RAG_PREFETCH_MAX_PER_MINUTE)
+    return _budget
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, settings.RAG_PREFETCH_MAX_IN_FLIGHT),
+                                               thread_name_prefix='rag-prefetch')
+    return _executor
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def query_overlap(a: str, b: str) -> float:
+    """Jaccard similarity of the word sets of two queries (1.0 for identical normalized text)."""
+    ta, tb = _tokens(a), _tokens(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def _normalized(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _retrieve(query: str, k: int) -> list:
+    # Imported here so the agent does not load the retriever (and its optional SDKs) at startup
+    from tools.rag_retriever import retrieve_scored_documents
+    return retrieve_scored_documents(query, k)
+
+
+def start(query: str, k: Optional[int] = None) -> Optional[Prefetch]:
+    """Submit a speculative retrieval for ``query`` if the budget allows it."""
+    k = k or settings.RAG_K_CHUNKS
+    budget = _get_budget()
+    if not budget.try_acquire():
+        _count("skipped_budget")
+        return None
+    future = _get_executor().submit(deadline.run_in_context(_retrieve, query, k))
+    future.add_done_callback(lambda _f: budget.release())
+    _count("started")
+    return Prefetch(query, k, future)
+
+
+def is_rag_heavy(query: str) -> bool:
+    from llm_client import classify_intent
+    return classify_intent(query) in RAG_INTENTS
+
+
+@contextmanager
+def speculate(query: str):
+    """Prefetch retrieval for ``query`` for the duration of the block (when enabled and RAG-like).
+
+    Code run inside the block, including worker threads started via
+    ``deadline.run_in_context``, can pick the result up with ``take()``.
+    """
+    prefetch = None
+    if settings.RAG_SPECULATIVE_PREFETCH and is_rag_heavy(query):
+        prefetch = start(query)
+    token = _current.set(prefetch)
+    try:
+        yield prefetch
+    finally:
+        _current.reset(token)
+        if prefetch is not None and not prefetch.used:
+            # Not started yet: never run it; already running: let it finish and drop the result
+            prefetch.future.cancel()
+            _count("discarded")
+
+
+def take(query: str, k: int) -> Optional[Taken]:
+    """Prefetched ScoredChunk list for a matching query in the current context, or None."""
+    prefetch = _current.get()
+    if prefetch is None or prefetch.used or prefetch.k != k:
+        return None
+    if query_overlap(prefetch.query, query) < settings.RAG_PREFETCH_MIN_OVERLAP:
+        return None
+    try:
+        result = prefetch.future.result(timeout=deadline.remaining())
+    except FutureTimeout:
+        return None
+    except Exception:
+        logger.exception("Speculative retrieval failed; retrieving again")
+        return None
+    prefetch.used = True
+    _count("used")
+    return Taken(result, _normalized(prefetch.query) == _normalized(query))
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
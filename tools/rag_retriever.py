@@ -1,22 +1,231 @@
 # Rag retriever: supports Chromadb and in-memory fallback
+import hashlib
+import heapq
 import logging
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
 from config import settings
-from typing import List, Tuple, Dict
-try:
-    import chromadb  # if installed; optional
-    from chromadb.config import Settings as ChromaSettings
-except Exception:
-    chromadb = None
-    ChromaSettings = None
-try:
-    from google import genai
-except Exception:
-    genai = None
-# import google.genai is not required here
-
-_in_memory_store: List[Dict[str, str]] = []
+from typing import Iterable, List, Optional, Tuple
+from tools.chunk_store import ChunkStore
+from utils.cache import make_cache
+from utils.lazy import optional_import
+
+# chromadb and google.genai are optional and slow to import; they are loaded on first use
+# via optional_import('chromadb') / optional_import('google.genai').
+
+# In-memory fallback index keyed by chunk id, so re-ingesting a chunk replaces it
+_in_memory_store = ChunkStore()
+# Chunk ids hidden from retrieval until compaction deletes them (see tools/ingest_manifest.py)
+_tombstoned: set = set()
 _chroma_client = None
 _chroma_collection = None
+# Quantized embedding index over _in_memory_store (RAG_VECTOR_INDEX_ENABLED), created on first upsert
+_vector_index = None
+# Local model (tools/local_embedder.py) whose vectors _vector_index holds; None: Gemini or nothing indexed yet
+_vector_index_embedder = None
+_vector_index_lock = threading.RLock()
+# Index version (see index_version); kept in a cache backend so other workers and the ingest CLI share it
+_version_store = None
+_INDEX_VERSION_TTL_S = 365 * 86400.0
+# Identity of the in-process chunk store (in-memory fallback or an ephemeral Chroma client), see store_id
+_process_store_id = uuid.uuid4().hex
+_STORE_ID_FILE = '.store_id'
+
+
+def _get_version_store():
+    global _version_store
+    if _version_store is None:
+        _version_store = make_cache('rag_index', maxsize=16, ttl=_INDEX_VERSION_TTL_S)
+    return _version_store
+
+
+def index_version() -> int:
+    """Monotonically increasing version of the index contents, bumped by every upsert and removal.
+
+    A lost version (expired or a fresh cache) restarts from the clock, which is newer than
+    any version handed out before, so nothing keyed on an old version is served again.
+    """
+    store = _get_version_store()
+    version = store.get('version')
+    if version is None:
+        version = time.time_ns()
+        store.set('version', version)
+    return version
+
+
+def _bump_index_version():
+    _get_version_store().set('version', max(index_version() + 1, time.time_ns()))
+
+
+def _chroma_enabled() -> bool:
+    return bool(settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL
+                and optional_import('chromadb'))
+
+
+def _new_chroma_client(chromadb):
+    if settings.CHROMA_PERSIST_DIR:
+        return chromadb.PersistentClient(path=settings.CHROMA_PERSIST_DIR)
+    return chromadb.Client()
+
+
+def store_id() -> str:
+    """Identity of the store chunks are upserted into, saved in the ingestion manifest.
+
+    A persistent Chroma directory (CHROMA_PERSIST_DIR) keeps its id in a marker file, so it
+    survives restarts and changes when the directory is wiped. Every other store lives only
+    as long as this process, so a manifest written by another process does not describe it.
+    """
+    if not (settings.CHROMA_PERSIST_DIR and _chroma_enabled()):
+        return _process_store_id
+    marker = os.path.join(settings.CHROMA_PERSIST_DIR, _STORE_ID_FILE)
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        os.makedirs(settings.CHROMA_PERSIST_DIR, exist_ok=True)
+        value = uuid.uuid4().hex
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(value)
+        return value
+
+
+def _local_embedder():
+    # imported on use: scikit-learn is slow to import
+    from tools import local_embedder
+    return local_embedder.get()
+
+
+def _has_semantic_embedder() -> bool:
+    return bool(settings.GEMINI_API_KEY) or _local_embedder() is not None
+
+
+def local_embeddings_active() -> bool:
+    """True when queries are embedded by the corpus-fitted local model rather than Gemini."""
+    return not settings.GEMINI_API_KEY and _local_embedder() is not None
+
+
+def embed_text(text: str) -> List[float]:
+    """Embedding for a chunk or query: Gemini when configured, else the fitted local model, else a hash vector."""
+    logger = logging.getLogger(__name__)
+    # Prefer Gemini embeddings if available
+    genai = optional_import('google.genai') if settings.GEMINI_API_KEY else None
+    if genai:
+        try:
+            client = genai.Client(api_key=settings.GEMINI_API_KEY)
+            emb_resp = client.embeddings.create(model="text-embedding-3-small", input=text)
+            return emb_resp[0].embedding if isinstance(emb_resp, list) else emb_resp.embedding
+        except Exception:
+            logger.exception("Gemini embedding failed, falling back to simple embedding")
+    # Offline: the TF-IDF + SVD model fitted on our corpus (tools/local_embedder.py)
+    embedder = _local_embedder()
+    if embedder is not None:
+        return embedder.embed([text])[0].tolist()
+    # Last resort: deterministic hash-based embedding (not semantically accurate but works offline)
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    # convert bytes to floats between -1 and 1
+    vec = [((b / 255.0) * 2.0 - 1.0) for b in digest[:32]]
+    return vec
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Batch ``embed_text``: the local model embeds the whole batch in one pass."""
+    if not settings.GEMINI_API_KEY:
+        embedder = _local_embedder()
+        if embedder is not None:
+            return embedder.embed(texts).tolist()
+    return [embed_text(t) for t in texts]
+
+
+def _vector_shards() -> int:
+    """RAG_VECTOR_SHARDS, capped at the core count: more shard processes than cores only add IPC."""
+    cores = os.cpu_count() or 1
+    if settings.RAG_VECTOR_SHARDS > cores:
+        logging.getLogger(__name__).warning("RAG_VECTOR_SHARDS=%d exceeds the %d available cores; using %d shards",
+                                            settings.RAG_VECTOR_SHARDS, cores, cores)
+        return cores
+    return settings.RAG_VECTOR_SHARDS
+
+
+def _get_vector_index():
+    global _vector_index
+    if _vector_index is None:
+        options = (settings.RAG_VECTOR_QUANTIZATION, settings.RAG_VECTOR_RESCORE,
+                   settings.RAG_VECTOR_PQ_SUBVECTORS, settings.RAG_VECTOR_PQ_TRAIN_SIZE)
+        shards = _vector_shards()
+        if shards > 1:
+            from tools.sharded_index import ShardedVectorIndex
+            _vector_index = ShardedVectorIndex(settings.RAG_VECTOR_DIR, shards, *options)
+        else:
+            from tools.vector_index import VectorIndex
+            _vector_index = VectorIndex(settings.RAG_VECTOR_DIR, *options)
+    return _vector_index
+
+
+def _add_to_vector_index(ids: List[str], vectors, companies: List[Optional[str]]):
+    index = _get_vector_index()
+    if getattr(index, 'shards', 1) > 1 and settings.RAG_VECTOR_SHARD_BY == 'company':
+        index.add(ids, vectors, shard_keys=companies)
+    else:
+        index.add(ids, vectors)
+
+
+def _sync_vector_index() -> bool:
+    """Re-embed every in-memory chunk into a new vector index when the local model changed.
+
+    The model file is shared: a refit here, in another worker or by
+    ``python -m tools.local_embedder --fit`` replaces it, and ``local_embedder.get()`` then
+    returns the new model. Vectors of the old model are meaningless next to its query
+    vectors, so the index is rebuilt before it is used. Returns True when it rebuilt.
+    """
+    global _vector_index, _vector_index_embedder
+    if settings.GEMINI_API_KEY:
+        return False
+    with _vector_index_lock:
+        model = _local_embedder()
+        if model is None or model is _vector_index_embedder:
+            return False
+        # cached query embeddings belong to the old model too
+        embed_query.cache_clear()
+        if _vector_index is not None:
+            _vector_index.close()
+            _vector_index = None
+        _vector_index_embedder = model
+        ids = list(_in_memory_store)
+        if ids:
+            chunks = [_in_memory_store[chunk_id] for chunk_id in ids]
+            logging.getLogger(__name__).info("Re-embedding %d chunks with the new local embedder", len(ids))
+            _add_to_vector_index(ids, model.embed([c.text for c in chunks]), [c.metadata.get('company') for c in chunks])
+        _bump_index_version()
+        return True
+
+
+def _refit_local_embedder() -> bool:
+    """With LOCAL_EMBEDDER_AUTO_FIT (off by default), fit the local embedder on the in-memory chunks.
+
+    Runs when there is no model yet and LOCAL_EMBEDDER_MIN_DOCS chunks are stored, and again
+    whenever the corpus has grown LOCAL_EMBEDDER_REFIT_GROWTH-fold since the last fit (the
+    amortized cost stays linear). The fit blocks the upsert that triggers it, so production
+    setups fit with ``python -m tools.local_embedder --fit`` instead. Returns True when it refitted.
+    """
+    if settings.GEMINI_API_KEY or not settings.LOCAL_EMBEDDER_AUTO_FIT:
+        return False
+    count, current = len(_in_memory_store), _local_embedder()
+    if count < settings.LOCAL_EMBEDDER_MIN_DOCS or (
+            current is not None and count < current.n_docs * settings.LOCAL_EMBEDDER_REFIT_GROWTH):
+        return False
+    from tools import local_embedder
+    model = local_embedder.fit_and_save([_in_memory_store[chunk_id].text for chunk_id in _in_memory_store])
+    logging.getLogger(__name__).info("Fitted a %d-dim local embedder on %d chunks", model.dim, model.n_docs)
+    return _sync_vector_index()
+
+
+@lru_cache(maxsize=1024)
+def embed_query(query: str) -> Tuple[float, ...]:
+    """Cached query embedding: the answer cache and the vector search embed the same question."""
+    return tuple(embed_text(query))
 
 
 def upsert_chunks_to_vector_db(chunks: list[dict]):
@@ -29,30 +238,15 @@ def upsert_chunks_to_vector_db(chunks: list[dict]):
     # embedding_model = genai.Client().models.get_embedding_model("text-embedding-004")
     # 2. Vector DB Insertion: Call the vector DB client (e.g., chromadb.upsert)
     # If a Chromadb instance is configured, you could insert real embeddings there.
-    def get_embedding(text: str) -> List[float]:
-        # Prefer Gemini embeddings if available
-        if genai and settings.GEMINI_API_KEY:
-            try:
-                client = genai.Client(api_key=settings.GEMINI_API_KEY)
-                emb_resp = client.embeddings.create(model="text-embedding-3-small", input=text)
-                return emb_resp[0].embedding if isinstance(emb_resp, list) else emb_resp.embedding
-            except Exception:
-                logger.exception("Gemini embedding failed, falling back to simple embedding")
-        # Fallback: deterministic hash-based embedding (not semantically accurate but works offline)
-        import hashlib
-        digest = hashlib.sha256(text.encode('utf-8')).digest()
-        # convert bytes to floats between -1 and 1
-        vec = [((b / 255.0) * 2.0 - 1.0) for b in digest[:32]]
-        return vec
-
-    if chromadb and (settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL):
+    chromadb = optional_import('chromadb') if (settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL) else None
+    if chromadb:
         logger.info("(Chromadb integration requested; attempting remote connection)")
         try:
             # Use chromadb client (basic configuration) - this requires the user to provide a chroma server URL or local
             # For the example, we just instantiate default client
             global _chroma_client
             if _chroma_client is None:
-                _chroma_client = chromadb.Client()
+                _chroma_client = _new_chroma_client(chromadb)
             col = None
             try:
                 col = _chroma_client.get_collection("finance_land")
@@ -61,83 +255,157 @@ def upsert_chunks_to_vector_db(chunks: list[dict]):
             # Prepare batches
             ids = [c.get('id', f'doc-{i}') for i, c in enumerate(chunks)]
             documents = [c.get('text', '') for c in chunks]
-            metadatas = [{'source': c.get('source', 'unknown')} for c in chunks]
-            embeddings = [get_embedding(t) for t in documents]
-            col.add(ids=ids, metadatas=metadatas, documents=documents, embeddings=embeddings)
+            # Chroma metadata values must be scalars; drop empty fields (e.g. chunks without a date)
+            metadatas = [{'source': c.get('source', 'unknown'),
+                          **{k: v for k, v in (c.get('metadata') or {}).items() if v is not None}} for c in chunks]
+            embeddings = embed_texts(documents)
+            col.upsert(ids=ids, metadatas=metadatas, documents=documents, embeddings=embeddings)
+            _tombstoned.difference_update(ids)
+            _bump_index_version()
             logger.info("Ingestion complete. Chromadb index updated with %d chunks.", len(chunks))
             return
         except Exception:
             logger.exception("Chromadb ingestion failed; falling back to in-memory storage")
-    else:
-        # Fallback: simple in-memory store
-        for c in chunks:
-            _in_memory_store.append(c)
-        logger.info("Ingestion complete. In-memory index updated with %d chunks.", len(chunks))
-    
-def retrieve_documents(query: str, k: int) -> Tuple[List[str], List[str]]:
+    # Fallback: simple in-memory store (upsert by id)
+    ids = []
+    for i, c in enumerate(chunks):
+        chunk_id = c.get('id', f'doc-{len(_in_memory_store) + i}')
+        _in_memory_store.upsert(chunk_id, c.get('text', ''), c.get('source', 'unknown'), c.get('metadata'))
+        _tombstoned.discard(chunk_id)
+        ids.append(chunk_id)
+    if settings.RAG_VECTOR_INDEX_ENABLED:
+        try:
+            # a refit or a new model file re-embeds the whole store, these chunks included;
+            # hash vectors would rank worse than term search: index only real embeddings
+            with _vector_index_lock:
+                if not _refit_local_embedder() and not _sync_vector_index() and _has_semantic_embedder():
+                    _add_to_vector_index(ids, embed_texts([c.get('text', '') for c in chunks]),
+                                         [(c.get('metadata') or {}).get('company') for c in chunks])
+        except ValueError:
+            logger.exception("Embedding index update failed; these chunks are only found by term search")
+    _bump_index_version()
+    logger.info("Ingestion complete. In-memory index updated with %d chunks.", len(chunks))
+
+
+def tombstone_chunks(ids: Iterable[str]):
+    """Hide chunks from retrieval immediately; they are physically removed by delete_chunks_from_vector_db."""
+    _tombstoned.update(ids)
+    _bump_index_version()
+
+
+def delete_chunks_from_vector_db(ids: List[str]):
+    """Remove chunks (typically tombstoned ones, during compaction) from the vector database."""
+    logger = logging.getLogger(__name__)
+    if not ids:
+        return
+    chromadb = optional_import('chromadb') if (settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL) else None
+    if chromadb:
+        try:
+            global _chroma_client
+            if _chroma_client is None:
+                _chroma_client = _new_chroma_client(chromadb)
+            _chroma_client.get_collection("finance_land").delete(ids=list(ids))
+        except Exception:
+            logger.exception("Chromadb delete failed for %d chunks", len(ids))
+            raise
+    for chunk_id in ids:
+        _in_memory_store.delete(chunk_id)
+        _tombstoned.discard(chunk_id)
+    if _vector_index is not None:
+        _vector_index.remove(ids)
+    _bump_index_version()
+    logger.info("Deleted %d chunks from the index.", len(ids))
+
+
+class ScoredChunk:
+    """A retrieved chunk with its source citation and relevance score (higher is better)."""
+
+    def __init__(self, text: str, source: str, score: float, chunk_id: Optional[str] = None):
+        self.text = text
+        self.source = source
+        self.score = score
+        self.chunk_id = chunk_id
+
+    def __repr__(self) -> str:
+        return f"ScoredChunk(source={self.source!r}, score={self.score:.3f}, text={self.text[:40]!r})"
+
+
+def retrieve_scored_documents(query: str, k: int) -> List[ScoredChunk]:
     """
     Searches the vector database for the top-k relevant text chunks based on the query.
 
     Returns:
-        A tuple: (list of relevant text chunks, list of source citations)
+        Up to k ScoredChunk objects, best first.
     """
     logger = logging.getLogger(__name__)
     logger.info("Retrieving top %d documents for query: %s", k, query)
     # 1. Query Embedding: Embed the user's query
     # 2. Vector Search: Execute the nearest neighbor search
     
-    # If Chromadb is available and remote
-    def get_embedding(text: str) -> List[float]:
-        if genai and settings.GEMINI_API_KEY:
-            try:
-                client = genai.Client(api_key=settings.GEMINI_API_KEY)
-                emb_resp = client.embeddings.create(model="text-embedding-3-small", input=text)
-                return emb_resp[0].embedding if isinstance(emb_resp, list) else emb_resp.embedding
-            except Exception:
-                logger.exception("Gemini embedding failed; using hash fallback")
-        import hashlib
-        digest = hashlib.sha256(text.encode('utf-8')).digest()
-        vec = [((b / 255.0) * 2.0 - 1.0) for b in digest[:32]]
-        return vec
-
-    if chromadb and (settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL):
+    chromadb = optional_import('chromadb') if (settings.VECTOR_DB_URL and 'localhost' not in settings.VECTOR_DB_URL) else None
+    if chromadb:
         try:
             global _chroma_client
             if _chroma_client is None:
-                _chroma_client = chromadb.Client()
+                _chroma_client = _new_chroma_client(chromadb)
             col = _chroma_client.get_collection("finance_land")
-            query_emb = get_embedding(query)
+            query_emb = list(embed_query(query))
             # Attempt an embedding-based query for better semantic matching.
             try:
-                results = col.query(query_embeddings=[query_emb], n_results=k, include=['documents', 'metadatas'])
+                results = col.query(query_embeddings=[query_emb], n_results=k, include=['documents', 'metadatas', 'distances'])
             except Exception:
-                results = col.query(queries=[query], n_results=k, include=['documents', 'metadatas'])
+                results = col.query(queries=[query], n_results=k, include=['documents', 'metadatas', 'distances'])
             docs = results.get('documents', [])
             metadatas = results.get('metadatas', [])
-            # results documents is a list of lists
+            distances = results.get('distances', [])
+            # results are lists of lists (one per query embedding)
             relevant_chunks = docs[0] if docs and isinstance(docs, list) else []
-            citations = [m.get('source', 'unknown') if isinstance(m, dict) else str(m) for m in (metadatas[0] if metadatas and isinstance(metadatas, list) else [])]
-            return relevant_chunks[:k], citations[:k]
+            metas = metadatas[0] if metadatas and isinstance(metadatas, list) else []
+            dists = distances[0] if distances and isinstance(distances, list) else []
+            ids = (results.get('ids') or [[]])[0]
+            scored = []
+            for i, text in enumerate(relevant_chunks[:k]):
+                if i < len(ids) and ids[i] in _tombstoned:
+                    continue
+                meta = metas[i] if i < len(metas) else {}
+                source = meta.get('source', 'unknown') if isinstance(meta, dict) else str(meta)
+                # Convert distance (lower is closer) to a score; keep rank order when distances are missing
+                score = 1.0 / (1.0 + float(dists[i])) if i < len(dists) else 1.0 / (1 + i)
+                scored.append(ScoredChunk(text, source, score, ids[i] if i < len(ids) else None))
+            return scored
         except Exception:
             logger.exception("Chromadb query failed; falling back to in-memory search")
-    # Fallback: simple substring match on in-memory store
+    store = _in_memory_store
+    if settings.RAG_VECTOR_INDEX_ENABLED:
+        _sync_vector_index()
+    if settings.RAG_VECTOR_INDEX_ENABLED and _vector_index is not None and len(_vector_index):
+        try:
+            hits = []
+            for chunk_id, similarity in _vector_index.search(embed_query(query), k, exclude=_tombstoned):
+                chunk = store.get(chunk_id)
+                if chunk is not None:
+                    hits.append(ScoredChunk(chunk.text, chunk.source or 'unknown', similarity, chunk_id))
+            if hits:
+                return hits
+        except ValueError:
+            logger.exception("Embedding search failed; falling back to term search")
+    # Fallback: simple substring match on in-memory store, scanned in place; only the top k become objects
+    first_token = query.split()[0] if query.split() else ''
+    counts = ((row, count) for row, count in store.term_counts(first_token)  # naive score using first token
+              if not _tombstoned or store.chunk_id(row) not in _tombstoned)
     hits = []
-    for doc in _in_memory_store:
-        content = doc.get('text', '') if isinstance(doc, dict) else str(doc)
-        score = content.count(query.split()[0])  # naive score using first token
-        hits.append((score, content, doc.get('source', 'unknown') if isinstance(doc, dict) else 'unknown'))
-    hits.sort(key=lambda t: t[0], reverse=True)
-    relevant_chunks = [h[1] for h in hits[:k]]
-    citations = [h[2] for h in hits[:k]]
-    if not relevant_chunks:
-        # default placeholder
-        relevant_chunks = [
-            "The Q3 2024 report indicates a net revenue of $500 Million.",
-            "The company's primary focus for next year is renewable energy."
-        ]
-        citations = [
-            "Source: Q3 2024 Investor Presentation, Slide 10",
-            "Source: CEO Letter, Oct 2024"
-        ]
-    
-    return relevant_chunks, citations
\ No newline at end of file
+    for row, count in heapq.nlargest(k, counts, key=lambda rc: rc[1]):
+        chunk = store.view(row)
+        hits.append(ScoredChunk(chunk.text, chunk.source or 'unknown', float(count), chunk.id))
+    return hits[:k]
+
+
+def retrieve_documents(query: str, k: int) -> Tuple[List[str], List[str]]:
+    """
+    Searches the vector database for the top-k relevant text chunks based on the query.
+
+    Returns:
+        A tuple: (list of relevant text chunks, list of source citations)
+    """
+    scored = retrieve_scored_documents(query, k)
+    return [c.text for c in scored], [c.source for c in scored]
@@ -0,0 +1,342 @@
+# Historical exchange rates: a columnar daily store with memory-mapped loading
+"""Daily exchange rates kept as one NumPy matrix for point, range and period-average queries.
+
+Layout (``RATE_HISTORY_DIR``):
+    rates.npy   float64 [day, currency]: units of currency per 1 ``base``; NaN = no quote
+    meta.json   {"base": "USD", "start": "2024-01-01", "currencies": ["EUR", ...]}
+
+Row ``i`` is ``start + i`` days, so a date resolves to a row with one subtraction
+and a currency to a column with one dict lookup; cross rates are the ratio of two
+columns. Days without a quote (weekends, holidays) answer with the last quote
+at most ``RATE_HISTORY_MAX_GAP_DAYS`` earlier, so "quarter-end rate" works on a
+Sunday. The matrix is memory-mapped, so loading is instant and only the touched
+pages are read; a year of 160 currencies is ~470 KB.
+
+Usage:
+    python -m tools.rate_history --backfill --start 2024-01-01
+    python -m tools.rate_history EUR GBP 2024-09-30
+    python -m tools.rate_history --benchmark
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from config import settings
+from utils import deadline
+
+logger = logging.getLogger(__name__)
+
+RATES_FILE = 'rates.npy'
+META_FILE = 'meta.json'
+
+
+class RateHistoryError(Exception):
+    pass
+
+
+def _as_date(value) -> date:
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        raise RateHistoryError(f"Invalid date '{value}', expected YYYY-MM-DD")
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Carry the last finite value forward along axis 0 (leading NaNs stay NaN)."""
+    mask = np.isfinite(values)
+    idx = np.where(mask, np.arange(len(values)).reshape(-1, *([1] * (values.ndim - 1))), 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = np.take_along_axis(values, idx, axis=0)
+    # rows before the first quote in a column pick up row 0, which may itself be NaN
+    return np.where(np.logical_or.accumulate(mask, axis=0), filled, np.nan)
+
+
+class RateHistory:
+    """Daily rates for ``currencies`` against ``base`` from ``start`` onwards."""
+
+    def __init__(self, base: str, start: date, currencies: List[str], rates: np.ndarray):
+        self.base = base.upper()
+        self.start = start
+        self.currencies = [c.upper() for c in currencies]
+        self.rates = rates
+        self._columns: Dict[str, int] = {c: i for i, c in enumerate(self.currencies)}
+
+    @property
+    def end(self) -> Optional[date]:
+        """Last stored day (None when empty)."""
+        return self.start + timedelta(days=len(self.rates) - 1) if len(self.rates) else None
+
+    def _row(self, day: date) -> int:
+        return (day - self.start).days
+
+    def _column(self, currency: str) -> Optional[int]:
+        """Column of ``currency``; None for the base currency (always 1.0)."""
+        currency = currency.upper()
+        if currency == self.base:
+            return None
+        col = self._columns.get(currency)
+        if col is None:
+            raise RateHistoryError(f"No history for currency '{currency}'")
+        return col
+
+    def _values(self, currency: str, first: int, last: int) -> np.ndarray:
+        col = self._column(currency)
+        if col is None:
+            return np.ones(last - first)
+        return np.asarray(self.rates[first:last, col], dtype=np.float64)
+
+    def _cross(self, source: str, target: str, first: int, last: int) -> np.ndarray:
+        return self._values(target, first, last) / self._values(source, first, last)
+
+    def rate(self, source: str, target: str, day) -> Tuple[float, date]:
+        """Rate from ``source`` to ``target`` on ``day``; returns (rate, date of the quote used)."""
+        day = _as_date(day)
+        row = self._row(day)
+        if row < 0 or row >= len(self.rates):
+            raise RateHistoryError(f"{day} is outside the stored history ({self.start} to {self.end})")
+        first = max(0, row - settings.RATE_HISTORY_MAX_GAP_DAYS)
+        values = self._cross(source, target, first, row + 1)
+        quoted = np.flatnonzero(np.isfinite(values))
+        if not len(quoted):
+            raise RateHistoryError(f"No {source}/{target} quote within {settings.RATE_HISTORY_MAX_GAP_DAYS} days before {day}")
+        last = quoted[-1]
+        return float(values[last]), self.start + timedelta(days=int(first + last))
+
+    def series(self, source: str, target: str, start, end) -> Tuple[np.ndarray, np.ndarray]:
+        """(dates as datetime64[D], rates) for every day in [start, end], gaps forward-filled."""
+        start, end = _as_date(start), _as_date(end)
+        if end < start:
+            raise RateHistoryError(f"End date {end} is before start date {start}")
+        first = max(0, self._row(start))
+        last = min(len(self.rates), self._row(end) + 1)
+        if first >= last:
+            raise RateHistoryError(f"{start} to {end} is outside the stored history ({self.start} to {self.end})")
+        # read a little further back so a range starting on a holiday has a value on day one
+        lead = min(first, settings.RATE_HISTORY_MAX_GAP_DAYS)
+        values = _ffill(self._cross(source, target, first - lead, last))[lead:]
+        dates = np.datetime64(self.start, 'D') + np.arange(first, last)
+        return dates, values
+
+    def average(self, source: str, target: str, start, end) -> dict:
+        """Mean, min and max of the daily rate over [start, end]."""
+        dates, values = self.series(source, target, start, end)
+        quoted = values[np.isfinite(values)]
+        if not len(quoted):
+            raise RateHistoryError(f"No {source}/{target} quotes between {start} and {end}")
+        return {
+            "average": float(quoted.mean()),
+            "min": float(quoted.min()),
+            "max": float(quoted.max()),
+            "start": str(dates[0]),
+            "end": str(dates[-1]),
+            "days": int(len(quoted)),
+        }
+
+    def add_day(self, day, quotes: Dict[str, float]) -> 'RateHistory':
+        """Store one day of quotes (units per 1 base); grows rows and currency columns as needed."""
+        day = _as_date(day)
+        quotes = {c.upper(): float(v) for c, v in quotes.items() if c.upper() != self.base}
+        new = [c for c in quotes if c not in self._columns]
+        rates = np.asarray(self.rates)
+        if not len(rates):
+            self.start = day
+        row = self._row(day)
+        if row < 0:
+            # day before the current start: prepend empty rows
+            rates = np.vstack([np.full((-row, rates.shape[1]), np.nan), rates])
+            self.start, row = day, 0
+        if row >= len(rates) or new:
+            grown = np.full((max(len(rates), row + 1), len(self.currencies) + len(new)), np.nan)
+            grown[:rates.shape[0], :rates.shape[1]] = rates
+            rates = grown
+            for c in new:
+                self._columns[c] = len(self.currencies)
+                self.currencies.append(c)
+        elif not rates.flags.writeable:
+            rates = rates.copy()
+        for c, v in quotes.items():
+            rates[row, self._columns[c]] = v
+        self.rates = rates
+        return self
+
+    def save(self, directory: Optional[str] = None):
+        """Write rates.npy and meta.json atomically (readers never see a half-written file)."""
+        directory = directory or settings.RATE_HISTORY_DIR
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npy.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.asarray(self.rates, dtype=np.float64))
+        os.replace(tmp, os.path.join(directory, RATES_FILE))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.json.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({"base": self.base, "start": self.start.isoformat(), "currencies": self.currencies}, f)
+        os.replace(tmp, os.path.join(directory, META_FILE))
+
+
+def load_history(directory: Optional[str] = None, mmap: bool = True) -> Optional[RateHistory]:
+    """Open a stored history (memory-mapped by default); None when nothing has been stored."""
+    directory = directory or settings.RATE_HISTORY_DIR
+    try:
+        with open(os.path.join(directory, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        rates = np.load(os.path.join(directory, RATES_FILE), mmap_mode='r' if mmap else None)
+    except FileNotFoundError:
+        return None
+    return RateHistory(meta['base'], _as_date(meta['start']), meta['currencies'], rates)
+
+
+_history: Optional[RateHistory] = None
+_history_key: Optional[tuple] = None
+_lock = threading.Lock()
+
+
+def get_history() -> Optional[RateHistory]:
+    """The history at RATE_HISTORY_DIR, opened once and reopened after a backfill rewrites it."""
+    global _history, _history_key
+    directory = settings.RATE_HISTORY_DIR
+    try:
+        key = (directory, os.path.getmtime(os.path.join(directory, META_FILE)))
+    except OSError:
+        return None
+    if key != _history_key:
+        with _lock:
+            if key != _history_key:
+                _history = load_history(directory)
+                _history_key = key
+    return _history
+
+
+def fetch_day_rates(day: date, base: Optional[str] = None) -> Dict[str, float]:
+    """Fetch one day of rates for ``base`` from the configured provider.
+
+    With an API key this uses the Exchangerate-API history endpoint
+    (/v6/{KEY}/history/{BASE}/{Y}/{M}/{D}); otherwise a dated endpoint with a
+    ``base`` query parameter (/{YYYY-MM-DD}?base=USD), as served by keyless providers.
+    """
+    base = (base or settings.RATE_HISTORY_BASE).upper()
+    base_url = settings.EXCHANGE_RATE_BASE_URL.rstrip('/')
+    api_key = settings.EXCHANGE_RATE_API_KEY or settings.FINANCIAL_DATA_API_KEY or ''
+    if api_key:
+        api_url = f"{base_url}/{api_key}/history/{base}/{day.year}/{day.month}/{day.day}"
+    else:
+        api_url = f"{base_url}/{day.isoformat()}?base={base}"
+    response = requests.get(api_url, timeout=deadline.timeout_for(10))
+    response.raise_for_status()
+    data = response.json()
+    return data.get('conversion_rates') or data.get('rates') or {}
+
+
+def backfill(history: Optional[RateHistory] = None, start=None, end=None,
+             fetch: Callable[[date], Dict[str, float]] = fetch_day_rates, save: bool = True) -> int:
+    """Fetch and store the days missing from ``history``; returns how many days were added.
+
+    Incremental: resumes the day after the last stored day (or at ``start`` for a new
+    store) and stops at ``end`` (default today). Days the provider has no quotes for
+    are skipped; the store is saved once at the end.
+    """
+    history = history or load_history(mmap=False) or RateHistory(settings.RATE_HISTORY_BASE, _as_date(start or date.today()), [], np.empty((0, 0)))
+    end = _as_date(end or date.today())
+    day = history.end + timedelta(days=1) if history.end else _as_date(start or history.start)
+    added = 0
+    while day <= end:
+        try:
+            quotes = fetch(day)
+        except requests.RequestException as e:
+            logger.error("Failed to fetch rates for %s: %s", day, e)
+            break
+        if quotes:
+            history.add_day(day, quotes)
+            added += 1
+        day += timedelta(days=1)
+    if added and save:
+        history.save()
+    logger.info("Backfilled %d days of %s rates (history now ends %s)", added, history.base, history.end)
+    return added
+
+
+def get_historical_exchange_rate(source_currency: str, target_currency: str, date: str,
+                                 end_date: Optional[str] = None) -> dict:
+    """
+    Looks up historical exchange rates from the local daily rate history.
+
+    Args:
+        source_currency: The currency to convert from (e.g., "USD").
+        target_currency: The currency to convert to (e.g., "EUR").
+        date: The day of the rate (YYYY-MM-DD), or the first day of a period.
+        end_date: Optional last day of a period (YYYY-MM-DD); when given the average,
+            min and max rate over the period are returned.
+
+    Returns:
+        A dictionary with the rate (and the date of the quote used), or period statistics.
+    """
+    # imported here so this module does not depend on the live-rate tool at import time
+    from tools.currency_tool import ToolExecutionError
+
+    history = get_history()
+    if history is None:
+        raise ToolExecutionError("No rate history stored; run `python -m tools.rate_history --backfill`")
+    pair = {"source": source_currency.upper(), "target": target_currency.upper()}
+    try:
+        if end_date:
+            return {**pair, **history.average(source_currency, target_currency, date, end_date)}
+        rate, quoted = history.rate(source_currency, target_currency, date)
+        return {**pair, "rate": rate, "date": quoted.isoformat()}
+    except RateHistoryError as e:
+        raise ToolExecutionError(str(e))
+
+
+def benchmark(days: int = 365, currencies: int = 160, repeat: int = 10000) -> dict:
+    """Microseconds per point / range / average query on a synthetic memory-mapped store."""
+    rng = np.random.default_rng(0)
+    codes = [f"C{i:03d}" for i in range(currencies)]
+    rates = np.exp(rng.normal(size=(days, currencies)))
+    rates[rng.random(rates.shape) < 0.02] = np.nan
+    start = date(2024, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        RateHistory('USD', start, codes, rates).save(tmp)
+        history = load_history(tmp)
+        report = {"days": days, "currencies": currencies}
+        queries = {
+            "point": lambda i: history.rate(codes[i % currencies], codes[(i * 7) % currencies], start + timedelta(days=i % days)),
+            "range_90d": lambda i: history.series(codes[i % currencies], 'USD', start + timedelta(days=i % 200), start + timedelta(days=i % 200 + 89)),
+            "average_year": lambda i: history.average(codes[i % currencies], codes[(i * 7) % currencies], start, start + timedelta(days=days - 1)),
+        }
+        for name, query in queries.items():
+            begin = time.perf_counter()
+            for i in range(repeat):
+                query(i)
+            report[f"{name}_us"] = (time.perf_counter() - begin) / repeat * 1e6
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local daily exchange-rate history')
+    parser.add_argument('query', nargs='*', help='SOURCE TARGET DATE [END_DATE]')
+    parser.add_argument('--backfill', action='store_true', help='Fetch days missing from the store')
+    parser.add_argument('--start', help='First day for a new store (YYYY-MM-DD, default today)')
+    parser.add_argument('--end', help='Last day to backfill (YYYY-MM-DD, default today)')
+    parser.add_argument('--benchmark', action='store_true', help='Benchmark queries on a synthetic store')
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark().items():
+            print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+        return
+    if args.backfill:
+        print(f"Added {backfill(start=args.start, end=args.end)} days")
+    if args.query:
+        print(get_historical_exchange_rate(*args.query))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Background refresh of exchange-rate tables for the most requested base currencies
+"""Keep ``currency_tool``'s rate tables warm so agent queries rarely wait on the provider.
+
+``currency_tool.get_rate_table`` records every base it is asked for in ``tracker``
+(counts over the last ``RATE_PREFETCH_WINDOW_S``). While the API runs, a
+``RatePrefetcher`` task (started from the app lifespan in ``main.py``) wakes every
+``RATE_PREFETCH_INTERVAL_S`` and refetches the ``RATE_PREFETCH_TOP_N`` hottest
+bases (plus ``RATE_PREFETCH_SEED_BASES``) whose cached table is missing or older
+than ``RATE_PREFETCH_REFRESH_AT`` of ``RATE_TABLE_TTL_S``, i.e. before it expires.
+Refreshes are capped at ``RATE_PREFETCH_MAX_PER_MINUTE`` provider requests: each
+refresh is a single attempt (no retries), and a cycle stops at the first failure
+so a struggling provider is not hammered.
+
+Every API worker starts a prefetcher, but a cycle only runs in the worker holding
+the ``leader`` lease in the ``rate_prefetch`` cache. With ``CACHE_BACKEND=sqlite``
+that is one worker on the host, so the cap is per host; with the in-process
+``memory`` backend each worker keeps (and refreshes) its own tables, so the cap
+is per worker.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import List, Optional
+
+from config import settings
+from tools.rag_prefetch import PrefetchBudget
+from utils.cache import make_cache
+
+logger = logging.getLogger(__name__)
+
+
+class HotBaseTracker:
+    """Request counts per base currency over a sliding time window."""
+
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        self._events: deque = deque()
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._events and now - self._events[0][0] > self.window_s:
+            _, base = self._events.popleft()
+            self._counts[base] -= 1
+            if self._counts[base] <= 0:
+                del self._counts[base]
+
+    def record(self, base: str):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._events.append((now, base))
+            self._counts[base] += 1
+
+    def top(self, n: int) -> List[str]:
+        with self._lock:
+            self._expire(time.monotonic())
+            return [base for base, _ in self._counts.most_common(n)]
+
+    def counts(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return dict(self._counts)
+
+
+tracker = HotBaseTracker(settings.RATE_PREFETCH_WINDOW_S)
+
+
+class RatePrefetcher:
+    """Periodically refreshes hot rate tables ahead of expiry within a request budget."""
+
+    def __init__(self, interval_s: Optional[float] = None, top_n: Optional[int] = None,
+                 max_per_minute: Optional[int] = None, refresh_at: Optional[float] = None,
+                 seed_bases: Optional[List[str]] = None):
+        self.interval_s = settings.RATE_PREFETCH_INTERVAL_S if interval_s is None else interval_s
+        self.top_n = settings.RATE_PREFETCH_TOP_N if top_n is None else top_n
+        self.refresh_at = settings.RATE_PREFETCH_REFRESH_AT if refresh_at is None else refresh_at
+        self.seed_bases = [b.upper() for b in (settings.RATE_PREFETCH_SEED_BASES if seed_bases is None else seed_bases)]
+        self.budget = PrefetchBudget(max_in_flight=1, max_per_minute=(
+            settings.RATE_PREFETCH_MAX_PER_MINUTE if max_per_minute is None else max_per_minute))
+        self.stats = {"cycles": 0, "refreshed": 0, "failed": 0, "skipped_budget": 0, "skipped_not_leader": 0}
+        self._task: Optional[asyncio.Task] = None
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # held across cycles; lapses when the leader stops renewing it (e.g. its worker exited)
+        self._lease_s = max(2 * self.interval_s, 30.0)
+        self._leases = make_cache('rate_prefetch', maxsize=4, ttl=self._lease_s)
+
+    def due(self) -> List[str]:
+        """Hot and seed bases whose table is missing or past the refresh point, hottest first."""
+        from tools.currency_tool import rate_table_age
+
+        bases = list(dict.fromkeys(tracker.top(self.top_n) + self.seed_bases))
+        horizon = settings.RATE_TABLE_TTL_S * self.refresh_at
+        due = []
+        for base in bases:
+            age = rate_table_age(base)
+            if age is None or age >= horizon:
+                due.append(base)
+        return due
+
+    def run_once(self) -> List[str]:
+        """One refresh cycle (blocking); returns the bases that were refreshed."""
+        from tools.currency_tool import refresh_rate_table
+
+        if not self._leases.claim('leader', self._owner, self._lease_s):
+            self.stats["skipped_not_leader"] += 1
+            return []
+        self.stats["cycles"] += 1
+        refreshed = []
+        for base in self.due():
+            if not self.budget.try_acquire():
+                self.stats["skipped_budget"] += 1
+                break
+            try:
+                # one budget token is one provider request
+                refresh_rate_table(base, retries=1)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning("Rate prefetch for %s failed, skipping the rest of this cycle: %s", base, e)
+                break
+            finally:
+                self.budget.release()
+            refreshed.append(base)
+            self.stats["refreshed"] += 1
+        if refreshed:
+            logger.info("Prefetched rate tables for %s", ", ".join(refreshed))
+        return refreshed
+
+    async def run(self):
+        while True:
+            try:
+                # provider calls are blocking (requests); keep them off the event loop
+                await asyncio.to_thread(self.run_once)
+            except Exception:
+                logger.exception("Rate prefetch cycle failed")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run(), name='rate-prefetch')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_prefetcher: Optional[RatePrefetcher] = None
+
+
+def start() -> RatePrefetcher:
+    """Start the app-wide prefetcher on the running event loop."""
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = RatePrefetcher()
+    _prefetcher.start()
+    return _prefetcher
+
+
+async def stop():
+    global _prefetcher
+    if _prefetcher is not None:
+        await _prefetcher.stop()
+        _prefetcher = None
+
+
+def stats() -> dict:
+    """Prefetcher counters, current hot bases and rate-table cache hit rate."""
+    from tools.currency_tool import _rate_tables
+
+    lookups = _rate_tables.hits + _rate_tables.misses
+    return {
+        "running": _prefetcher is not None,
+        **(_prefetcher.stats if _prefetcher is not None else {}),
+        "hot_bases": tracker.counts(),
+        "table_hits": _rate_tables.hits,
+        "table_misses": _rate_tables.misses,
+        "table_hit_rate": _rate_tables.hits / lookups if lookups else None,
+    }
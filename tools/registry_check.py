@@ -1,30 +1,65 @@
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 from config import settings
+from utils import deadline
+from utils.cache import make_cache
+from tools.registry_snapshot import get_snapshot, is_fresh, normalize_name, RegistryMatch
 
-def verify_company_registry(company_name: str) -> dict:
-    """
-    Queries an external registry (simulated) to verify a company's status and details.
+logger = logging.getLogger(__name__)
 
-    Args:
-        company_name: The name of the company to check.
+# Recent results keyed by normalized company name
+_cache = make_cache('registry', maxsize=settings.REGISTRY_CACHE_SIZE, ttl=settings.REGISTRY_CACHE_TTL_S)
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
 
-    Returns:
-        A dictionary of the company's verified details.
-    """
-    logger = logging.getLogger(__name__)
-    logger.info("Checking registry for: %s", company_name)
-    
-    # Prefer calling an API when REGISTRY_API_URL is configured
+
+def _get_session() -> requests.Session:
+    """Shared keep-alive session; its pool is sized for REGISTRY_BULK_CONCURRENCY parallel requests."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.REGISTRY_BULK_CONCURRENCY)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _from_snapshot(match: RegistryMatch) -> dict:
+    return {**match.record, "match_score": round(match.score, 3), "matched_from": "snapshot"}
+
+
+def _lookup(company_name: str) -> Tuple[dict, bool]:
+    """Resolve one company; returns (result, cacheable). Fallbacks after an API failure are not cached."""
+    # A confident match in a fresh local snapshot answers without any network call
+    snapshot = get_snapshot()
+    match = snapshot.best_match(company_name) if snapshot is not None else None
+    if match is not None and (is_fresh(snapshot) or not settings.REGISTRY_API_URL):
+        return _from_snapshot(match), True
+
+    # Snapshot miss or stale snapshot: ask the API when REGISTRY_API_URL is configured
     if settings.REGISTRY_API_URL:
         try:
-            resp = requests.get(f"{settings.REGISTRY_API_URL}/search", params={"q": company_name}, timeout=5)
+            resp = _get_session().get(f"{settings.REGISTRY_API_URL}/search", params={"q": company_name}, timeout=deadline.timeout_for(5))
             resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException:
+            return resp.json(), True
+        except (requests.RequestException, deadline.DeadlineExceeded):
             logger.exception("Failed to reach registry API at %s", settings.REGISTRY_API_URL)
-            # fall back to simulation
+            # fall back to the (stale) snapshot match or the simulation
+            if match is not None:
+                return _from_snapshot(match), False
+            return _simulated(company_name), False
+
+    return _simulated(company_name), True
+
 
+def _simulated(company_name: str) -> dict:
     # In a real app, this fallback is a simulation
     if "Tesla" in company_name:
         return {
@@ -35,4 +70,73 @@ def verify_company_registry(company_name: str) -> dict:
             "date_founded": "2003-07-01"
         }
     else:
-        return {"name": company_name, "status": "Not Found", "details": None}
\ No newline at end of file
+        return {"name": company_name, "status": "Not Found", "details": None}
+
+
+def verify_company_registry(company_name: str) -> dict:
+    """
+    Queries an external registry (simulated) to verify a company's status and details.
+
+    Args:
+        company_name: The name of the company to check.
+
+    Returns:
+        A dictionary of the company's verified details.
+    """
+    logger.info("Checking registry for: %s", company_name)
+    key = normalize_name(company_name) or company_name
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    result, cacheable = _lookup(company_name)
+    if cacheable:
+        _cache.set(key, result)
+    return result
+
+
+def iter_verify_companies(company_names: Iterable[str], max_workers: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    """Verify many companies, yielding (name, result) as results arrive.
+
+    Names that normalize to the same company are looked up once; cached results are
+    yielded first, and misses fan out over at most ``REGISTRY_BULK_CONCURRENCY``
+    threads sharing the pooled session.
+    """
+    pending: Dict[str, List[str]] = {}
+    for name in company_names:
+        key = normalize_name(name) or name
+        if key in pending:
+            pending[key].append(name)
+            continue
+        cached = _cache.get(key)
+        if cached is not None:
+            yield name, cached
+            continue
+        pending[key] = [name]
+    if not pending:
+        return
+
+    workers = min(max_workers or settings.REGISTRY_BULK_CONCURRENCY, len(pending))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='registry') as pool:
+        futures = {pool.submit(deadline.run_in_context(verify_company_registry, names[0])): names
+                   for names in pending.values()}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception("Registry lookup failed for %s", futures[future][0])
+                result = {"name": futures[future][0], "status": "Error", "error": str(e)}
+            for name in futures[future]:
+                yield name, result
+
+
+def verify_companies(company_names: List[str]) -> dict:
+    """
+    Verifies a list of companies (e.g. portfolio counterparties) in the registry.
+
+    Args:
+        company_names: Company names to check; duplicates are looked up once.
+
+    Returns:
+        A dictionary mapping each company name to its verified details.
+    """
+    return dict(iter_verify_companies(company_names))
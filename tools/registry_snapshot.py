@@ -0,0 +1,173 @@
+# Local company-registry snapshot with exact and fuzzy name lookup
+"""In-process index over a registry export (CSV or Parquet) for ``verify_company_registry``.
+
+Names are normalized (case, punctuation, '&', legal suffixes such as "Inc." or
+"Ltd") so "Tesla, Inc." and "TESLA INC" hit the exact index. Other spellings go
+through a character-trigram inverted index: candidates are gathered from the
+postings of the query's trigrams (skipping very common ones) and ranked by Dice
+similarity. Exact lookups take a few microseconds; fuzzy ones take around a
+millisecond on a snapshot of 200k companies.
+
+Expected columns: ``name`` (or ``company_name``), ``cik``, ``status``; any other
+columns (country, date_founded, ...) are returned with the record.
+"""
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import settings
+from utils.lazy import optional_import
+
+logger = logging.getLogger(__name__)
+
+LEGAL_SUFFIXES = frozenset({
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited', 'llc', 'plc',
+    'lp', 'llp', 'sa', 'ag', 'gmbh', 'nv', 'bv', 'spa', 'srl', 'pty', 'pte', 'oyj', 'ab', 'as', 'kk',
+})
+# Candidates taken from trigram postings before exact Dice scoring
+_MAX_CANDIDATES = 50
+# Trigrams in more than this share of names (and more than _MIN_STOP_DF names) are not scanned
+_STOP_DF_RATIO = 0.01
+_MIN_STOP_DF = 1000
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, '&' -> 'and', drop punctuation, a leading 'the' and trailing legal suffixes."""
+    text = name.lower().replace('&', ' and ')
+    words = re.sub(r"[^\w\s]", " ", text).split()
+    if len(words) > 1 and words[0] == 'the':
+        words = words[1:]
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def trigrams(normalized: str) -> set:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RegistryMatch:
+    def __init__(self, record: dict, score: float):
+        self.record = record
+        self.score = score
+
+    def __repr__(self) -> str:
+        return f"RegistryMatch({self.record.get('name')!r}, score={self.score:.3f})"
+
+
+class RegistrySnapshot:
+    """Registry records indexed by normalized name, CIK and name trigrams."""
+
+    def __init__(self, records: List[dict], as_of: Optional[float] = None):
+        self.records = records
+        # Unix time the data was exported (file mtime for loaded snapshots)
+        self.as_of = as_of if as_of is not None else time.time()
+        self._exact: Dict[str, List[int]] = {}
+        self._by_cik: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        self._normalized: List[str] = []
+        for idx, record in enumerate(records):
+            norm = normalize_name(record.get('name') or '')
+            self._normalized.append(norm)
+            self._exact.setdefault(norm, []).append(idx)
+            if record.get('cik'):
+                self._by_cik[str(record['cik']).lstrip('0')] = idx
+            for gram in trigrams(norm):
+                self._postings.setdefault(gram, []).append(idx)
+        self._stop_df = max(_MIN_STOP_DF, int(len(records) * _STOP_DF_RATIO))
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def by_cik(self, cik: str) -> Optional[dict]:
+        idx = self._by_cik.get(str(cik).lstrip('0'))
+        return self.records[idx] if idx is not None else None
+
+    def lookup(self, name: str, limit: int = 5, min_score: float = 0.0) -> List[RegistryMatch]:
+        """Best matches for ``name``, highest score first (1.0 for an exact normalized match)."""
+        norm = normalize_name(name)
+        if not norm:
+            return []
+        exact = self._exact.get(norm)
+        if exact:
+            return [RegistryMatch(self.records[i], 1.0) for i in exact[:limit]]
+
+        grams = trigrams(norm)
+        # Very common trigrams ("  s", "ng ") add little but dominate scan time; skip their
+        # postings unless nothing rarer is shared
+        postings = [self._postings[g] for g in grams if g in self._postings]
+        rare = [p for p in postings if len(p) <= self._stop_df] or postings
+        hits: Counter = Counter()
+        for posting in rare:
+            hits.update(posting)
+        matches = []
+        for idx, _ in hits.most_common(_MAX_CANDIDATES):
+            other = trigrams(self._normalized[idx])
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score >= min_score:
+                matches.append(RegistryMatch(self.records[idx], score))
+        matches.sort(key=lambda m: m.score, reverse=True)
+        return matches[:limit]
+
+    def best_match(self, name: str, min_score: Optional[float] = None) -> Optional[RegistryMatch]:
+        threshold = settings.REGISTRY_MATCH_MIN_SCORE if min_score is None else min_score
+        matches = self.lookup(name, limit=1, min_score=threshold)
+        return matches[0] if matches else None
+
+
+def _clean(record: dict) -> dict:
+    out = {str(k).strip().lower(): (v.strip() if isinstance(v, str) else v) for k, v in record.items()}
+    if 'name' not in out and 'company_name' in out:
+        out['name'] = out.pop('company_name')
+    # empty CSV cells / NaN from Parquet carry no information
+    return {k: v for k, v in out.items() if v not in ('', None) and v == v}
+
+
+def load_snapshot(path: str) -> RegistrySnapshot:
+    """Load a CSV or Parquet registry export (Parquet needs pandas with pyarrow/fastparquet)."""
+    if path.lower().endswith('.parquet'):
+        pandas = optional_import('pandas')
+        if pandas is None:
+            raise ImportError("pandas is required to load Parquet registry snapshots")
+        rows = pandas.read_parquet(path).to_dict('records')
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+    records = [r for r in (_clean(row) for row in rows) if r.get('name')]
+    logger.info("Loaded registry snapshot %s with %d companies", path, len(records))
+    return RegistrySnapshot(records, as_of=os.path.getmtime(path))
+
+
+_snapshot: Optional[RegistrySnapshot] = None
+_snapshot_key: Optional[tuple] = None
+_lock = threading.Lock()
+
+
+def get_snapshot() -> Optional[RegistrySnapshot]:
+    """The snapshot at REGISTRY_SNAPSHOT_PATH, loaded once and reloaded when the file changes."""
+    global _snapshot, _snapshot_key
+    path = settings.REGISTRY_SNAPSHOT_PATH
+    if not path:
+        return None
+    try:
+        key = (path, os.path.getmtime(path))
+    except OSError:
+        logger.warning("Registry snapshot %s not found", path)
+        return None
+    if key != _snapshot_key:
+        with _lock:
+            if key != _snapshot_key:
+                _snapshot = load_snapshot(path)
+                _snapshot_key = key
+    return _snapshot
+
+
+def is_fresh(snapshot: RegistrySnapshot) -> bool:
+    """True while the snapshot is younger than REGISTRY_SNAPSHOT_MAX_AGE_DAYS."""
+    return time.time() - snapshot.as_of <= settings.REGISTRY_SNAPSHOT_MAX_AGE_DAYS * 86400
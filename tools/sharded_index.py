@@ -0,0 +1,270 @@
+# Sharded vector index: scatter-gather search over worker processes
+"""Partition the embedding index across worker processes so a search uses every core.
+
+``ShardedVectorIndex`` has the same interface as ``tools.vector_index.VectorIndex``.
+Each of its ``shards`` worker processes owns one ``VectorIndex``. A chunk is routed
+to a shard by a stable hash of its id, or of its company when one is given, so a
+company's filings stay together.
+
+A search writes the query embeddings once into a shared-memory block that every
+worker maps, so the queries are never pickled. Each shard is sent a small command,
+scans its partition in parallel with the others, and returns its local top-k.
+The coordinator merges the shard lists with a heap. ``search_many`` sends a batch
+of queries in one round trip.
+"""
+import argparse
+import heapq
+import multiprocessing
+import threading
+import time
+import weakref
+import zlib
+from itertools import islice
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tools.vector_index import VectorIndex, _synthetic_vectors
+
+
+def _shard_worker(conn, directory: str, options: dict):
+    """Serve one shard: commands arrive on ``conn``, query vectors in a shared-memory block."""
+    index = VectorIndex(directory, **options)
+    blocks: Dict[str, shared_memory.SharedMemory] = {}
+    try:
+        while True:
+            command, *args = conn.recv()
+            if command == 'stop':
+                return
+            try:
+                if command == 'add':
+                    ids, vectors = args
+                    index.add(ids, vectors)
+                    reply = None
+                elif command == 'remove':
+                    index.remove(args[0])
+                    reply = None
+                elif command == 'search':
+                    block_name, count, dim, k, exclude = args
+                    if block_name not in blocks:
+                        for old in blocks.values():
+                            old.close()
+                        blocks = {block_name: shared_memory.SharedMemory(name=block_name)}
+                    queries = np.ndarray((count, dim), dtype=np.float32, buffer=blocks[block_name].buf)
+                    reply = [index.search(q, k, exclude) for q in queries]
+                    del queries
+                else:
+                    raise ValueError(f"unknown shard command {command!r}")
+                conn.send(('ok', reply))
+            except Exception as e:
+                conn.send(('error', e))
+    finally:
+        for block in blocks.values():
+            block.close()
+        index.close()
+        conn.close()
+
+
+def shard_for(key: str, shards: int) -> int:
+    # crc32, not hash(): the routing must agree across processes and restarts
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+class ShardedVectorIndex:
+    """``VectorIndex`` partitioned over ``shards`` worker processes (started on first use)."""
+
+    def __init__(self, directory: str, shards: int, quantization: str = 'int8', rescore: int = 50,
+                 pq_subvectors: int = 16, pq_train_size: int = 10000):
+        self.directory = directory
+        self.shards = shards
+        # each shard trains its own PQ codebooks on its share of the corpus
+        self.options = {'quantization': quantization, 'rescore': rescore, 'pq_subvectors': pq_subvectors,
+                        'pq_train_size': max(1, pq_train_size // shards)}
+        self._shard_of: Dict[str, int] = {}
+        self._conns: List = []
+        self._processes: List = []
+        # one-element holder for the query block, shared with the finalizer so it is unlinked on exit
+        self._block: List[Optional[shared_memory.SharedMemory]] = [None]
+        self._lock = threading.Lock()
+        self._finalizer = None
+
+    def __len__(self) -> int:
+        return len(self._shard_of)
+
+    def __contains__(self, chunk_id) -> bool:
+        return chunk_id in self._shard_of
+
+    def _start(self):
+        if self._conns:
+            return
+        ctx = multiprocessing.get_context('spawn')
+        for _ in range(self.shards):
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_shard_worker, args=(child, self.directory, self.options), daemon=True)
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        self._finalizer = weakref.finalize(self, ShardedVectorIndex._shutdown, self._conns, self._processes, self._block)
+
+    @staticmethod
+    def _shutdown(conns, processes, block_holder):
+        for conn in conns:
+            try:
+                conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in conns:
+            conn.close()
+        if block_holder[0] is not None:
+            block_holder[0].close()
+            block_holder[0].unlink()
+
+    def close(self):
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer.detach()
+                self._shutdown(self._conns, self._processes, self._block)
+            self._conns, self._processes, self._block, self._finalizer = [], [], [None], None
+
+    def _gather(self, shards: Sequence[int]) -> list:
+        # read every shard's reply before raising, or the next command would receive a stale one
+        replies, error = [], None
+        for shard in shards:
+            status, reply = self._conns[shard].recv()
+            if status == 'error':
+                error = error or reply
+            replies.append(reply)
+        if error is not None:
+            raise error
+        return replies
+
+    def add(self, ids: Iterable[str], vectors, shard_keys: Optional[Sequence[Optional[str]]] = None) -> None:
+        """Add (or replace) embeddings; ``shard_keys`` (e.g. company ids) override routing by id."""
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        keys = shard_keys if shard_keys is not None else [None] * len(ids)
+        targets = [shard_for(key or chunk_id, self.shards) for chunk_id, key in zip(ids, keys)]
+        with self._lock:
+            self._start()
+            # a chunk whose routing key changed is dropped from its old shard
+            moved: Dict[int, List[str]] = {}
+            for chunk_id, shard in zip(ids, targets):
+                old = self._shard_of.get(chunk_id)
+                if old is not None and old != shard:
+                    moved.setdefault(old, []).append(chunk_id)
+            for shard, moved_ids in moved.items():
+                self._conns[shard].send(('remove', moved_ids))
+            self._gather(list(moved))
+            by_shard: Dict[int, List[int]] = {}
+            for row, shard in enumerate(targets):
+                by_shard.setdefault(shard, []).append(row)
+            for shard, rows in by_shard.items():
+                self._conns[shard].send(('add', [ids[r] for r in rows], vectors[rows]))
+            self._gather(list(by_shard))
+            for chunk_id, shard in zip(ids, targets):
+                self._shard_of[chunk_id] = shard
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            by_shard: Dict[int, List[str]] = {}
+            for chunk_id in ids:
+                shard = self._shard_of.pop(chunk_id, None)
+                if shard is not None:
+                    by_shard.setdefault(shard, []).append(chunk_id)
+            if not by_shard:
+                return
+            for shard, shard_ids in by_shard.items():
+                self._conns[shard].send(('remove', shard_ids))
+            self._gather(list(by_shard))
+
+    def _write_queries(self, queries: np.ndarray) -> str:
+        block = self._block[0]
+        if block is None or block.size < queries.nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = self._block[0] = shared_memory.SharedMemory(create=True, size=max(queries.nbytes, 1 << 16))
+        view = np.ndarray(queries.shape, dtype=np.float32, buffer=block.buf)
+        view[:] = queries
+        del view  # release the export so the block can be closed later
+        return block.name
+
+    def search_many(self, queries, k: int, exclude: Iterable[str] = ()) -> List[List[Tuple[str, float]]]:
+        """Top ``k`` (chunk_id, similarity) per query, fanned out to every shard at once."""
+        queries = np.ascontiguousarray(np.asarray(queries, dtype=np.float32).reshape(len(queries), -1))
+        if not self._shard_of or not len(queries):
+            return [[] for _ in range(len(queries))]
+        # exclusions only matter on the shard that holds them
+        excluded: Dict[int, List[str]] = {}
+        for chunk_id in exclude:
+            shard = self._shard_of.get(chunk_id)
+            if shard is not None:
+                excluded.setdefault(shard, []).append(chunk_id)
+        with self._lock:
+            name = self._write_queries(queries)
+            for shard, conn in enumerate(self._conns):
+                conn.send(('search', name, len(queries), queries.shape[1], k, excluded.get(shard, [])))
+            per_shard = self._gather(range(self.shards))
+        # every shard list is sorted best first, so a k-step heap merge yields the global top k
+        return [list(islice(heapq.merge(*(hits[i] for hits in per_shard), key=lambda h: -h[1]), k))
+                for i in range(len(queries))]
+
+    def search(self, query, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        return self.search_many(np.asarray(query, dtype=np.float32).reshape(1, -1), k, exclude)[0]
+
+
+def benchmark(n: int = 100000, dim: int = 384, queries: int = 64, k: int = 10, shards: Sequence[int] = (1, 2, 4),
+              oversubscribe: bool = False) -> dict:
+    """Batched-query throughput and single-query latency for each shard count (int8 codes).
+
+    Shard counts above the number of cores only measure process contention; they
+    are skipped unless ``oversubscribe`` is set, and then marked in the report.
+    """
+    import tempfile
+
+    vectors = _synthetic_vectors(n, dim, seed=0)
+    query_vectors = _synthetic_vectors(queries, dim, seed=1)
+    ids = [str(i) for i in range(n)]
+    cpus = multiprocessing.cpu_count()
+    report = {"vectors": n, "dim": dim, "cpus": cpus}
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in shards:
+            if count > cpus:
+                report[f"shards_{count}"] = "oversubscribed" if oversubscribe else "skipped (more shards than cores)"
+                if not oversubscribe:
+                    continue
+            index = ShardedVectorIndex(tmp, count)
+            index.add(ids, vectors)
+            index.search(query_vectors[0], k)  # warm up
+            begin = time.perf_counter()
+            index.search_many(query_vectors, k)
+            report[f"shards_{count}_qps"] = queries / (time.perf_counter() - begin)
+            begin = time.perf_counter()
+            for q in query_vectors[:16]:
+                index.search(q, k)
+            report[f"shards_{count}_latency_ms"] = (time.perf_counter() - begin) / 16 * 1e3
+            index.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sharded vector index')
+    parser.add_argument('--benchmark', action='store_true', help='Throughput and latency for 1, 2 and 4 shards')
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--oversubscribe', action='store_true', help='Also run shard counts above the core count')
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark(args.vectors, oversubscribe=args.oversubscribe).items():
+            print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# Quantized vector index for the in-memory retriever
+"""Nearest-neighbour search over chunk embeddings with quantized codes in RAM.
+
+Vectors are unit-normalized, so the inner product is the cosine similarity. Each
+vector is kept two ways:
+
+* a compact code in RAM, used for the first pass:
+    * ``int8``: one byte per dimension plus a per-vector scale, about 4x smaller than float32.
+    * ``pq`` (product quantization): one byte per sub-vector. Codebooks are trained
+      with k-means once ``pq_train_size`` vectors exist. Until then, search is exact.
+* the float32 vector, appended to a file in ``directory`` and read through ``np.memmap``
+  only to re-score the ``rescore`` best first-pass candidates.
+
+Replacing or removing a vector only marks its row dead. Once more than half of the
+rows are dead, ``compact()`` rewrites the file and the codes with the live rows, so
+incremental re-ingestion does not grow the index without bound.
+
+``benchmark()`` (``python -m tools.vector_index --benchmark``) reports recall@k and
+latency for each mode against exact float32 search.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+import weakref
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SEARCH_BLOCK = 8192  # rows scored per block: the dequantized block stays cache-sized
+_COMPACT_DEAD_FRACTION = 0.5  # compact once this share of the rows are removed or replaced
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 codes and scales (``vectors ~= codes * scales[:, None]``)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        # ||x||^2 is the same for every centroid, so it does not change the argmin
+        assignment = ((centroids ** 2).sum(1)[None, :] - 2 * data @ centroids.T).argmin(axis=1)
+        sums = np.stack([np.bincount(assignment, weights=column, minlength=k) for column in data.T], axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class ProductQuantizer:
+    """Splits vectors into ``subvectors`` slices and encodes each slice as its nearest centroid id."""
+
+    def __init__(self, dim: int, subvectors: int, centroids: int = 256):
+        if dim % subvectors:
+            raise ValueError(f"dimension {dim} is not divisible into {subvectors} sub-vectors")
+        self.dim, self.subvectors, self.centroids = dim, subvectors, min(centroids, 256)
+        self.sub_dim = dim // subvectors
+        self.codebooks: Optional[np.ndarray] = None  # (subvectors, centroids, sub_dim)
+
+    def train(self, sample: np.ndarray, iterations: int = 10, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        k = min(self.centroids, len(sample))
+        self.codebooks = np.stack([
+            _kmeans(sample[:, m * self.sub_dim:(m + 1) * self.sub_dim], k, iterations, rng)
+            for m in range(self.subvectors)]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for m, codebook in enumerate(self.codebooks):
+            part = vectors[:, m * self.sub_dim:(m + 1) * self.sub_dim]
+            distances = -2 * part @ codebook.T + (codebook ** 2).sum(1)[None, :]
+            codes[:, m] = distances.argmin(axis=1)
+        return codes
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate inner products (asymmetric distance: exact query, quantized database)."""
+        table = np.einsum('mkd,md->mk', self.codebooks, query.reshape(self.subvectors, self.sub_dim))
+        return table[np.arange(self.subvectors), codes].sum(axis=1)
+
+
+class VectorIndex:
+    """Embeddings keyed by chunk id, with ``add``/``remove`` and two-pass ``search``."""
+
+    def __init__(self, directory: str, quantization: str = 'int8', rescore: int = 50,
+                 pq_subvectors: int = 16, pq_train_size: int = 10000):
+        if quantization not in ('none', 'int8', 'pq'):
+            raise ValueError(f"unknown quantization {quantization!r}")
+        self.quantization = quantization
+        self.rescore = rescore
+        self.pq_subvectors = pq_subvectors
+        self.pq_train_size = pq_train_size
+        self.dim: Optional[int] = None
+        self.directory = directory
+        self.pq: Optional[ProductQuantizer] = None
+        self._ids: List[Optional[str]] = []  # None marks a removed row
+        self._rows: Dict[str, int] = {}
+        self._dead = np.zeros(0, dtype=bool)
+        self._dead_count = 0
+        self._codes: Optional[np.ndarray] = None  # int8 codes or PQ codes, grown by doubling
+        self._scales = np.empty(0, dtype=np.float32)
+        # full-precision vectors: this process's own append-only file, removed with the index
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='vectors-', suffix='.f32', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._finalizer = weakref.finalize(self, VectorIndex._cleanup, self._file, self.path)
+        self._memmap: Optional[np.memmap] = None
+
+    @staticmethod
+    def _cleanup(file, path):
+        file.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        self._memmap = None
+        self._finalizer()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, chunk_id) -> bool:
+        return chunk_id in self._rows
+
+    def nbytes(self) -> int:
+        """RAM held by the first-pass codes (the float vectors stay on disk)."""
+        codes = self._codes.nbytes if self._codes is not None else 0
+        return codes + self._scales.nbytes
+
+    def _full(self) -> np.ndarray:
+        rows = len(self._ids)
+        if self._memmap is None or len(self._memmap) != rows:
+            self._file.flush()
+            self._memmap = np.memmap(self.path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else None
+        return self._memmap
+
+    def _store_codes(self, start: int, vectors: np.ndarray):
+        if self.quantization == 'int8':
+            codes, scales = quantize_int8(vectors)
+        elif self.pq is not None:
+            codes, scales = self.pq.encode(vectors), None
+        else:
+            return
+        end = start + len(vectors)
+        if self._codes is None or end > len(self._codes):
+            capacity = max(end, 2 * (len(self._codes) if self._codes is not None else 0), 1024)
+            grown = np.zeros((capacity, codes.shape[1]), dtype=codes.dtype)
+            if self._codes is not None:
+                grown[:start] = self._codes[:start]
+            self._codes = grown
+            if scales is not None:
+                self._scales = np.concatenate([self._scales[:start], np.ones(capacity - start, dtype=np.float32)])
+        self._codes[start:end] = codes
+        if scales is not None:
+            self._scales[start:end] = scales
+
+    def add(self, ids: Iterable[str], vectors) -> None:
+        """Add (or replace) the embeddings of ``ids``."""
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if self.dim is None:
+            if self.quantization == 'pq' and vectors.shape[1] % self.pq_subvectors:
+                # fail before anything is stored rather than quietly indexing with another mode
+                raise ValueError(f"cannot product-quantize {vectors.shape[1]}-dim vectors into "
+                                 f"{self.pq_subvectors} sub-vectors (RAG_VECTOR_PQ_SUBVECTORS must divide it)")
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"embedding dimension {vectors.shape[1]} does not match the index ({self.dim})")
+        self.remove(ids)
+        start = len(self._ids)
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(vectors.tobytes())
+        for offset, chunk_id in enumerate(ids):
+            self._rows[chunk_id] = start + offset
+        self._ids.extend(ids)
+        self._dead = np.concatenate([self._dead, np.zeros(len(ids), dtype=bool)])
+        self._store_codes(start, vectors)
+        if self.quantization == 'pq' and self.pq is None and len(self._ids) >= self.pq_train_size:
+            self._train_pq()
+
+    def _train_pq(self):
+        pq = ProductQuantizer(self.dim, self.pq_subvectors)
+        full = self._full()
+        rng = np.random.default_rng(0)
+        # ~40 points per centroid is plenty for k-means on these low-dimensional slices
+        sample = full[np.sort(rng.choice(len(full), size=min(len(full), 40 * pq.centroids), replace=False))]
+        pq.train(np.asarray(sample))
+        self.pq = pq
+        self._codes = None
+        for start in range(0, len(full), _SEARCH_BLOCK):
+            self._store_codes(start, np.asarray(full[start:start + _SEARCH_BLOCK]))
+
+    def remove(self, ids: Iterable[str]) -> None:
+        for chunk_id in ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._dead[row] = True
+                self._dead_count += 1
+        if self._dead_count > _COMPACT_DEAD_FRACTION * len(self._ids):
+            self.compact()
+
+    def compact(self) -> None:
+        """Drop dead rows: rewrite the float file and the codes with the live rows only."""
+        live = np.flatnonzero(~self._dead)
+        full = self._full()
+        fd, path = tempfile.mkstemp(prefix='vectors-', suffix='.f32', dir=self.directory)
+        file = os.fdopen(fd, 'w+b')
+        for start in range(0, len(live), _SEARCH_BLOCK):
+            file.write(np.ascontiguousarray(full[live[start:start + _SEARCH_BLOCK]]).tobytes())
+        file.flush()
+        del full
+        self._memmap = None
+        self._finalizer()
+        self.path, self._file = path, file
+        self._finalizer = weakref.finalize(self, VectorIndex._cleanup, file, path)
+        if self._codes is not None:
+            self._codes = self._codes[live]
+        if len(self._scales):
+            self._scales = self._scales[live]
+        self._ids = [self._ids[row] for row in live]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._dead = np.zeros(len(live), dtype=bool)
+        self._dead_count = 0
+
+    def _approx_scores(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        if self.quantization == 'int8':
+            return (self._codes[start:end].astype(np.float32) @ query) * self._scales[start:end]
+        if self.pq is not None:
+            return self.pq.scores(query, self._codes[start:end])
+        return np.asarray(self._full()[start:end]) @ query
+
+    def search(self, query, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """Top ``k`` (chunk_id, cosine similarity), best first, skipping ``exclude`` ids."""
+        if not self._rows or k <= 0:
+            return []
+        query = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"query dimension {query.shape[0]} does not match the index ({self.dim})")
+        rows = len(self._ids)
+        dead = self._dead
+        excluded = [self._rows[chunk_id] for chunk_id in exclude if chunk_id in self._rows]
+        if excluded:
+            dead = dead.copy()
+            dead[excluded] = True
+        wanted = min(max(k, self.rescore), rows)
+        block_rows, block_scores = [], []
+        for start in range(0, rows, _SEARCH_BLOCK):
+            end = min(rows, start + _SEARCH_BLOCK)
+            scores = self._approx_scores(query, start, end)
+            scores[dead[start:end]] = -np.inf
+            # each block's best `wanted` rows are enough to contain the overall best `wanted`
+            keep = np.argpartition(-scores, wanted - 1)[:wanted] if end - start > wanted else np.arange(end - start)
+            block_rows.append(keep + start)
+            block_scores.append(scores[keep])
+        best_rows, best_scores = np.concatenate(block_rows), np.concatenate(block_scores)
+        if len(best_scores) > wanted:
+            keep = np.argpartition(-best_scores, wanted - 1)[:wanted]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+        candidates = np.sort(best_rows[np.isfinite(best_scores)])
+        if not len(candidates):
+            return []
+        # second pass: exact scores from the full-precision vectors on disk
+        exact = np.asarray(self._full()[candidates]) @ query
+        order = np.argsort(-exact, kind='stable')[:k]
+        return [(self._ids[candidates[i]], float(exact[i])) for i in order]
+
+
+def _synthetic_vectors(n: int, dim: int, seed: int) -> np.ndarray:
+    # clustered data, closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 100), dim))
+    return (centers[rng.integers(len(centers), size=n)] + 0.35 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def benchmark(n: int = 50000, dim: int = 384, queries: int = 200, k: int = 10) -> dict:
+    """Recall@k, latency and RAM per vector of each quantization mode vs exact float32 search."""
+    vectors = _synthetic_vectors(n, dim, seed=0)
+    query_vectors = _synthetic_vectors(queries, dim, seed=1)
+    unit = _normalize(vectors)
+    report = {"vectors": n, "dim": dim, "k": k, "float32_bytes_per_vector": 4 * dim}
+
+    begin = time.perf_counter()
+    truth = [set(np.argsort(-(unit @ q))[:k].tolist()) for q in _normalize(query_vectors)]
+    report["exact_ms"] = (time.perf_counter() - begin) / queries * 1e3
+
+    ids = [str(i) for i in range(n)]
+    # about 8 dimensions per sub-vector; the count must divide dim
+    subvectors = next(s for s in range(max(dim // 8, 1), 0, -1) if dim % s == 0)
+    report["pq_subvectors"] = subvectors
+    with tempfile.TemporaryDirectory() as tmp:
+        # PQ codes are much coarser, so they need a deeper candidate list for the same recall
+        for mode, rescore in (('int8', 5 * k), ('pq', 50 * k)):
+            index = VectorIndex(tmp, quantization=mode, rescore=rescore, pq_subvectors=subvectors, pq_train_size=n)
+            report[f"{mode}_rescore"] = rescore
+            index.add(ids, vectors)
+            begin = time.perf_counter()
+            results = [index.search(q, k) for q in query_vectors]
+            report[f"{mode}_ms"] = (time.perf_counter() - begin) / queries * 1e3
+            report[f"{mode}_recall"] = float(np.mean([
+                len(truth[i] & {int(chunk_id) for chunk_id, _ in hits}) / k for i, hits in enumerate(results)]))
+            report[f"{mode}_bytes_per_vector"] = index.nbytes() / len(index)
+            index.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantized vector index')
+    parser.add_argument('--benchmark', action='store_true', help='Recall and latency vs exact float32 search')
+    parser.add_argument('--vectors', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    args = parser.parse_args()
+    if args.benchmark:
+        for key, value in benchmark(args.vectors, args.dim).items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""Cache backends shared by rate tables, registry results, LLM responses and circuit breakers.
+
+``make_cache(namespace, maxsize, ttl)`` returns the backend selected by ``CACHE_BACKEND``:
+
+- ``memory``: a per-process ``TTLCache`` (LRU with per-entry TTL).
+- ``sqlite``: a ``TieredCache`` putting a short-lived ``TTLCache`` in front of a
+  ``SQLiteCache`` at ``CACHE_SQLITE_PATH``, which every worker process on the host
+  shares (WAL mode: readers never block the writer). One worker's fetch warms all
+  of them, so hit rates hold as workers are added.
+
+All backends offer ``get``/``set``/``delete``/``clear``/``peek`` and
+``get_or_compute``, which runs ``compute`` once per key even when many threads (or,
+for SQLite, many processes) miss at the same time. ``claim`` is a renewable lease
+that one owner at a time holds, e.g. to run a background job in a single worker.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from config import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after ``ttl`` seconds.
+
+    Usage:
+        cache = TTLCache(maxsize=1024, ttl=3600)
+        hit = cache.get('tesla')
+        if hit is None:
+            hit = cache.set('tesla', lookup('Tesla'))
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # per-key locks held while a get_or_compute miss is being computed
+        self._computing: Dict[Hashable, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Like ``get`` but leaves the LRU order and hit/miss counters alone (for background refreshers)."""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> Any:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # another thread may have computed it while we waited
+                value = self.peek(key, _MISSING)
+                if value is _MISSING:
+                    value = self.set(key, compute(), ttl)
+        finally:
+            with self._lock:
+                self._computing.pop(key, None)
+        return value
+
+    def claim(self, key: Hashable, owner: str, ttl: float) -> bool:
+        """Take or renew the lease ``key`` for ``owner``; False while another owner holds it."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now and entry[1] != owner:
+                return False
+            self._data[key] = (now + ttl, owner)
+            self._data.move_to_end(key)
+        return True
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Cache entries in a SQLite file shared by all processes on the host.
+
+    Values are pickled. Expired entries are purged and, past ``maxsize`` entries
+    in the namespace, the entries closest to expiry are evicted (checked every
+    ``_EVICT_EVERY`` writes). ``get_or_compute`` takes a per-key lease row so only
+    one process computes a missing value while the others wait for it.
+    """
+
+    _EVICT_EVERY = 64
+    _LEASE_S = 30.0
+    _POLL_S = 0.02
+
+    def __init__(self, path: str, namespace: str, maxsize: int = 10000, ttl: float = 300.0):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # one connection per thread and process (connections must not cross a fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (ns TEXT, key TEXT, value BLOB, expires REAL, "
+                         "PRIMARY KEY (ns, key)) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (ns, expires)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (ns TEXT, key TEXT, expires REAL, PRIMARY KEY (ns, key))")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _row(self, key: Hashable) -> Optional[tuple]:
+        row = self._conn().execute("SELECT value, expires FROM cache WHERE ns = ? AND key = ?",
+                                   (self.namespace, str(key))).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return row
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        row = self._row(key)
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        row = self._row(key)
+        return pickle.loads(row[0]) if row is not None else default
+
+    def remaining_ttl(self, key: Hashable) -> Optional[float]:
+        row = self._row(key)
+        return row[1] - time.time() if row is not None else None
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> Any:
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._conn().execute("INSERT OR REPLACE INTO cache (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                             (self.namespace, str(key), blob, expires))
+        self._writes += 1
+        if self._writes % self._EVICT_EVERY == 0:
+            self.evict()
+        return value
+
+    def evict(self):
+        """Purge expired entries and trim the namespace to ``maxsize`` (soonest to expire first)."""
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE ns = ? AND expires <= ?", (self.namespace, time.time()))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()
+        if count > self.maxsize:
+            conn.execute("DELETE FROM cache WHERE ns = ? AND key IN (SELECT key FROM cache WHERE ns = ? "
+                         "ORDER BY expires LIMIT ?)", (self.namespace, self.namespace, count - self.maxsize))
+
+    def _acquire_lease(self, key: str) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM leases WHERE ns = ? AND key = ? AND expires <= ?", (self.namespace, key, now))
+            acquired = conn.execute("INSERT OR IGNORE INTO leases (ns, key, expires) VALUES (?, ?, ?)",
+                                    (self.namespace, key, now + self._LEASE_S)).rowcount == 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def _release_lease(self, key: str):
+        self._conn().execute("DELETE FROM leases WHERE ns = ? AND key = ?", (self.namespace, key))
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        key = str(key)
+        give_up = time.monotonic() + self._LEASE_S
+        while True:
+            if self._acquire_lease(key):
+                try:
+                    value = self.peek(key, _MISSING)
+                    if value is _MISSING:
+                        value = self.set(key, compute(), ttl)
+                    return value
+                finally:
+                    self._release_lease(key)
+            # another process is computing this key: wait for its result
+            time.sleep(self._POLL_S)
+            value = self.peek(key, _MISSING)
+            if value is not _MISSING:
+                return value
+            if time.monotonic() > give_up:
+                return self.set(key, compute(), ttl)
+
+    def claim(self, key: Hashable, owner: str, ttl: float) -> bool:
+        """Take or renew the lease ``key`` for ``owner`` across processes; False while another owner holds it."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires FROM cache WHERE ns = ? AND key = ?",
+                               (self.namespace, str(key))).fetchone()
+            acquired = row is None or row[1] <= now or pickle.loads(row[0]) == owner
+            if acquired:
+                conn.execute("INSERT OR REPLACE INTO cache (ns, key, value, expires) VALUES (?, ?, ?, ?)",
+                             (self.namespace, str(key), pickle.dumps(owner), now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def delete(self, key: Hashable):
+        self._conn().execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, str(key)))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache WHERE ns = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM cache WHERE ns = ? AND expires > ?",
+                                    (self.namespace, time.time())).fetchone()[0]
+
+
+class TieredCache:
+    """An in-process ``TTLCache`` in front of a shared ``SQLiteCache``.
+
+    Reads try the local tier first; shared hits are copied into it for at most the
+    local TTL, so a value updated by another worker is picked up within that time.
+    """
+
+    def __init__(self, local: TTLCache, shared: SQLiteCache):
+        self.local = local
+        self.shared = shared
+
+    @property
+    def hits(self) -> int:
+        return self.local.hits + self.shared.hits
+
+    @property
+    def misses(self) -> int:
+        return self.shared.misses
+
+    def _fill_local(self, key: Hashable, value: Any):
+        remaining = self.shared.remaining_ttl(key)
+        self.local.set(key, value, min(self.local.ttl, remaining) if remaining is not None else None)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.local.peek(key, _MISSING)
+        if value is not _MISSING:
+            self.local.hits += 1
+            return value
+        value = self.shared.get(key, _MISSING)
+        if value is _MISSING:
+            return default
+        self._fill_local(key, value)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        # the shared tier is authoritative: another worker may have refreshed the entry
+        value = self.shared.peek(key, _MISSING)
+        return value if value is not _MISSING else self.local.peek(key, default)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> Any:
+        self.shared.set(key, value, ttl)
+        self.local.set(key, value, min(self.local.ttl, ttl) if ttl is not None else None)
+        return value
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = self.shared.get_or_compute(key, compute, ttl)
+        self._fill_local(key, value)
+        return value
+
+    def claim(self, key: Hashable, owner: str, ttl: float) -> bool:
+        # leases are only meaningful in the shared tier
+        return self.shared.claim(key, owner, ttl)
+
+    def delete(self, key: Hashable):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def __len__(self) -> int:
+        return len(self.shared)
+
+
+def make_cache(namespace: str, maxsize: int, ttl: float):
+    """Cache for one component (``namespace``) on the configured backend (CACHE_BACKEND)."""
+    if settings.CACHE_BACKEND == 'sqlite':
+        local = TTLCache(maxsize=maxsize, ttl=min(ttl, settings.CACHE_LOCAL_TTL_S))
+        return TieredCache(local, SQLiteCache(settings.CACHE_SQLITE_PATH, namespace, maxsize, ttl))
+    return TTLCache(maxsize=maxsize, ttl=ttl)
@@ -1,8 +1,16 @@
 import time
-from typing import Dict
+from typing import Optional
+
+from utils.cache import TTLCache
+
 
 class CircuitBreaker:
-    """Simple per-key in-memory circuit breaker.
+    """Simple per-key circuit breaker.
+
+    State lives in a cache backend (``utils.cache``): in-process by default, or a
+    ``make_cache(...)`` backend so all workers share it and stop calling a failing
+    dependency together. Failure counts are forgotten ``reset_timeout`` seconds after
+    the last failure.
 
     Usage:
         cb = CircuitBreaker(failure_threshold=3, reset_timeout=60)
@@ -16,10 +24,10 @@ class CircuitBreaker:
             raise
     """
 
-    def __init__(self, failure_threshold: int = 3, reset_timeout: int = 60):
+    def __init__(self, failure_threshold: int = 3, reset_timeout: int = 60, backend: Optional[object] = None):
         self.failure_threshold = failure_threshold
         self.reset_timeout = reset_timeout
-        self._state: Dict[str, Dict[str, float]] = {}
+        self._state = backend if backend is not None else TTLCache(maxsize=4096, ttl=reset_timeout)
 
     def is_open(self, key: str) -> bool:
         entry = self._state.get(key)
@@ -30,15 +38,15 @@ class CircuitBreaker:
         # check reset timeout
         if time.time() - entry['last_failure'] >= self.reset_timeout:
             # reset
-            self._state.pop(key, None)
+            self._state.delete(key)
             return False
         return True
 
     def record_failure(self, key: str):
         now = time.time()
-        entry = self._state.setdefault(key, {'failures': 0, 'last_failure': now})
-        entry['failures'] += 1
-        entry['last_failure'] = now
+        entry = self._state.get(key) or {'failures': 0, 'last_failure': now}
+        entry = {'failures': entry['failures'] + 1, 'last_failure': now}
+        self._state.set(key, entry, self.reset_timeout)
 
     def record_success(self, key: str):
-        self._state.pop(key, None)
+        self._state.delete(key)
@@ -0,0 +1,87 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the current request has no time budget left for more work."""
+
+
+# Absolute time.monotonic() value by which the current request must finish (None: unbounded)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('request_deadline', default=None)
+
+# Below this many seconds there is no point starting a network call
+MIN_CALL_BUDGET_S = 0.05
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Bound all work inside the block to ``seconds`` from now.
+
+    Nested scopes can only shorten the effective deadline. ``None`` leaves the
+    current deadline unchanged. Threads started inside the block inherit the
+    deadline only if they run in a copy of this context (see ``run_in_context``).
+    """
+    current = _deadline.get()
+    if seconds is None:
+        new = current
+    else:
+        new = time.monotonic() + max(0.0, seconds)
+        if current is not None:
+            new = min(new, current)
+    token = _deadline.set(new)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline, or None when no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0.0
+
+
+def check():
+    """Raise DeadlineExceeded when the budget is (nearly) exhausted."""
+    left = remaining()
+    if left is not None and left < MIN_CALL_BUDGET_S:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def timeout_for(own_timeout: float) -> float:
+    """Timeout for the next call: min(own timeout, remaining budget). Raises if nothing is left."""
+    check()
+    left = remaining()
+    return own_timeout if left is None else min(own_timeout, left)
+
+
+def can_wait(seconds: float) -> bool:
+    """True if sleeping ``seconds`` still leaves time for another call."""
+    left = remaining()
+    return left is None or left - seconds >= MIN_CALL_BUDGET_S
+
+
+def sleep(seconds: float) -> bool:
+    """Sleep for a backoff delay if the budget allows it; returns False (without sleeping) otherwise."""
+    if not can_wait(seconds):
+        return False
+    time.sleep(seconds)
+    return True
+
+
+def run_in_context(fn, *args, **kwargs):
+    """Bind ``fn`` to a copy of the current context so a worker thread sees the same deadline.
+
+    Usage: executor.submit(run_in_context(fn, arg))
+    """
+    ctx = contextvars.copy_context()
+    return lambda: ctx.run(fn, *args, **kwargs)
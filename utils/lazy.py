@@ -0,0 +1,51 @@
+import importlib
+import threading
+from typing import Any, Callable, Optional
+
+
+class LazyCallable:
+    """Callable proxy that imports ``module:attr`` on first call.
+
+    Keeps heavy tool modules (and the SDKs they pull in) out of process startup:
+        get_rate = LazyCallable('tools.currency_tool', 'get_exchange_rate')
+        get_rate('USD', 'EUR')  # imports tools.currency_tool here
+    """
+
+    def __init__(self, module: str, attr: str):
+        self.module = module
+        self.attr = attr
+        self._target: Optional[Callable] = None
+        self._lock = threading.Lock()
+
+    def resolve(self) -> Callable:
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = getattr(importlib.import_module(self.module), self.attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._target is not None else 'not loaded'
+        return f"<LazyCallable {self.module}.{self.attr} ({state})>"
+
+
+_MISSING = object()
+_optional_modules: dict = {}
+
+
+def optional_import(module: str) -> Any:
+    """Import an optional dependency on first use; returns None when it is not installed.
+
+    The outcome (module or None) is cached, so a missing package is only probed once.
+    """
+    mod = _optional_modules.get(module, _MISSING)
+    if mod is _MISSING:
+        try:
+            mod = importlib.import_module(module)
+        except Exception:
+            mod = None
+        _optional_modules[module] = mod
+    return mod